@@ -0,0 +1,269 @@
+import json
+import sys
+import threading
+import time
+from multiprocessing.pool import ThreadPool
+
+import ckan.model as model
+from ckan.lib.cli import CkanCommand
+from ckan.plugins import toolkit
+from ckanext.twitter.lib import (db, digest, helpers as twitter_helpers,
+                                 markers, parsers as twitter_parsers)
+
+
+def search_pages(context, rows = 100):
+    '''
+    Pages through the search index, yielding each page of packages as it is
+    needed rather than loading the whole catalogue first.
+    :param context: The current context.
+    :param rows: The number of packages per page.
+    :return: generator of (total number of packages, list of package dicts)
+    '''
+    start = 0
+    while True:
+        result = toolkit.get_action('package_search')(dict(context), {
+            'q': '*:*',
+            'sort': 'id asc',
+            'rows': rows,
+            'start': start
+            })
+        if not result['results']:
+            return
+        yield result['count'], result['results']
+        start += rows
+
+
+def show_pages(context, pkg_ids, rows = 100):
+    '''
+    Loads the given packages with package_show (so they can be given by ID
+    or name, and private and draft packages are found too) and splits them
+    into pages like search_pages().
+    :param context: The current context.
+    :param pkg_ids: The IDs or names of the packages.
+    :param rows: The number of packages per page.
+    :return: (list of (total number of packages, list of package dicts),
+    list of the IDs that weren't found)
+    '''
+    packages = []
+    missing = []
+    for pkg_id in pkg_ids:
+        try:
+            packages.append(toolkit.get_action('package_show')(dict(context), {
+                'id': pkg_id
+                }))
+        except toolkit.ObjectNotFound:
+            missing.append(pkg_id)
+    pages = [(len(packages), packages[i:i + rows]) for i in
+             range(0, len(packages), rows)]
+    return pages, missing
+
+
+def _generate_page(context, packages, is_new = None):
+    '''
+    Generates tweets for the suitable packages in one page of results.
+    :param context: The current context.
+    :param packages: A list of package dicts.
+    :param is_new: Whether to use the template for new packages, or None to
+    work it out for each package.
+    :return: list of (package dict, tweet text)
+    '''
+    try:
+        suitable = [pkg for pkg in packages if
+                    twitter_helpers.twitter_pkg_suitable(context, pkg['id'],
+                                                         pkg)]
+        if is_new is None:
+            new_packages = markers.is_new_many([pkg['id'] for pkg in suitable])
+        else:
+            new_packages = {pkg['id']: is_new for pkg in suitable}
+        tweets = twitter_parsers.generate_tweets(dict(context), suitable,
+                                                 new_packages)
+        return [(pkg, tweets[pkg['id']]) for pkg in suitable]
+    finally:
+        model.Session.remove()
+
+
+def generate_pages(context, pages, workers = 4, is_new = None):
+    '''
+    Generates tweets for pages of packages using a pool of worker threads.
+    Only a few pages more than there are workers are fetched ahead, so
+    memory use doesn't grow with the size of the catalogue.
+    :param context: The current context.
+    :param pages: An iterable of (total, list of package dicts), e.g. from
+    search_pages().
+    :param workers: The number of pages to generate at the same time.
+    :param is_new: Whether to use the template for new packages, or None to
+    work it out for each package.
+    :return: generator of (total, number of packages in the page, list of
+    (package dict, tweet text))
+    '''
+    pool = ThreadPool(workers)
+    # the pool reads its input as fast as it can, so hold it back
+    ahead = threading.Semaphore(workers * 2)
+
+    def bounded():
+        for total, packages in pages:
+            ahead.acquire()
+            yield total, packages
+
+    def generate(page):
+        total, packages = page
+        return total, len(packages), _generate_page(context, packages,
+                                                    is_new)
+
+    try:
+        for result in pool.imap(generate, bounded()):
+            ahead.release()
+            yield result
+    finally:
+        # let the pool's input thread see that it has been stopped
+        for i in range(workers * 2):
+            ahead.release()
+        pool.terminate()
+
+
+class Progress(object):
+    '''
+    Reports how many packages have been processed, and how fast, on stderr.
+    '''
+
+    def __init__(self, stream = sys.stderr):
+        self.stream = stream
+        self.start = time.time()
+        self.packages = 0
+        self.tweets = 0
+
+    @property
+    def rate(self):
+        return self.packages / max(time.time() - self.start, 0.001)
+
+    def update(self, total, packages, tweets):
+        self.packages += packages
+        self.tweets += tweets
+        self.stream.write('\r{0}/{1} packages, {2} tweets ({3:.0f} '
+                          'packages/s)'.format(self.packages, total,
+                                               self.tweets, self.rate))
+        self.stream.flush()
+
+    def finish(self):
+        self.stream.write('\nDone: {0} tweets for {1} packages in {2:.1f}s '
+                          '({3:.0f} packages/s)\n'.format(
+                self.tweets, self.packages, time.time() - self.start,
+                self.rate))
+
+
+class TwitterCommand(CkanCommand):
+    '''
+    Generates and posts tweets about datasets.
+
+    Usage:
+        paster twitter generate (--all | ID [ID ...]) [--post]
+                                [--output=FILE] [--workers=N] [--rows=N]
+                                [--new | --updated] -c <config>
+            Generates a tweet for each suitable dataset and writes them as
+            JSON lines (to stdout, or FILE). With --post, the tweets are
+            also posted (subject to the usual rest period). Progress, and
+            any IDs that weren't found, are reported on stderr.
+
+        paster twitter digest -c <config>
+            Posts any digests whose window has ended.
+
+        paster twitter initdb -c <config>
+            Creates the plugin's tables in CKAN's database.
+    '''
+    summary = __doc__.split('\n')[1].strip()
+    usage = __doc__
+    min_args = 1
+    max_args = None
+
+    def __init__(self, name):
+        super(TwitterCommand, self).__init__(name)
+        self.parser.add_option('--all', action = 'store_true',
+                               dest = 'all', default = False,
+                               help = 'Generate tweets for every dataset')
+        self.parser.add_option('--post', action = 'store_true',
+                               dest = 'post', default = False,
+                               help = 'Post the tweets as well')
+        self.parser.add_option('-o', '--output', dest = 'output',
+                               help = 'Write to this file instead of stdout')
+        self.parser.add_option('-w', '--workers', dest = 'workers',
+                               type = 'int', default = 4,
+                               help = 'Number of pages generated at once')
+        self.parser.add_option('-r', '--rows', dest = 'rows', type = 'int',
+                               default = 100,
+                               help = 'Number of datasets per page')
+        self.parser.add_option('--new', action = 'store_true',
+                               dest = 'is_new', default = None,
+                               help = 'Always use the new dataset template')
+        self.parser.add_option('--updated', action = 'store_false',
+                               dest = 'is_new',
+                               help = 'Always use the updated dataset '
+                                      'template')
+
+    def command(self):
+        self._load_config()
+        site_user = toolkit.get_action('get_site_user')({
+            'ignore_auth': True
+            }, {})
+        self.context = {
+            'model': model,
+            'session': model.Session,
+            'user': site_user['name'],
+            'ignore_auth': True
+            }
+        cmd = self.args[0]
+        if cmd == 'generate':
+            self.generate()
+        elif cmd == 'digest':
+            self.digest()
+        elif cmd == 'initdb':
+            self.initdb()
+        else:
+            print self.usage
+            sys.exit(1)
+
+    def generate(self):
+        pkg_ids = self.args[1:]
+        if not pkg_ids and not self.options.all:
+            print 'Give some dataset IDs, or --all for every dataset'
+            sys.exit(1)
+        if pkg_ids:
+            pages, missing = show_pages(self.context, pkg_ids,
+                                        self.options.rows)
+            if missing:
+                sys.stderr.write('Not found: {0}\n'.format(
+                        ', '.join(missing)))
+        else:
+            pages = search_pages(self.context, self.options.rows)
+        if self.options.post:
+            from ckanext.twitter.lib import twitter_api
+        out = open(self.options.output, 'w') if self.options.output else \
+            sys.stdout
+        progress = Progress()
+        try:
+            for total, n, tweets in generate_pages(self.context, pages,
+                                                   self.options.workers,
+                                                   self.options.is_new):
+                for pkg, tweet_text in tweets:
+                    line = {
+                        'id': pkg['id'],
+                        'name': pkg['name'],
+                        'tweet': tweet_text
+                        }
+                    if tweet_text and self.options.post:
+                        line['success'], line['reason'] = \
+                            twitter_api.post_tweet(tweet_text, pkg['id'])
+                    out.write(json.dumps(line) + '\n')
+                out.flush()
+                progress.update(total, n, len(tweets))
+        finally:
+            if out is not sys.stdout:
+                out.close()
+        progress.finish()
+
+    def digest(self):
+        for result in digest.flush(self.context):
+            print json.dumps(result)
+
+    def initdb(self):
+        db.create_tables()
+        print 'Created the twitter tables'
@@ -0,0 +1,62 @@
+import json
+
+import ckan.lib.base as base
+import ckan.model as model
+from ckan.common import c, request, response
+from ckan.plugins import toolkit
+from ckanext.twitter.lib import history
+
+# the most tweets that can be exported in one request
+max_export_limit = 100000
+
+
+def _int_param(name, default, minimum, maximum = None):
+    '''
+    Reads a whole number from the query string, aborting with a 400 if it
+    isn't one.
+    :param name: The parameter name.
+    :param default: The value to use if the parameter isn't given.
+    :param minimum: The smallest value allowed.
+    :param maximum: Optionally, the largest value allowed.
+    :return: int
+    '''
+    try:
+        value = int(request.params.get(name, default))
+    except ValueError:
+        base.abort(400, '{0} must be a whole number'.format(name))
+    if maximum is None and value < minimum:
+        base.abort(400, '{0} must be at least {1}'.format(name, minimum))
+    if maximum is not None and not minimum <= value <= maximum:
+        base.abort(400, '{0} must be between {1} and {2}'.format(
+                name, minimum, maximum))
+    return value
+
+
+class HistoryController(base.BaseController):
+    '''
+    Exports the history of posted tweets for analytics.
+    '''
+
+    def export(self):
+        '''
+        Streams the tweet history, oldest first, as JSON lines. Only
+        sysadmins can export it. The query string can include after (only
+        tweets with a higher ID; use the last ID of one page to get the
+        next), limit (the number of tweets, up to 100000) and package_id.
+        :return: generator of str
+        '''
+        context = {
+            'model': model,
+            'session': model.Session,
+            'user': c.user
+            }
+        try:
+            toolkit.check_access('twitter_history_export', context, {})
+        except toolkit.NotAuthorized:
+            base.abort(403)
+        after = _int_param('after', 0, 0)
+        limit = _int_param('limit', max_export_limit, 1, max_export_limit)
+        pkg_id = request.params.get('package_id') or None
+        response.headers['Content-Type'] = 'application/x-ndjson'
+        return (json.dumps(row) + '\n' for row in
+                history.export(after, limit, pkg_id))
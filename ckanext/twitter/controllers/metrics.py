@@ -0,0 +1,33 @@
+import ckan.lib.base as base
+import ckan.model as model
+from ckan.common import c, response
+from ckan.plugins import toolkit
+from ckanext.twitter.lib import metrics
+
+
+class MetricsController(base.BaseController):
+    '''
+    Serves the plugin's metrics for scraping by Prometheus.
+    '''
+
+    def metrics(self):
+        '''
+        Returns all metrics in the Prometheus text format. Only available if
+        ckanext.twitter.metrics is enabled, and only to sysadmins (a scraper
+        can send a sysadmin's API key in the Authorization header). Metrics
+        are per process.
+        :return: str
+        '''
+        if not metrics.enabled:
+            base.abort(404)
+        context = {
+            'model': model,
+            'session': model.Session,
+            'user': c.user
+            }
+        try:
+            toolkit.check_access('twitter_metrics', context, {})
+        except toolkit.NotAuthorized:
+            base.abort(403)
+        response.headers['Content-Type'] = 'text/plain; version=0.0.4'
+        return metrics.exposition()
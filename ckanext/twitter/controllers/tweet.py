@@ -1,8 +1,12 @@
 import json
+import math
+import time
 
 import ckan.lib.base as base
+import ckan.model as model
 from ckan.common import c
-from ckanext.twitter.lib import twitter_api
+from ckan.plugins import toolkit
+from ckanext.twitter.lib import post_queue, twitter_api
 
 
 class TweetController(base.BaseController):
@@ -14,14 +18,39 @@ class TweetController(base.BaseController):
         '''
         Posts the tweet given in the request body. The package ID is
         required for caching. Returns json data for displaying success/error
-        messages.
+        messages. If a posting queue is configured, the tweet is queued
+        instead and the response includes the job ID to check on later. If
+        the twitter API is unavailable the response says so straight away,
+        with the number of seconds to wait before trying again. If the rate
+        limit for posting has been used up, the tweet is queued to be posted
+        when it resets.
         :param pkg_id: The package ID (for caching).
         :return: str
         '''
         body = dict(c.pylons.request.postvars)
         text = body.get('tweet_text', None)
+        if text and twitter_api.breaker.is_open():
+            return self._deferred(text)
+        wait = twitter_api.post_wait() if text else 0
+        if wait:
+            return self._scheduled(text, pkg_id, wait)
+        queue = post_queue.get_queue()
+        if text and queue:
+            return json.dumps({
+                'success': True,
+                'reason': 'queued',
+                'tweet': text,
+                'queued': True,
+                'job_id': queue.enqueue(text, pkg_id)
+                })
         if text:
-            posted, reason = twitter_api.post_tweet(text, pkg_id)
+            posted, reason, retry_after = twitter_api.post_tweet_result(
+                    text, pkg_id)
+            if reason == 'deferred':
+                return self._deferred(text)
+            # the limit may have been the credential check's, not posting's
+            if reason == 'rate limited':
+                return self._scheduled(text, pkg_id, retry_after)
         else:
             posted = False
             reason = 'no tweet defined'
@@ -30,3 +59,78 @@ class TweetController(base.BaseController):
             'reason': reason,
             'tweet': text if text else 'tweet not defined'
             })
+
+    def _deferred(self, text):
+        '''
+        The response for a tweet that wasn't posted because the twitter API
+        is unavailable.
+        :param text: The tweet text.
+        :return: str
+        '''
+        return json.dumps({
+            'success': False,
+            'reason': 'deferred',
+            'tweet': text,
+            'deferred': True,
+            'retry_after': int(math.ceil(twitter_api.breaker.retry_after()))
+            })
+
+    def _scheduled(self, text, pkg_id, wait):
+        '''
+        Queues a tweet to be posted once the rate limit resets. Uses the
+        configured queue, or a worker thread if there isn't one.
+        :param text: The tweet text.
+        :param pkg_id: The package ID.
+        :param wait: The number of seconds until the rate limit resets.
+        :return: str
+        '''
+        queue = post_queue.get_queue() or post_queue.get_queue('thread')
+        return json.dumps({
+            'success': True,
+            'reason': 'scheduled',
+            'tweet': text,
+            'queued': True,
+            'job_id': queue.enqueue(text, pkg_id, delay = wait),
+            'scheduled_for': time.time() + wait
+            })
+
+    def status(self, pkg_id, job_id):
+        '''
+        Gets the status of a queued tweet. Returns json data with the job
+        status ('scheduled', 'queued', 'started', 'finished', 'failed' or
+        'unknown') and, once finished, the same success/error fields as
+        send. Only users who can edit the package can see its jobs.
+        :param pkg_id: The package ID.
+        :param job_id: The ID of the queued job.
+        :return: str
+        '''
+        context = {
+            'model': model,
+            'session': model.Session,
+            'user': c.user
+            }
+        try:
+            toolkit.check_access('package_update', context, {
+                'id': pkg_id
+                })
+        except toolkit.ObjectNotFound:
+            base.abort(404)
+        except toolkit.NotAuthorized:
+            base.abort(403)
+        package = model.Package.get(pkg_id)
+        # tweets are still scheduled on the thread queue when they aren't
+        # queued otherwise (see _scheduled)
+        queue = post_queue.get_queue() or post_queue.get_queue('thread')
+        job = queue.status(job_id)
+        # a job about another package is treated as unknown
+        if job is not None and job.get('package_id') not in (package.id,
+                                                             package.name):
+            job = None
+        if job is None:
+            job = {
+                'status': 'unknown',
+                'success': False,
+                'reason': 'job not found'
+                }
+        job['job_id'] = job_id
+        return json.dumps(job)
@@ -0,0 +1,260 @@
+import hashlib
+import threading
+import time
+
+from ckanext.twitter.lib import config_helpers, rate_limit
+
+# twitter's rate limits are counted over 15 minute windows
+default_window = 900
+
+
+class BudgetExceeded(Exception):
+    '''
+    Raised instead of making a request that would go over the rate limit.
+    '''
+
+    def __init__(self, endpoint, retry_after):
+        super(BudgetExceeded, self).__init__(
+                'rate limit for {0} reached; resets in {1:.0f}s'.format(
+                        endpoint, retry_after))
+        self.endpoint = endpoint
+        self.retry_after = retry_after
+
+
+def account(credentials):
+    '''
+    Identifies a set of credentials without including any of the secrets.
+    :param credentials: (consumer_key, consumer_secret, token_key,
+    token_secret)
+    :return: str
+    '''
+    name = u'{0}:{1}'.format(credentials[0], credentials[2])
+    return hashlib.sha1(name.encode('utf-8')).hexdigest()[:12]
+
+
+def parse_headers(response):
+    '''
+    Reads the rate limit headers from a twitter API response.
+    :param response: The httplib2.Response (a dictionary of lower case
+    header names to values, plus the status).
+    :return: (remaining, reset time, limit), or None if the response doesn't
+    have them
+    '''
+    try:
+        remaining = int(response['x-rate-limit-remaining'])
+        reset = float(response['x-rate-limit-reset'])
+    except (KeyError, ValueError):
+        if response.status == 429:
+            return 0, time.time() + default_window, None
+        return None
+    try:
+        limit = int(response['x-rate-limit-limit'])
+    except (KeyError, ValueError):
+        limit = None
+    return remaining, reset, limit
+
+
+class MemoryBudget(object):
+    '''
+    Keeps the remaining number of requests for each endpoint and account in
+    memory, shared by the threads in this process.
+    '''
+
+    def __init__(self):
+        self._buckets = {}
+        self._lock = threading.Lock()
+
+    def update(self, endpoint, account, remaining, reset, limit = None):
+        '''
+        Sets the number of requests left until the limit resets, as reported
+        by the API.
+        :param endpoint: The API path.
+        :param account: The account, from account().
+        :param remaining: The number of requests left.
+        :param reset: The time (as from time.time()) the limit resets.
+        :param limit: Optionally, the number of requests per window.
+        '''
+        with self._lock:
+            self._buckets[(endpoint, account)] = [remaining, reset, limit]
+
+    def take(self, endpoint, account):
+        '''
+        Uses up one request if there are any left.
+        :param endpoint: The API path.
+        :param account: The account, from account().
+        :return: float; 0 if the request can be made now, otherwise the
+        number of seconds until the limit resets
+        '''
+        now = time.time()
+        with self._lock:
+            bucket = self._buckets.get((endpoint, account))
+            if bucket is None or bucket[1] <= now:
+                return 0
+            if bucket[0] > 0:
+                bucket[0] -= 1
+                return 0
+            return bucket[1] - now
+
+    def wait(self, endpoint, account):
+        '''
+        Like take(), but without using anything up.
+        :return: float number of seconds
+        '''
+        now = time.time()
+        with self._lock:
+            bucket = self._buckets.get((endpoint, account))
+            if bucket is None or bucket[1] <= now or bucket[0] > 0:
+                return 0
+            return bucket[1] - now
+
+    def state(self):
+        '''
+        Gets every bucket whose window hasn't reset yet.
+        :return: list of dicts
+        '''
+        now = time.time()
+        with self._lock:
+            return [{
+                'endpoint': endpoint,
+                'account': account,
+                'remaining': remaining,
+                'limit': limit,
+                'resets_in': reset - now
+                } for (endpoint, account), (remaining, reset, limit) in
+                sorted(self._buckets.items()) if reset > now]
+
+    def clear(self):
+        with self._lock:
+            self._buckets.clear()
+
+
+class RedisBudget(object):
+    '''
+    Keeps the remaining number of requests in Redis, so every CKAN process
+    using the same credentials shares them. Each bucket is a counter that
+    expires when the limit resets.
+    '''
+
+    prefix = 'ckanext-twitter:budget:'
+
+    # decrements the counter if it is above 0; returns the milliseconds
+    # until it expires otherwise
+    _take_script = '''
+        local remaining = redis.call('GET', KEYS[1])
+        if not remaining then return 0 end
+        if tonumber(remaining) > 0 then
+            redis.call('DECR', KEYS[1])
+            return 0
+        end
+        return redis.call('PTTL', KEYS[1])
+        '''
+
+    def __init__(self):
+        self.redis = rate_limit.redis_client()
+        self._take = self.redis.register_script(self._take_script)
+
+    def _key(self, endpoint, account):
+        return '{0}{1}:{2}'.format(self.prefix, account, endpoint)
+
+    def update(self, endpoint, account, remaining, reset, limit = None):
+        ttl = int((reset - time.time()) * 1000)
+        if ttl <= 0:
+            return
+        pipe = self.redis.pipeline()
+        pipe.set(self._key(endpoint, account), remaining, px = ttl)
+        if limit is not None:
+            pipe.set(self._key(endpoint, account) + ':limit', limit, px = ttl)
+        pipe.execute()
+
+    def take(self, endpoint, account):
+        return max(self._take(keys = [self._key(endpoint, account)]), 0) / \
+               1000.0
+
+    def wait(self, endpoint, account):
+        key = self._key(endpoint, account)
+        pipe = self.redis.pipeline()
+        pipe.get(key)
+        pipe.pttl(key)
+        remaining, ttl = pipe.execute()
+        if remaining is None or int(remaining) > 0:
+            return 0
+        return max(ttl, 0) / 1000.0
+
+    def state(self):
+        buckets = []
+        for key in sorted(self.redis.scan_iter(self.prefix + '*')):
+            if key.endswith(':limit'):
+                continue
+            pipe = self.redis.pipeline()
+            pipe.get(key)
+            pipe.pttl(key)
+            pipe.get(key + ':limit')
+            remaining, ttl, limit = pipe.execute()
+            if remaining is None:
+                continue
+            account, endpoint = key[len(self.prefix):].split(':', 1)
+            buckets.append({
+                'endpoint': endpoint,
+                'account': account,
+                'remaining': int(remaining),
+                'limit': int(limit) if limit is not None else None,
+                'resets_in': max(ttl, 0) / 1000.0
+                })
+        return buckets
+
+    def clear(self):
+        keys = list(self.redis.scan_iter(self.prefix + '*'))
+        if keys:
+            self.redis.delete(*keys)
+
+
+_budgets = {
+    'memory': MemoryBudget,
+    'redis': RedisBudget
+    }
+_instances = {}
+
+
+def get_budget():
+    '''
+    Gets the store configured by ckanext.twitter.api_limit_store.
+    :return: MemoryBudget or RedisBudget
+    '''
+    backend = config_helpers.get_settings().api_limit_store
+    if backend not in _instances:
+        _instances[backend] = _budgets[backend]()
+    return _instances[backend]
+
+
+def take(endpoint, credentials):
+    '''
+    Uses up one request to the endpoint, raising BudgetExceeded if there are
+    none left until the limit resets.
+    :param endpoint: The API path.
+    :param credentials: The credentials the request will be made with.
+    '''
+    retry_after = get_budget().take(endpoint, account(credentials))
+    if retry_after > 0:
+        raise BudgetExceeded(endpoint, retry_after)
+
+
+def update(endpoint, credentials, response):
+    '''
+    Records the rate limit reported in an API response, if there is one.
+    :param endpoint: The API path.
+    :param credentials: The credentials the request was made with.
+    :param response: The httplib2.Response.
+    '''
+    limits = parse_headers(response)
+    if limits is not None:
+        get_budget().update(endpoint, account(credentials), *limits)
+
+
+def wait(endpoint, credentials):
+    '''
+    The number of seconds until a request to the endpoint can be made.
+    :param endpoint: The API path.
+    :param credentials: The credentials the request would be made with.
+    :return: float; 0 if it can be made now
+    '''
+    return get_budget().wait(endpoint, account(credentials))
@@ -1,37 +1,178 @@
-from datetime import datetime as dt
+import threading
+import time
+from collections import OrderedDict
 
-from beaker.cache import Cache
-from ckanext.twitter.lib import config_helpers
+from ckanext.twitter.lib import config_helpers, history, metrics, rate_limit
 
-twitter_cache = Cache('twitter')
+
+class ExpiringCache(object):
+    '''
+    A thread-safe cache whose entries expire after a set number of seconds.
+    The least recently used entries are removed once the cache is full.
+    '''
+
+    def __init__(self, ttl = 3600, max_size = 10000):
+        self.ttl = ttl
+        self.max_size = max_size
+        self.hits = 0
+        self.misses = 0
+        self._entries = OrderedDict()
+        self._lock = threading.Lock()
+
+    def configure(self, ttl, max_size):
+        '''
+        Changes the expiry time and size limit, and empties the cache.
+        :param ttl: The number of seconds an entry is valid for.
+        :param max_size: The maximum number of entries.
+        '''
+        with self._lock:
+            self.ttl = ttl
+            self.max_size = max_size
+            self._entries.clear()
+
+    def get(self, key):
+        '''
+        Gets a cached value.
+        :param key: The key the value was stored under.
+        :return: the value, or None if there is no valid entry
+        '''
+        with self._lock:
+            entry = self._entries.pop(key, None)
+            if entry is None or entry[1] < time.time():
+                self.misses += 1
+                return None
+            # re-insert to mark as most recently used
+            self._entries[key] = entry
+            self.hits += 1
+            return entry[0]
+
+    def put(self, key, value):
+        '''
+        Stores a value, removing the least recently used entries if the cache
+        is full.
+        :param key: The key to store the value under.
+        :param value: The value.
+        '''
+        with self._lock:
+            self._entries.pop(key, None)
+            self._entries[key] = (value, time.time() + self.ttl)
+            while len(self._entries) > self.max_size:
+                self._entries.popitem(last = False)
+
+    def invalidate(self, key):
+        '''
+        Removes an entry, e.g. because the value has changed.
+        :param key: The key the value was stored under.
+        '''
+        with self._lock:
+            self._entries.pop(key, None)
+
+    def clear(self):
+        '''
+        Removes all entries and resets the hit and miss counters.
+        '''
+        with self._lock:
+            self._entries.clear()
+            self.hits = 0
+            self.misses = 0
+
+    def stats(self):
+        '''
+        Gets the hit and miss counts and the current number of entries.
+        :return: dict
+        '''
+        with self._lock:
+            return {
+                'hits': self.hits,
+                'misses': self.misses,
+                'size': len(self._entries)
+                }
+
+
+class RecordCountCache(ExpiringCache):
+    '''
+    Caches the number of records in each datastore resource, keyed by
+    resource ID. Each process has its own cache, so a count cleared in one
+    process is still used by the others until it expires.
+    '''
+
+
+record_counts = RecordCountCache()
+
+# tweets generated in the background after a package is updated, keyed by
+# (package ID, metadata_modified) so that any later change misses. Only the
+# process that generated a tweet has it; the others generate their own.
+tweet_previews = ExpiringCache(ttl = 300, max_size = 1000)
+
+
+def _store(operation):
+    '''
+    Gets the rate limit store, counting the operation about to be made on it
+    (each is a single round trip for the shared stores).
+    :param operation: The name of the operation.
+    :return: the rate limit store
+    '''
+    metrics.rate_limit_store_operations.inc(
+            store = config_helpers.get_settings().rate_limit_store,
+            operation = operation)
+    return rate_limit.get_store()
+
+
+def rest_period():
+    '''
+    The length of the rest period between tweets about the same dataset.
+    :return: float number of seconds
+    '''
+    return config_helpers.get_settings().hours_between_tweets * 3600
 
 
 def cache(pkg_id):
     '''
-    Adds the package id and current time to the 'twitter' cache. Clears any
-    existing entries for the given package id first.
+    Records that a tweet about the package has just been posted, starting a
+    new rest period.
     :param pkg_id: The package id to store.
     '''
-    twitter_cache.remove_value(pkg_id)
-    twitter_cache.put(pkg_id, dt.now())
+    _store('mark').mark(pkg_id, rest_period())
+
+
+def reserve(pkg_id):
+    '''
+    Atomically checks that the package is not in a rest period and, if not,
+    starts one. This stops two processes from both posting about the same
+    package. Use release() if the tweet is not posted after all. Tweets in
+    the history count too, so rest periods outlast the store (e.g. a
+    restart with the memory store).
+    :param pkg_id: The package ID.
+    :return: boolean; True if the tweet can be posted
+    '''
+    seconds = rest_period()
+    if not history.expired(pkg_id, seconds):
+        return False
+    return _store('acquire').acquire(pkg_id, seconds)
+
+
+def release(pkg_id):
+    '''
+    Ends the package's rest period, e.g. because posting the tweet failed.
+    :param pkg_id: The package ID.
+    '''
+    _store('release').release(pkg_id)
 
 
 def reset_cache():
     '''
-    Clears everything from the 'twitter' cache.
+    Ends all rest periods in the store. Tweets in the history still count
+    towards their packages' rest periods.
     '''
-    twitter_cache.clear()
+    _store('clear').clear()
 
 
 def expired(pkg_id):
     '''
-    Checks to see if the cache entry for the package's last tweet (if any)
-    is old enough to be overwritten.
+    Checks to see if the package's last tweet (if any) is old enough for
+    another one to be posted.
     :param pkg_id: The package ID.
     :return: boolean
     '''
-    if not twitter_cache.has_key(pkg_id):
-        return True
-    last_posted = twitter_cache.get(pkg_id)
-    hours_since = ((dt.now() - last_posted).seconds / 3600)
-    return hours_since > config_helpers.twitter_hours_between_tweets()
+    return _store('expired').expired(pkg_id) and history.expired(
+            pkg_id, rest_period())
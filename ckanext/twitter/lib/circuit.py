@@ -0,0 +1,153 @@
+import threading
+import time
+from collections import deque
+
+state_closed = 'closed'
+state_open = 'open'
+state_half_open = 'half-open'
+
+
+class CircuitOpenError(Exception):
+    '''
+    Raised instead of making a call while the circuit breaker is open.
+    '''
+    pass
+
+
+class CircuitBreaker(object):
+    '''
+    Stops calls to a service that is failing, so that callers don't all
+    wait for it to time out. The circuit opens when at least failure_rate of
+    the calls in the last window seconds (and at least min_calls of them)
+    have failed. After reset_timeout seconds it is half-open: a single trial
+    call is let through, which closes the circuit if it succeeds or opens it
+    again if it fails.
+    '''
+
+    def __init__(self, failure_rate = 0.5, min_calls = 5, window = 60,
+                 reset_timeout = 30):
+        self.failure_rate = failure_rate
+        self.min_calls = min_calls
+        self.window = window
+        self.reset_timeout = reset_timeout
+        self.state = state_closed
+        self.opened = 0
+        self.rejected = 0
+        self._opened_at = None
+        self._trial_started = None
+        self._outcomes = deque()
+        self._lock = threading.Lock()
+
+    def configure(self, failure_rate, min_calls, window, reset_timeout):
+        '''
+        Changes the thresholds and closes the circuit.
+        :param failure_rate: The proportion of failed calls (0-1) that opens
+        the circuit.
+        :param min_calls: The number of calls in the window needed before the
+        circuit can open.
+        :param window: The number of seconds calls are counted over.
+        :param reset_timeout: The number of seconds the circuit stays open.
+        '''
+        with self._lock:
+            self.failure_rate = failure_rate
+            self.min_calls = min_calls
+            self.window = window
+            self.reset_timeout = reset_timeout
+            self._close()
+
+    def _close(self):
+        self.state = state_closed
+        self._opened_at = None
+        self._trial_started = None
+        self._outcomes.clear()
+
+    def _open(self, now):
+        self.state = state_open
+        self.opened += 1
+        self._opened_at = now
+        self._trial_started = None
+        self._outcomes.clear()
+
+    def retry_after(self):
+        '''
+        The number of seconds until a call will be allowed again.
+        :return: float; 0 if calls are allowed now
+        '''
+        if self.state != state_open:
+            return 0
+        return max(self._opened_at + self.reset_timeout - time.time(), 0)
+
+    def is_open(self):
+        '''
+        Checks, without changing the state, whether calls are being rejected.
+        :return: boolean
+        '''
+        return self.retry_after() > 0
+
+    def allow(self):
+        '''
+        Checks whether a call can be made now. Every allowed call must be
+        followed by record().
+        :return: boolean
+        '''
+        now = time.time()
+        with self._lock:
+            if self.state == state_open and \
+                    now - self._opened_at >= self.reset_timeout:
+                self.state = state_half_open
+            if self.state == state_half_open:
+                # only one trial at a time, unless the last one was abandoned
+                if self._trial_started is None or \
+                        now - self._trial_started >= self.reset_timeout:
+                    self._trial_started = now
+                    return True
+            elif self.state == state_closed:
+                return True
+            self.rejected += 1
+            return False
+
+    def cancel(self):
+        '''
+        Records that an allowed call wasn't made after all, so a half-open
+        circuit can let another trial through straight away.
+        '''
+        with self._lock:
+            self._trial_started = None
+
+    def record(self, success):
+        '''
+        Records the result of an allowed call.
+        :param success: False if the call failed in a way that suggests the
+        service is unavailable.
+        '''
+        now = time.time()
+        with self._lock:
+            if self.state == state_half_open:
+                if success:
+                    self._close()
+                else:
+                    self._open(now)
+                return
+            if self.state == state_open:
+                return
+            self._outcomes.append((now, success))
+            while self._outcomes and self._outcomes[0][0] < now - self.window:
+                self._outcomes.popleft()
+            failures = sum(1 for t, ok in self._outcomes if not ok)
+            if len(self._outcomes) >= self.min_calls and \
+                    failures >= self.failure_rate * len(self._outcomes):
+                self._open(now)
+
+    def stats(self):
+        '''
+        Gets the state of the circuit and how often it has opened.
+        :return: dict
+        '''
+        with self._lock:
+            return {
+                'state': self.state,
+                'opened': self.opened,
+                'rejected': self.rejected,
+                'failures': sum(1 for t, ok in self._outcomes if not ok),
+                'calls': len(self._outcomes)
+                }
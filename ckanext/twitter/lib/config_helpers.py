@@ -1,4 +1,244 @@
+from collections import namedtuple
+
 import pylons
+from jinja2 import Environment, TemplateSyntaxError
+from paste.deploy.converters import asbool
+
+default_new_format = 'New dataset: "{{ title }}" by {{ author }} ({%- if ' \
+                     'records != 0 -%} {{ records }} records {%- else -%} ' \
+                     '{{ resources }} resource {%- endif -%}).'
+
+default_updated_format = 'Updated dataset: "{{ title }}" by {{ author }} ({' \
+                         '%- if records != 0 -%} {{ records }} records {%- ' \
+                         'elif resources == 1 -%} {{ resources }} resource ' \
+                         '{%- else -%} {{ resources }} resources {%- endif ' \
+                         '-%}).'
+
+default_digest_format = '{{ datasets }} datasets updated by {{ group }} ({' \
+                        '%- if records != 0 -%} {{ records|short_number }} ' \
+                        'records {%- else -%} {{ resources }} resources {%- ' \
+                        'endif -%}).'
+
+_post_queues = ('', 'thread', 'jobs')
+_rate_limit_stores = ('memory', 'sql', 'redis')
+_api_limit_stores = ('memory', 'redis')
+_duplicate_stores = ('memory', 'redis')
+_digest_groups = ('', 'organization', 'author')
+
+
+def _number(config, key, default, cast, minimum, maximum = None):
+    '''
+    Reads a number from the config.
+    :param config: The config dictionary.
+    :param key: The key, without the ckanext.twitter. prefix.
+    :param default: The value to use if the key isn't set.
+    :param cast: int or float.
+    :param minimum: The smallest value allowed.
+    :param maximum: Optionally, the largest value allowed.
+    :return: int or float
+    '''
+    value = config.get('ckanext.twitter.' + key, default)
+    try:
+        value = cast(value)
+    except (TypeError, ValueError):
+        raise ValueError('ckanext.twitter.{0} must be a number, not '
+                         '{1!r}'.format(key, value))
+    if value < minimum:
+        raise ValueError('ckanext.twitter.{0} must be at least {1}, not '
+                         '{2}'.format(key, minimum, value))
+    if maximum is not None and value > maximum:
+        raise ValueError('ckanext.twitter.{0} must be at most {1}, not '
+                         '{2}'.format(key, maximum, value))
+    return value
+
+
+def _boolean(config, key, default):
+    '''
+    Reads a boolean ("true", "false", "1", "0" etc.) from the config.
+    :param config: The config dictionary.
+    :param key: The full key.
+    :param default: The value to use if the key isn't set.
+    :return: boolean
+    '''
+    value = config.get(key, default)
+    try:
+        return asbool(value)
+    except ValueError:
+        raise ValueError('{0} must be true or false, not {1!r}'.format(key,
+                                                                     value))
+
+
+def _choice(config, key, default, choices):
+    '''
+    Reads one of a fixed set of names from the config.
+    :param config: The config dictionary.
+    :param key: The key, without the ckanext.twitter. prefix.
+    :param default: The value to use if the key isn't set.
+    :param choices: The allowed values.
+    :return: string
+    '''
+    value = (config.get('ckanext.twitter.' + key, default) or '').strip()
+    if value not in choices:
+        raise ValueError('ckanext.twitter.{0} must be one of {1}, not '
+                         '{2!r}'.format(key, ', '.join(repr(c) for c in
+                                                       choices), value))
+    return value
+
+
+def _template(config, key, default):
+    '''
+    Reads a tweet format from the config, checking that it is a valid jinja2
+    template.
+    :param config: The config dictionary.
+    :param key: The key, without the ckanext.twitter. prefix.
+    :param default: The value to use if the key isn't set.
+    :return: string
+    '''
+    value = config.get('ckanext.twitter.' + key, default)
+    try:
+        Environment().parse(value)
+    except TemplateSyntaxError as e:
+        raise ValueError('ckanext.twitter.{0} is not a valid template: '
+                         '{1}'.format(key, e))
+    return value
+
+
+class Settings(namedtuple('Settings', [
+    'credentials',
+    'api_url',
+    'timeout',
+    'verify_credentials_ttl',
+    'api_retries',
+    'api_retry_backoff',
+    'post_deadline',
+    'circuit_failure_rate',
+    'circuit_min_calls',
+    'circuit_window',
+    'circuit_reset_timeout',
+    'debug',
+    'hours_between_tweets',
+    'record_count_workers',
+    'record_count_timeout',
+    'record_count_ttl',
+    'record_count_cache_size',
+    'preview_ttl',
+    'post_queue',
+    'rate_limit_store',
+    'api_limit_store',
+    'duplicate_window',
+    'duplicate_store',
+    'metrics',
+    'new_format',
+    'updated_format',
+    'disable_edit',
+    'digest',
+    'digest_window',
+    'digest_format'
+    ])):
+    '''
+    The plugin's settings, read from the config and checked once, so that
+    they can be looked up as plain attributes afterwards. Immutable; changes
+    to the config only take effect after reload().
+    '''
+    __slots__ = ()
+
+    @classmethod
+    def from_config(cls, config):
+        '''
+        Reads and checks all of the settings.
+        :param config: The config dictionary.
+        :return: Settings
+        '''
+        credentials = tuple(
+                config.get('ckanext.twitter.' + key, 'no-{0}-set'.format(
+                        key.replace('_', '-')))
+                for key in ['consumer_key', 'consumer_secret', 'token_key',
+                            'token_secret'])
+        api_url = config.get('ckanext.twitter.api_url',
+                             'https://api.twitter.com/1.1/')
+        if not api_url.startswith(('http://', 'https://')):
+            raise ValueError('ckanext.twitter.api_url must be an http(s) URL, '
+                             'not {0!r}'.format(api_url))
+        return cls(
+                credentials = credentials,
+                api_url = api_url,
+                timeout = _number(config, 'timeout', 10, float, 0.001),
+                verify_credentials_ttl = _number(config,
+                                                 'verify_credentials_ttl',
+                                                 3600, int, 0),
+                api_retries = _number(config, 'api_retries', 2, int, 0),
+                api_retry_backoff = _number(config, 'api_retry_backoff', 0.5,
+                                            float, 0),
+                post_deadline = _number(config, 'post_deadline', 20, float,
+                                        0.001),
+                circuit_failure_rate = _number(config, 'circuit_failure_rate',
+                                               0.5, float, 0.001, 1),
+                circuit_min_calls = _number(config, 'circuit_min_calls', 5,
+                                            int, 1),
+                circuit_window = _number(config, 'circuit_window', 60, float,
+                                         0.001),
+                circuit_reset_timeout = _number(config,
+                                                'circuit_reset_timeout', 30,
+                                                float, 0),
+                # the plugin-specific flag can override the global one
+                debug = _boolean(config, 'ckanext.twitter.debug',
+                                 config.get('debug', False)),
+                hours_between_tweets = _number(config, 'hours_between_tweets',
+                                               24, float, 0),
+                record_count_workers = _number(config, 'record_count_workers',
+                                               4, int, 1),
+                record_count_timeout = _number(config, 'record_count_timeout',
+                                               5, float, 0.001),
+                record_count_ttl = _number(config, 'record_count_ttl', 3600,
+                                           int, 0),
+                record_count_cache_size = _number(config,
+                                                  'record_count_cache_size',
+                                                  10000, int, 1),
+                preview_ttl = _number(config, 'preview_ttl', 300, int, 0),
+                post_queue = _choice(config, 'post_queue', '', _post_queues),
+                rate_limit_store = _choice(config, 'rate_limit_store',
+                                           'memory', _rate_limit_stores),
+                api_limit_store = _choice(config, 'api_limit_store', 'memory',
+                                          _api_limit_stores),
+                duplicate_window = _number(config, 'duplicate_window', 86400,
+                                           int, 0),
+                duplicate_store = _choice(config, 'duplicate_store', 'memory',
+                                          _duplicate_stores),
+                metrics = _boolean(config, 'ckanext.twitter.metrics', False),
+                new_format = _template(config, 'new', default_new_format),
+                updated_format = _template(config, 'updated',
+                                           default_updated_format),
+                disable_edit = _boolean(config, 'ckanext.twitter.disable_edit',
+                                        False),
+                digest = _choice(config, 'digest', '', _digest_groups),
+                digest_window = _number(config, 'digest_window', 3600, int, 1),
+                digest_format = _template(config, 'digest_format',
+                                          default_digest_format)
+                )
+
+
+_settings = None
+
+
+def reload(config = None):
+    '''
+    Reads the settings from the config again. Raises ValueError (before
+    replacing the current settings) if any of them are invalid.
+    :param config: Optionally, the config to read; defaults to pylons.config.
+    :return: Settings
+    '''
+    global _settings
+    _settings = Settings.from_config(pylons.config if config is None
+                                     else config)
+    return _settings
+
+
+def get_settings():
+    '''
+    Gets the current settings, reading them from the config the first time.
+    :return: Settings
+    '''
+    return _settings or reload()
 
 
 def twitter_get_credentials():
@@ -6,15 +246,7 @@ def twitter_get_credentials():
     Retrieves twitter API key and secret from config file.
     :return: (key, secret)
     '''
-    consumer_key = pylons.config.get('ckanext.twitter.consumer_key',
-                                     'no-consumer-key-set')
-    consumer_secret = pylons.config.get('ckanext.twitter.consumer_secret',
-                                        'no-consumer-secret-set')
-    token_key = pylons.config.get('ckanext.twitter.token_key',
-                                  'no-token-key-set')
-    token_secret = pylons.config.get('ckanext.twitter.token_secret',
-                                     'no-token-secret-set')
-    return consumer_key, consumer_secret, token_key, token_secret
+    return get_settings().credentials
 
 
 def twitter_is_debug():
@@ -23,17 +255,16 @@ def twitter_is_debug():
     the global debug flag.
     :return: boolean
     '''
-    return pylons.config.get('ckanext.twitter.debug',
-                             pylons.config.get('debug', False))
+    return get_settings().debug
 
 
 def twitter_hours_between_tweets():
     '''
     For calculating the 'rest period' between subsequent tweets about the
     same dataset.
-    :return: int
+    :return: float
     '''
-    return pylons.config.get('ckanext.twitter.hours_between_tweets', 24)
+    return get_settings().hours_between_tweets
 
 
 def twitter_new_format():
@@ -42,11 +273,7 @@ def twitter_new_format():
     new datasets.
     :return: string with replaceable jinja2 tags
     '''
-    return pylons.config.get('ckanext.twitter.new',
-                             'New dataset: "{{ title }}" by {{ author }} ({'
-                             '%- if records != 0 -%} {{ records }} records {'
-                             '%- else -%} {{ resources }} resource {%- endif '
-                             '-%}).')
+    return get_settings().new_format
 
 
 def twitter_updated_format():
@@ -55,12 +282,7 @@ def twitter_updated_format():
     updated.
     :return: string with replaceable jinja2 tags
     '''
-    return pylons.config.get('ckanext.twitter.updated',
-                             'Updated dataset: "{{ title }}" by {{ author }} '
-                             '({%- if records != 0 -%} {{ records }} records '
-                             '{%- elif resources == 1 -%} {{ resources }} '
-                             'resource {%- else -%} {{ resources }} '
-                             'resources {%- endif -%}).')
+    return get_settings().updated_format
 
 
 def twitter_disable_edit():
@@ -69,4 +291,4 @@ def twitter_disable_edit():
     user editing the tweet before it is posted.
     :return: boolean
     '''
-    return pylons.config.get('ckanext.twitter.disable_edit', False)
+    return get_settings().disable_edit
@@ -0,0 +1,57 @@
+import ckan.model as model
+
+
+def tables():
+    '''
+    Gets the plugin's tables in CKAN's database.
+    :return: list of sqlalchemy.Table
+    '''
+    # imported here because these modules import this one
+    from ckanext.twitter.lib import (digest, history, markers, pending,
+                                     rate_limit)
+    return [digest.digest_table, history.history_table, markers.marker_table,
+            pending.pending_table, rate_limit.rate_limit_table]
+
+
+def create_tables():
+    '''
+    Creates any of the plugin's tables (and their indexes) that don't exist
+    yet. Run by "paster twitter initdb" and by the plugin when it starts
+    (see missing_tables); the tables aren't created on first use, so that
+    errors in the statements using them aren't hidden.
+    '''
+    for table in tables():
+        table.create(model.meta.engine, checkfirst = True)
+
+
+def missing_tables():
+    '''
+    Gets the names of any of the plugin's tables that don't exist yet, e.g.
+    because the extension has been upgraded without running "paster twitter
+    initdb".
+    :return: list of strings
+    '''
+    return [table.name for table in tables()
+            if not model.meta.engine.has_table(table.name)]
+
+
+def execute(statement, **params):
+    '''
+    Runs a statement against CKAN's database.
+    :param statement: The statement to run.
+    :param params: Parameters for the statement.
+    :return: ResultProxy
+    '''
+    return model.meta.engine.execute(statement, **params)
+
+
+def execute_in_transaction(statement, **params):
+    '''
+    Runs a statement as part of the current transaction of CKAN's session,
+    so it is committed or rolled back along with the changes being made
+    (e.g. by package_update).
+    :param statement: The statement to run.
+    :param params: Parameters for the statement.
+    :return: ResultProxy
+    '''
+    return model.Session.execute(statement, params)
@@ -0,0 +1,168 @@
+import json
+from collections import OrderedDict
+
+import ckan.model as model
+from ckanext.twitter.lib import config_helpers, db, parsers
+from ckanext.twitter.lib.truncation import truncate_author, truncate_field
+from sqlalchemy import Column, DateTime, MetaData, Table, UnicodeText, text
+
+digest_table = Table('twitter_digest', MetaData(),
+                     Column('package_id', UnicodeText, primary_key = True),
+                     Column('group_key', UnicodeText, nullable = False),
+                     Column('added', DateTime, nullable = False))
+
+# reasons for a digest not being posted that mean it should be tried again
+_retry_reasons = ('deferred', 'rate limited')
+
+
+def group_key(context, pkg_dict):
+    '''
+    Gets the value the package is grouped by in the digest (its organisation
+    ID or its author, depending on ckanext.twitter.digest).
+    :param context: The current context.
+    :param pkg_dict: The package dictionary, which may be incomplete.
+    :return: unicode; empty if the package doesn't have one
+    '''
+    field = 'owner_org' if config_helpers.get_settings().digest == \
+                           'organization' else 'author'
+    if field in pkg_dict:
+        return pkg_dict[field] or u''
+    package = context.get('package')
+    if package is None or package.id != pkg_dict['id']:
+        package = model.Package.get(pkg_dict['id'])
+    return getattr(package, field, None) or u''
+
+
+def add(pkg_id, key):
+    '''
+    Adds an updated package to the next digest. A package is only included
+    once, however often it is updated.
+    :param pkg_id: The package ID.
+    :param key: The group the package is in, from group_key().
+    '''
+    db.execute(text('INSERT INTO twitter_digest (package_id, group_key, '
+                    'added) VALUES (:pkg_id, :key, now()) '
+                    'ON CONFLICT (package_id) DO UPDATE '
+                    'SET group_key = EXCLUDED.group_key'), pkg_id = pkg_id,
+               key = key)
+
+
+def _claim(window):
+    '''
+    Removes and returns the packages in every group whose window has ended,
+    i.e. whose first package was added at least window seconds ago. Each
+    package is only returned to one process.
+    :param window: The length of the window in seconds.
+    :return: dict of package ID to group key
+    '''
+    rows = db.execute(text('DELETE FROM twitter_digest WHERE group_key IN ('
+                           'SELECT group_key FROM twitter_digest '
+                           'GROUP BY group_key HAVING min(added) <= '
+                           'now() - :window * interval \'1 second\') '
+                           'RETURNING package_id, group_key'), window = window)
+    return {row['package_id']: row['group_key'] for row in rows}
+
+
+def _summarise(claimed):
+    '''
+    Adds up the datasets, resources and datastore resources in each group,
+    using a single query for all of the claimed packages. Packages that have
+    since been deleted or made private are left out.
+    :param claimed: A dict of package ID to group key.
+    :return: OrderedDict of group key to summary dict
+    '''
+    rows = db.execute(text('SELECT p.id AS package_id, g.title AS org_title, '
+                           'r.id AS resource_id, r.extras FROM package p '
+                           'LEFT JOIN "group" g ON g.id = p.owner_org '
+                           'LEFT JOIN resource r ON r.package_id = p.id '
+                           'AND r.state = \'active\' '
+                           'WHERE p.id = ANY(:ids) AND p.state = \'active\' '
+                           'AND NOT p.private'), ids = list(claimed))
+    groups = OrderedDict()
+    for row in rows:
+        key = claimed[row['package_id']]
+        group = groups.setdefault(key, {
+            'name': row['org_title'],
+            'packages': set(),
+            'resources': 0,
+            'datastore': []
+            })
+        group['packages'].add(row['package_id'])
+        if row['resource_id'] is None:
+            continue
+        group['resources'] += 1
+        if parsers._is_datastore_active(json.loads(row['extras'] or '{}')):
+            group['datastore'].append(row['resource_id'])
+    return groups
+
+
+def render(group_name, datasets, resources, records):
+    '''
+    Renders the digest tweet for one group, shortening the group's name if
+    the tweet would be too long.
+    :param group_name: The name of the organisation or author.
+    :param datasets: The number of datasets updated.
+    :param resources: The number of resources in those datasets.
+    :param records: The number of records in those datasets.
+    :return: unicode
+    '''
+    template = parsers.get_template(
+            config_helpers.get_settings().digest_format)
+    values = {
+        'group': group_name,
+        'datasets': datasets,
+        'resources': resources,
+        'records': records
+        }
+    rendered = template.render(values)
+    overflow = len(rendered) - parsers.tweet_limit
+    if overflow > 0 and 'group' in template.tokens:
+        values['group'] = truncate_field(group_name,
+                                         max(len(group_name) - overflow, 0))
+        rendered = template.render(values)
+    return rendered[:parsers.tweet_limit]
+
+
+def flush(context = None):
+    '''
+    Posts a digest tweet for every group whose window has ended. Run by
+    "paster twitter digest" (e.g. from cron), so that only one process
+    posts digests. Packages in digests that couldn't be posted because the
+    twitter API is unavailable or rate limited are kept for the next flush.
+    :param context: Optionally, the context to count records in.
+    :return: list of dicts describing each digest
+    '''
+    settings = config_helpers.get_settings()
+    claimed = _claim(settings.digest_window)
+    if not claimed:
+        return []
+    from ckanext.twitter.lib import twitter_api
+    context = context or {
+        'model': model,
+        'session': model.Session,
+        'ignore_auth': True
+        }
+    groups = _summarise(claimed)
+    totals = parsers.count_records(context, [rid for group in groups.values()
+                                             for rid in group['datastore']])
+    digests = []
+    for key, group in groups.items():
+        if settings.digest == 'organization':
+            name = group['name'] or u'unknown'
+        else:
+            name = truncate_author(key) if key else u'unknown'
+        tweet_text = render(name, len(group['packages']), group['resources'],
+                            sum(totals.get(rid, 0) for rid in
+                                group['datastore']))
+        posted, reason = twitter_api.post_digest(tweet_text)
+        if reason in _retry_reasons:
+            for pkg_id in group['packages']:
+                add(pkg_id, key)
+        digests.append({
+            'group': key,
+            'tweet': tweet_text,
+            'datasets': len(group['packages']),
+            'success': posted,
+            'reason': reason
+            })
+    return digests
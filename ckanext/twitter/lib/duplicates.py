@@ -0,0 +1,127 @@
+import threading
+import time
+from collections import OrderedDict
+
+from ckanext.twitter.lib import api_limits, config_helpers, history, rate_limit
+
+
+class MemoryIndex(object):
+    '''
+    Keeps the hashes of recent tweets in memory, shared by the threads in
+    this process. Holds at most max_size hashes; the oldest are forgotten
+    first.
+    '''
+
+    def __init__(self, max_size = 10000):
+        self.max_size = max_size
+        self._expires = OrderedDict()
+        self._lock = threading.Lock()
+
+    def claim(self, key, seconds):
+        '''
+        Atomically checks that the tweet hasn't been posted in the window
+        and, if it hasn't, records it.
+        :param key: The account and hash of the tweet, from _key().
+        :param seconds: The length of the window.
+        :return: boolean; True if the tweet isn't a duplicate
+        '''
+        now = time.time()
+        with self._lock:
+            if self._expires.get(key, 0) > now:
+                return False
+            # re-insert so the newest hashes are at the end
+            self._expires.pop(key, None)
+            self._expires[key] = now + seconds
+            while len(self._expires) > self.max_size:
+                self._expires.popitem(last = False)
+            return True
+
+    def release(self, key):
+        '''
+        Forgets a tweet, e.g. because posting it failed.
+        :param key: The account and hash of the tweet.
+        '''
+        with self._lock:
+            self._expires.pop(key, None)
+
+    def clear(self):
+        with self._lock:
+            self._expires.clear()
+
+
+class RedisIndex(object):
+    '''
+    Keeps the hashes of recent tweets in Redis as keys that expire at the
+    end of the window, so every CKAN process shares them.
+    '''
+
+    prefix = 'ckanext-twitter:tweet:'
+
+    def __init__(self):
+        self.redis = rate_limit.redis_client()
+
+    def claim(self, key, seconds):
+        return bool(self.redis.set(self.prefix + key, 1,
+                                   px = max(int(seconds * 1000), 1),
+                                   nx = True))
+
+    def release(self, key):
+        self.redis.delete(self.prefix + key)
+
+    def clear(self):
+        keys = list(self.redis.scan_iter(self.prefix + '*'))
+        if keys:
+            self.redis.delete(*keys)
+
+
+_indexes = {
+    'memory': MemoryIndex,
+    'redis': RedisIndex
+    }
+_instances = {}
+
+
+def get_index():
+    '''
+    Gets the index configured by ckanext.twitter.duplicate_store.
+    :return: MemoryIndex or RedisIndex
+    '''
+    backend = config_helpers.get_settings().duplicate_store
+    if backend not in _instances:
+        _instances[backend] = _indexes[backend]()
+    return _instances[backend]
+
+
+def _key(credentials, tweet_text):
+    '''
+    Identifies a tweet by the account posting it and a hash of its text.
+    :return: str
+    '''
+    return '{0}:{1}'.format(api_limits.account(credentials),
+                            history.text_hash(tweet_text))
+
+
+def claim(tweet_text):
+    '''
+    Checks that the same text hasn't been posted from the configured account
+    within ckanext.twitter.duplicate_window seconds and, if not, records it
+    so that it won't be posted again. Use release() if the tweet isn't
+    posted after all.
+    :param tweet_text: The text of the tweet.
+    :return: boolean; True if the tweet can be posted
+    '''
+    settings = config_helpers.get_settings()
+    if not settings.duplicate_window:
+        return True
+    return get_index().claim(_key(settings.credentials, tweet_text),
+                             settings.duplicate_window)
+
+
+def release(tweet_text):
+    '''
+    Forgets a tweet claimed with claim(), so the same text can be posted.
+    :param tweet_text: The text of the tweet.
+    '''
+    settings = config_helpers.get_settings()
+    if settings.duplicate_window:
+        get_index().release(_key(settings.credentials, tweet_text))
@@ -1,7 +1,8 @@
-from ckan.common import session
+import ckan.model as model
 from ckan.logic import NotFound, get_action
 from ckan.plugins import toolkit
-from ckanext.twitter.lib import (parsers as twitter_parsers)
+from ckanext.twitter.lib import (markers, parsers as twitter_parsers,
+                                 pending, previews)
 
 
 class TwitterJSHelpers(object):
@@ -34,35 +35,68 @@ class TwitterJSHelpers(object):
 
     def _is_new(self, package_id):
         '''
-        Tests to see if the package is "new", i.e. it has only just had its
-        first resource added.
+        Tests to see if the package is "new", i.e. it is still a draft or has
+        only just been published.
         :param package_id: The ID of the package to check.
         :return: boolean
         '''
-        revisions = get_action('package_activity_list')(self.context, {
-            'id': package_id
-            })
-        return len(revisions) <= 3
+        return twitter_pkg_is_new(self.context, package_id)
 
     def tweet_ready(self, package_id):
         '''
-        Checks the session to see if the package has been marked as ready
-        for tweeting via the update hook. Removes the 'twitter_is_suitable'
-        key from the session if present.
+        Checks whether the current user has just updated the package and
+        should be asked to tweet about it (marked by the update hook), and
+        if so removes the mark. Only users who can edit the package can have
+        updated it, so other visitors' page views don't touch the pending
+        table (and anonymous ones don't look anything up or load a
+        session).
         :param package_id: The package ID.
         :return: boolean
         '''
-        in_session = session.pop('twitter_is_suitable', '') == package_id
-        return in_session
+        user_name = toolkit.c.user
+        if not user_name:
+            return False
+        context = {
+            'model': model,
+            'session': model.Session,
+            'user': user_name
+            }
+        try:
+            toolkit.check_access('package_update', context, {
+                'id': package_id
+                })
+        except (toolkit.NotAuthorized, toolkit.ObjectNotFound):
+            return False
+        return pending.pop(user_name, package_id)
 
-    def get_tweet(self, package_id):
+    def get_tweet(self, package_id, pkg_dict = None):
         '''
-        Generates the tweet text for the given package.
+        Gets the tweet text for the given package: the one generated in the
+        background after the package was updated if it is ready, otherwise
+        generates it now.
         :param package_id: The package ID.
+        :param pkg_dict: Optionally, the package dictionary if it has already
+        been loaded (e.g. by the page being rendered).
         :return: str
         '''
+        tweet_text = previews.get(pkg_dict)
+        if tweet_text is not None:
+            return tweet_text
         return twitter_parsers.generate_tweet(self.context, package_id,
-                                              self._is_new(package_id))
+                                              self._is_new(package_id),
+                                              pkg_dict = pkg_dict)
+
+
+def twitter_pkg_is_new(context, pkg_id):
+    '''
+    Tests to see if the package is "new", i.e. it is still a draft or has
+    only just been published. Uses the markers written by the plugin's
+    hooks rather than the package's activity.
+    :param context: The current context.
+    :param pkg_id: The ID of the package to check.
+    :return: boolean
+    '''
+    return markers.is_new(pkg_id)
 
 
 def twitter_pkg_suitable(context, pkg_id, pkg_dict = None):
@@ -72,7 +106,7 @@ def twitter_pkg_suitable(context, pkg_id, pkg_dict = None):
     :param context: The current context.
     :param pkg_id: The package ID.
     :param pkg_dict: Optionally provided instead of pkg_id to avoid
-    requesting from the API. Not recommended - provided as a test helper.
+    requesting from the API, e.g. if the package has already been loaded.
     :return: boolean
     '''
     if pkg_dict:
@@ -84,6 +118,16 @@ def twitter_pkg_suitable(context, pkg_id, pkg_dict = None):
                 })
         except NotFound:
             return False
+    return _check_suitable(package)
+
+
+def _check_suitable(package):
+    '''
+    Applies the tests for twitter_pkg_suitable to a package dictionary.
+    :param package: The package dictionary; only the state, private and
+    resource state fields are used.
+    :return: boolean
+    '''
     if package.get('state', '') != 'active' and package.get('state',
                                                             '') != 'draft':
         return False
@@ -95,3 +139,51 @@ def twitter_pkg_suitable(context, pkg_id, pkg_dict = None):
     if package.get('private', False):
         return False
     return True
+
+
+def _suitability_fields(context, pkg_dict):
+    '''
+    Gets the minimal set of fields needed by _check_suitable (state, private
+    and the state of each resource). Uses the values in the package
+    dictionary where it has them, and only loads the package from the
+    database (without validating or serialising it) for the ones it doesn't.
+    :param context: The current context.
+    :param pkg_dict: A package dictionary, which may be incomplete.
+    :return: dict, or None if the package doesn't exist
+    '''
+    fields = {k: pkg_dict[k] for k in ['state', 'private'] if k in pkg_dict}
+    resources = pkg_dict.get('resources')
+    if resources is not None and all('state' in r for r in resources):
+        fields['resources'] = [{
+            'state': r['state']
+            } for r in resources]
+    if len(fields) == 3:
+        return fields
+    # package_update puts the package model in the context, so use that if
+    # it's the right one
+    package = context.get('package')
+    if package is None or package.id != pkg_dict.get('id'):
+        package = context.get('model', model).Package.get(pkg_dict.get('id'))
+    if package is None:
+        return None
+    fields.setdefault('state', package.state)
+    fields.setdefault('private', package.private)
+    fields.setdefault('resources', [{
+        'state': r.state
+        } for r in package.resources_all])
+    return fields
+
+
+def twitter_pkg_dict_suitable(context, pkg_dict):
+    '''
+    The same tests as twitter_pkg_suitable, but decided from a package
+    dictionary that may be incomplete (e.g. the one passed to after_update)
+    rather than from package_show. Missing fields are read from the database.
+    :param context: The current context.
+    :param pkg_dict: The package dictionary.
+    :return: boolean
+    '''
+    fields = _suitability_fields(context, pkg_dict)
+    if fields is None:
+        return False
+    return _check_suitable(fields)
@@ -0,0 +1,125 @@
+import hashlib
+from datetime import datetime as dt, timedelta
+
+from ckanext.twitter.lib import db
+from sqlalchemy import (Column, DateTime, Index, Integer, MetaData, Table,
+                        UnicodeText, select)
+
+status_posted = u'posted'
+status_failed = u'failed'
+
+history_table = Table('twitter_tweet_history', MetaData(),
+                      Column('id', Integer, primary_key = True),
+                      Column('package_id', UnicodeText, nullable = False),
+                      Column('text_hash', UnicodeText, nullable = False),
+                      Column('tweet_id', UnicodeText),
+                      Column('posted_at', DateTime, nullable = False),
+                      Column('status', UnicodeText, nullable = False))
+
+# a package's tweets, newest last; also used for checking the rest period
+Index('twitter_tweet_history_package_idx', history_table.c.package_id,
+      history_table.c.posted_at)
+
+# the number of rows fetched by each query when exporting
+export_batch_size = 1000
+
+
+def text_hash(tweet_text):
+    '''
+    Hashes the text of a tweet, so tweets can be compared without storing
+    the text.
+    :param tweet_text: The text of the tweet.
+    :return: unicode
+    '''
+    return unicode(hashlib.sha1(tweet_text.encode('utf-8')).hexdigest())
+
+
+def record(pkg_id, tweet_text, status, tweet_id = None):
+    '''
+    Adds a tweet that was sent to twitter to the history.
+    :param pkg_id: The package ID.
+    :param tweet_text: The text of the tweet.
+    :param status: status_posted or status_failed.
+    :param tweet_id: Optionally, the ID twitter gave the tweet.
+    '''
+    db.execute(history_table.insert().values(package_id = pkg_id,
+                                             text_hash = text_hash(tweet_text),
+                                             tweet_id = tweet_id,
+                                             posted_at = dt.utcnow(),
+                                             status = status))
+
+
+def expired(pkg_id, seconds):
+    '''
+    Checks that no tweet about the package has been posted in the last
+    seconds seconds. This is a single range lookup in the package index,
+    however long the history is.
+    :param pkg_id: The package ID.
+    :param seconds: The length of the rest period.
+    :return: boolean
+    '''
+    t = history_table.c
+    query = select([t.id]).where(t.package_id == pkg_id).where(
+            t.status == status_posted).where(
+            t.posted_at > dt.utcnow() - timedelta(seconds = seconds)).limit(1)
+    return db.execute(query).first() is None
+
+
+def _as_dict(row):
+    return {
+        'id': row['id'],
+        'package_id': row['package_id'],
+        'text_hash': row['text_hash'],
+        'tweet_id': row['tweet_id'],
+        'posted_at': row['posted_at'].isoformat(),
+        'status': row['status']
+        }
+
+
+def for_package(pkg_id, limit = 20):
+    '''
+    Gets the most recent tweets about a package.
+    :param pkg_id: The package ID.
+    :param limit: The maximum number of tweets.
+    :return: list of dicts, newest first
+    '''
+    t = history_table.c
+    query = history_table.select().where(t.package_id == pkg_id).order_by(
+            t.posted_at.desc()).limit(limit)
+    return [_as_dict(row) for row in db.execute(query)]
+
+
+def export(after = 0, limit = None, pkg_id = None):
+    '''
+    Pages through the history in order, fetching a batch of rows at a time
+    so that the whole history is never held in memory. Each batch starts
+    after the last ID seen rather than at an offset, so it is a lookup in
+    the primary key index however far through the history it is.
+    :param after: Only tweets with a higher ID than this are included.
+    :param limit: Optionally, the maximum number of tweets.
+    :param pkg_id: Optionally, only tweets about this package.
+    :return: generator of dicts
+    '''
+    t = history_table.c
+    remaining = limit
+    while remaining is None or remaining > 0:
+        batch = export_batch_size if remaining is None else min(
+                remaining, export_batch_size)
+        query = history_table.select().where(t.id > after)
+        if pkg_id is not None:
+            query = query.where(t.package_id == pkg_id)
+        rows = db.execute(query.order_by(t.id).limit(batch)).fetchall()
+        for row in rows:
+            yield _as_dict(row)
+        if len(rows) < batch:
+            return
+        after = rows[-1]['id']
+        if remaining is not None:
+            remaining -= len(rows)
+
+
+def clear():
+    '''
+    Removes the whole history.
+    '''
+    db.execute(history_table.delete())
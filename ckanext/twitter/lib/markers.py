@@ -0,0 +1,183 @@
+import threading
+from datetime import datetime as dt
+
+import ckan.model as model
+from ckanext.twitter.lib import db
+from sqlalchemy import (Column, DateTime, MetaData, Table, UnicodeText, event,
+                        text)
+
+marker_table = Table('twitter_package_marker', MetaData(),
+                     Column('package_id', UnicodeText, primary_key = True),
+                     Column('first_published', DateTime),
+                     Column('first_tweeted', DateTime))
+
+# packages this process has already marked as published, so the update
+# doesn't have to be repeated every time they change
+_published = set()
+_published_limit = 10000
+_lock = threading.Lock()
+
+
+def _remember(pkg_id):
+    '''
+    Notes that the package doesn't need marking as published again.
+    :param pkg_id: The package ID.
+    '''
+    with _lock:
+        if len(_published) >= _published_limit:
+            _published.clear()
+        _published.add(pkg_id)
+
+
+# the packages marked as published during a session's transaction, in
+# session.info; they are only remembered once it has been committed
+_published_key = 'twitter_published'
+
+
+def _after_commit(session):
+    '''
+    Remembers the packages marked as published during the transaction that
+    has just been committed.
+    '''
+    for pkg_id in session.info.pop(_published_key, ()):
+        _remember(pkg_id)
+
+
+def _after_rollback(session):
+    '''
+    Forgets the packages marked as published during a transaction that has
+    been rolled back, as their markers weren't changed after all.
+    '''
+    session.info.pop(_published_key, None)
+
+
+def _remember_on_commit(pkg_id):
+    '''
+    Calls _remember for the package once the current transaction has been
+    committed.
+    :param pkg_id: The package ID.
+    '''
+    session = model.Session()
+    if not event.contains(session, 'after_commit', _after_commit):
+        event.listen(session, 'after_commit', _after_commit)
+        event.listen(session, 'after_rollback', _after_rollback)
+    session.info.setdefault(_published_key, set()).add(pkg_id)
+
+
+def mark_created(pkg_id, published):
+    '''
+    Starts keeping track of a package that has just been created. Like the
+    other marks made while a package changes, this is part of the current
+    transaction, so it is undone if the change is rolled back.
+    :param pkg_id: The package ID.
+    :param published: True if the package is already active and suitable
+    for tweeting about, False if it is a draft or not suitable yet.
+    '''
+    db.execute_in_transaction(text('INSERT INTO twitter_package_marker '
+                                   '(package_id, first_published) '
+                                   'VALUES (:pkg_id, :now) '
+                                   'ON CONFLICT (package_id) DO NOTHING'),
+                              pkg_id = pkg_id,
+                              now = dt.utcnow() if published else None)
+    if published:
+        _remember_on_commit(pkg_id)
+
+
+def mark_unpublished(pkg_id):
+    '''
+    Records that an existing package hasn't been published yet (it is a
+    draft or not suitable for tweeting about), so that it counts as new when
+    it is. Packages created before the plugin was installed only get a
+    marker this way; those that were already published never do, so they
+    aren't mistaken for new ones.
+    :param pkg_id: The package ID.
+    '''
+    db.execute_in_transaction(text('INSERT INTO twitter_package_marker '
+                                   '(package_id, first_published) '
+                                   'VALUES (:pkg_id, NULL) '
+                                   'ON CONFLICT (package_id) DO NOTHING'),
+                              pkg_id = pkg_id)
+    with _lock:
+        _published.discard(pkg_id)
+
+
+def mark_published(pkg_id):
+    '''
+    Records that the package has just been published (i.e. become active
+    and suitable for tweeting about), if it is known not to have been
+    before. A package without a marker was created before the plugin was
+    installed, so it is left alone.
+    :param pkg_id: The package ID.
+    '''
+    if pkg_id in _published:
+        return
+    db.execute_in_transaction(text('UPDATE twitter_package_marker '
+                                   'SET first_published = :now '
+                                   'WHERE package_id = :pkg_id '
+                                   'AND first_published IS NULL'),
+                              pkg_id = pkg_id, now = dt.utcnow())
+    _remember_on_commit(pkg_id)
+
+
+def mark_tweeted(pkg_id):
+    '''
+    Records that a tweet about the package has been posted, unless one has
+    been before.
+    :param pkg_id: The package ID.
+    '''
+    db.execute(text('UPDATE twitter_package_marker SET first_tweeted = :now '
+                    'WHERE package_id = :pkg_id AND first_tweeted IS NULL'),
+               pkg_id = pkg_id, now = dt.utcnow())
+
+
+def is_new(pkg_id):
+    '''
+    Tests to see if the package is "new", i.e. it has not been published
+    yet (it's still a draft) or its most recent update is the one that
+    published it. This is a single lookup by primary key, however much
+    activity the package has.
+    :param pkg_id: The package ID.
+    :return: boolean
+    '''
+    row = db.execute(text('SELECT p.state, p.metadata_modified, '
+                          'm.first_published FROM package p '
+                          'LEFT JOIN twitter_package_marker m '
+                          'ON m.package_id = p.id WHERE p.id = :pkg_id'),
+                     pkg_id = pkg_id).first()
+    if row is None:
+        return False
+    return _row_is_new(row)
+
+
+def is_new_many(pkg_ids):
+    '''
+    Like is_new, but for several packages at once, in a single query.
+    :param pkg_ids: A list of package IDs.
+    :return: dict of package ID to boolean
+    '''
+    new_packages = {pkg_id: False for pkg_id in pkg_ids}
+    if not new_packages:
+        return new_packages
+    rows = db.execute(text('SELECT p.id, p.state, p.metadata_modified, '
+                           'm.first_published FROM package p '
+                           'LEFT JOIN twitter_package_marker m '
+                           'ON m.package_id = p.id WHERE p.id = ANY(:ids)'),
+                      ids = list(new_packages))
+    for row in rows:
+        new_packages[row['id']] = _row_is_new(row)
+    return new_packages
+
+
+def _row_is_new(row):
+    if row['first_published'] is None:
+        return row['state'] == 'draft'
+    return row['first_published'] >= row['metadata_modified']
+
+
+def clear():
+    '''
+    Removes all markers.
+    '''
+    db.execute(marker_table.delete())
+    with _lock:
+        _published.clear()
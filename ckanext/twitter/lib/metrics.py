@@ -0,0 +1,175 @@
+import threading
+import time
+from collections import OrderedDict
+from contextlib import contextmanager
+
+# set from the config when the plugin is configured; while False, nothing
+# is recorded and every call returns straight away
+enabled = False
+
+registry = OrderedDict()
+
+
+class Counter(object):
+    '''
+    A value that only goes up, optionally split by labels.
+    '''
+    kind = 'counter'
+
+    def __init__(self, name, documentation):
+        self.name = name
+        self.documentation = documentation
+        self._values = {}
+        self._lock = threading.Lock()
+        registry[name] = self
+
+    def inc(self, amount = 1, **labels):
+        '''
+        Increases the value for the given labels.
+        :param amount: The amount to increase by.
+        :param labels: Label names and values.
+        '''
+        if not enabled:
+            return
+        key = tuple(sorted(labels.items()))
+        with self._lock:
+            self._values[key] = self._values.get(key, 0) + amount
+
+    def samples(self):
+        '''
+        :return: list of (name, labels, value)
+        '''
+        with self._lock:
+            return [(self.name, dict(key), value) for key, value in
+                    sorted(self._values.items())]
+
+
+class Histogram(object):
+    '''
+    Counts observed values in cumulative buckets, optionally split by
+    labels.
+    '''
+    kind = 'histogram'
+
+    def __init__(self, name, documentation, buckets = (
+            0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10)):
+        self.name = name
+        self.documentation = documentation
+        self.buckets = tuple(buckets) + (float('inf'),)
+        self._values = {}
+        self._lock = threading.Lock()
+        registry[name] = self
+
+    def observe(self, value, **labels):
+        '''
+        Records an observed value for the given labels.
+        :param value: The value, e.g. a duration in seconds.
+        :param labels: Label names and values.
+        '''
+        if not enabled:
+            return
+        key = tuple(sorted(labels.items()))
+        with self._lock:
+            counts, total = self._values.get(key, ([0] * len(self.buckets),
+                                                   0))
+            for i, bound in enumerate(self.buckets):
+                if value <= bound:
+                    counts[i] += 1
+            self._values[key] = (counts, total + value)
+
+    @contextmanager
+    def time(self, **labels):
+        '''
+        Observes the time taken by the body of a with statement.
+        :param labels: Label names and values.
+        '''
+        if not enabled:
+            yield
+            return
+        start = time.time()
+        try:
+            yield
+        finally:
+            self.observe(time.time() - start, **labels)
+
+    def samples(self):
+        '''
+        :return: list of (name, labels, value)
+        '''
+        samples = []
+        with self._lock:
+            for key, (counts, total) in sorted(self._values.items()):
+                labels = dict(key)
+                for bound, count in zip(self.buckets, counts):
+                    le = '+Inf' if bound == float('inf') else repr(bound)
+                    samples.append((self.name + '_bucket',
+                                    dict(labels, le = le), count))
+                samples.append((self.name + '_sum', labels, total))
+                samples.append((self.name + '_count', labels, counts[-1]))
+        return samples
+
+
+def _format_labels(labels):
+    if not labels:
+        return ''
+    return '{' + ','.join('{0}="{1}"'.format(
+            k, unicode(v).replace('\\', '\\\\').replace('"', '\\"')) for
+                          k, v in sorted(labels.items())) + '}'
+
+
+def exposition():
+    '''
+    Renders every metric in the Prometheus text format.
+    :return: str
+    '''
+    lines = []
+    for metric in registry.values():
+        lines.append('# HELP {0} {1}'.format(metric.name,
+                                              metric.documentation))
+        lines.append('# TYPE {0} {1}'.format(metric.name, metric.kind))
+        for name, labels, value in metric.samples():
+            lines.append('{0}{1} {2}'.format(name, _format_labels(labels),
+                                             repr(float(value))))
+    return '\n'.join(lines) + '\n'
+
+
+def reset():
+    '''
+    Clears all recorded values.
+    '''
+    for metric in registry.values():
+        with metric._lock:
+            metric._values.clear()
+
+
+after_update_seconds = Histogram(
+        'ckanext_twitter_after_update_seconds',
+        'Time spent in the after_update hook.')
+generate_seconds = Histogram(
+        'ckanext_twitter_generate_tweet_seconds',
+        'Time spent generating a tweet, by phase (fetch, count, render).')
+datastore_searches = Histogram(
+        'ckanext_twitter_datastore_searches',
+        'Number of datastore_search calls made per record count.',
+        buckets = (0, 1, 2, 5, 10, 25, 50, 100, 250, 500, 1000))
+api_request_seconds = Histogram(
+        'ckanext_twitter_api_request_seconds',
+        'Latency of requests to the twitter API, by endpoint and status.')
+api_retries = Counter(
+        'ckanext_twitter_api_retries_total',
+        'Requests to the twitter API that were retried, by endpoint.')
+circuit_rejections = Counter(
+        'ckanext_twitter_circuit_rejections_total',
+        'Requests to the twitter API not made because the circuit was open.')
+rate_limited_posts = Counter(
+        'ckanext_twitter_rate_limited_posts_total',
+        'Tweets not sent because the twitter rate limit was used up.')
+duplicate_rejections = Counter(
+        'ckanext_twitter_duplicate_rejections_total',
+        'Tweets not posted because the same text was posted recently.')
+rest_period_rejections = Counter(
+        'ckanext_twitter_rest_period_rejections_total',
+        'Tweets not posted because the dataset was in its rest period.')
+rate_limit_store_operations = Counter(
+        'ckanext_twitter_rate_limit_store_operations_total',
+        'Calls to the rate limit store, by store and operation.')
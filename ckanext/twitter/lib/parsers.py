@@ -1,22 +1,121 @@
+import logging
 import math
+import threading
+import time
+from multiprocessing import TimeoutError
 
 import ckan.logic as logic
-import re
+import ckan.model as model
 from ckan.logic import get_action
-from ckanext.twitter.lib import config_helpers
-from jinja2 import Environment
+from ckanext.twitter.lib import cache_helpers, config_helpers, metrics
+from ckanext.twitter.lib.truncation import truncate_author, truncate_field
+from jinja2 import Environment, meta, nodes
+
+logger = logging.getLogger('ckanext.twitter')
 
 tweet_limit = 140
 
+_template_cache = {}
+
+
+def short_number(value):
+    '''
+    A template filter that abbreviates large numbers, e.g. 1234567 to 1.2M.
+    :param value: The number.
+    :return: str (or the value unchanged if it isn't a number)
+    '''
+    if not isinstance(value, (int, long, float)):
+        return value
+    for size, suffix in [(10 ** 9, 'B'), (10 ** 6, 'M'), (10 ** 3, 'k')]:
+        if abs(value) >= size:
+            return '{0:.1f}'.format(value / float(size)).rstrip('0').rstrip(
+                    '.') + suffix
+    return str(value)
+
+
+_environment = Environment()
+_environment.filters['short_number'] = short_number
+
+
+class TweetTemplate(object):
+    '''
+    A compiled tweet template plus the information about it that does not
+    change between renders, i.e. the length of its static text and the
+    variables it refers to.
+    '''
+
+    def __init__(self, format_string):
+        ast = _environment.parse(format_string)
+        self.format_string = format_string
+        self.template = _environment.from_string(ast)
+        self.static_length = len(unicode(self.template.module))
+        self.variables = frozenset(meta.find_undeclared_variables(ast))
+        self.tokens = self._output_tokens(ast)
+
+    def _output_tokens(self, ast):
+        '''
+        Finds the names of the variables that are printed by the template
+        (i.e. used inside {{ }} tags), in the order they first appear.
+        :param ast: The parsed template.
+        :return: tuple
+        '''
+        tokens = []
+        for output in ast.find_all(nodes.Output):
+            for node in output.nodes:
+                if isinstance(node, nodes.Name):
+                    names = [node]
+                else:
+                    names = node.find_all(nodes.Name)
+                for name in names:
+                    if name.name in self.variables and name.name not in tokens:
+                        tokens.append(name.name)
+        return tuple(tokens)
+
+    def render(self, values):
+        '''
+        Renders the template with the given values.
+        :param values: A dictionary of values for the template variables.
+        :return: unicode
+        '''
+        return self.template.render(values)
+
+
+def get_template(format_string):
+    '''
+    Gets the compiled template for the given format string, compiling and
+    caching it on first use. The cache is shared by the whole process.
+    :param format_string: A string with replaceable jinja2 tags.
+    :return: TweetTemplate
+    '''
+    try:
+        return _template_cache[format_string]
+    except KeyError:
+        compiled = TweetTemplate(format_string)
+        _template_cache[format_string] = compiled
+        return compiled
+
+
+def reset_template_cache():
+    '''
+    Clears all compiled templates from the template cache.
+    '''
+    _template_cache.clear()
 
-def extract_info(context, pkg_dict, template_length, tokens):
+
+def extract_info(context, pkg_dict, template_length, tokens,
+                 variables = None, records = None):
     '''
     Creates a simplified dictionary for use in a tweet string template.
     :param context: The current context.
     :param pkg_dict: The package information to be simplified.
     :param template_length: The length of the text in the template (without
     any of the tokens).
-    :param tokens: A list of token names in the template (extracted via regex).
+    :param tokens: A list of token names printed by the template.
+    :param variables: Optionally, the full set of variables referenced by the
+    template. If given, values the template never uses (e.g. the number of
+    records) are not calculated.
+    :param records: Optionally, the number of records in the package if they
+    have already been counted.
     :return: dict
     '''
     # get the values that are simple (i.e. not lists or dicts)
@@ -32,14 +131,18 @@ def extract_info(context, pkg_dict, template_length, tokens):
         simplified[k] = v
 
     # apply specific rules to certain fields
-    simplified[u'records'] = get_number_records(context, pkg_dict['id'])
+    if records is not None:
+        simplified[u'records'] = records
+    elif variables is None or 'records' in variables:
+        simplified[u'records'] = get_number_records(context, pkg_dict['id'],
+                                                    pkg_dict)
     simplified[u'author'] = truncate_author(simplified.get(u'author', 'Anon.'))
 
     # truncate other fields
     other_tokens = [t for t in tokens if
                     t not in ['records', 'author'] and t in simplified.keys()]
     max_total_token = tweet_limit - template_length
-    total_token = sum([len(str(simplified[t])) for t in tokens if
+    total_token = sum([len(unicode(simplified[t])) for t in tokens if
                        t in ['records', 'author']])
     for i in range(len(other_tokens)):
         char_limit = math.floor(
@@ -52,73 +155,162 @@ def extract_info(context, pkg_dict, template_length, tokens):
     return simplified
 
 
-def truncate_author(author):
+def _is_datastore_active(resource):
     '''
-    Shortens the author field using regular expressions.
-    :param author: The full author string.
-    :return: str
+    Checks whether a resource might have records in the datastore. Resources
+    from older CKAN versions don't have the datastore_active flag, so they're
+    assumed to be active.
+    :param resource: The resource dictionary.
+    :return: boolean
     '''
-    sep_rgx = '\s?[,;]\s?'
-    name_sep_rgx = '(?<=[^,;])\s'
-    separators = list(set(re.findall(sep_rgx, author)))
-    name_sep = re.search(name_sep_rgx, author)
-    if len(separators) == 0:
-        return re.split(name_sep_rgx, author)[-1] if name_sep else author
-    first_author = re.split(sep_rgx, author)[0]
-    if len(separators) == 1:
-        first_author = re.split(name_sep_rgx, first_author)[1]
-    return '{0} et al.'.format(first_author)
+    return unicode(resource.get('datastore_active', True)).lower() != 'false'
 
 
-def truncate_field(value, char_limit):
+_pool = None
+_pool_lock = threading.Lock()
+
+
+def _get_pool():
     '''
-    Shortens the given value to a length equal to or less than the character
-    limit and appends a continuation marker.
-    :param value: The value to be truncated.
-    :param char_limit: The maximum number of characters in the output string.
-    :return: str
+    Gets the thread pool used for datastore lookups, creating it on first use.
+    :return: ThreadPool
     '''
-    marker = '[...]'
-    truncated = []
-    if ' ' in value:
-        parts = value.split(' ')
-        for p in parts:
-            if sum([len(i) + 1 for i in truncated]) + len(p) + len(
-                    marker) < char_limit:
-                truncated.append(p)
-            else:
-                break
-        return ' '.join(truncated) + marker
-    return value[:char_limit - len(marker)] + marker
+    global _pool
+    with _pool_lock:
+        if _pool is None:
+            from multiprocessing.pool import ThreadPool
+            _pool = ThreadPool(
+                    config_helpers.get_settings().record_count_workers)
+    return _pool
 
 
-def get_number_records(context, pkg_id):
+def _search_total(context, resource_id):
     '''
-    Counts the total number of records associated with a package.
+    Asks the datastore for the number of records in a resource, without
+    retrieving any of the records themselves.
     :param context: The current context.
-    :param pkg_id: The package ID.
+    :param resource_id: The resource ID.
     :return: int
     '''
-    pkg = get_action('package_show')(context, {
-        'id': pkg_id
-        })
-    resources = pkg.get('resources', None)
-    if not resources or len(resources) == 0:
+    try:
+        resource_data = get_action('datastore_search')(dict(context), {
+            'resource_id': resource_id,
+            'limit': 0
+            })
+        return resource_data.get('total', 0)
+    except logic.NotFound:
         return 0
-    resource_ids = [r['id'] for r in resources]
-    total = 0
-    for rid in resource_ids:
+
+
+def _pooled_search_total(context, resource_id, deadline):
+    '''
+    Runs _search_total in a pool thread, releasing the thread's database
+    session afterwards so it isn't reused by the next lookup. Lookups that
+    are still waiting for a thread when the deadline passes are skipped, so
+    they don't hold up the pool.
+    :param context: The current context.
+    :param resource_id: The resource ID.
+    :param deadline: The time (as from time.time()) after which the total is
+    no longer wanted.
+    :return: int, or None if the lookup was skipped
+    '''
+    if time.time() >= deadline:
+        return None
+    try:
+        return _search_total(context, resource_id)
+    finally:
+        model.Session.remove()
+
+
+def _search_totals(context, resource_ids):
+    '''
+    Looks up the number of records in each of the given datastore resources.
+    The lookups are run concurrently on the thread pool and all of them share
+    one deadline, the configured timeout from now, however many of them are
+    waiting for a thread; any lookup that hasn't finished by then is left
+    out.
+    :param context: The current context.
+    :param resource_ids: A list of resource IDs.
+    :return: dict of resource ID to number of records
+    '''
+    if not resource_ids:
+        return {}
+    timeout = config_helpers.get_settings().record_count_timeout
+    deadline = time.time() + timeout
+    pool = _get_pool()
+    pending = {rid: pool.apply_async(_pooled_search_total,
+                                     (context, rid, deadline))
+               for rid in resource_ids}
+    totals = {}
+    for rid, result in pending.items():
         try:
-            resource_data = get_action('datastore_search')(context, {
-                'resource_id': rid
-                })
-            total += resource_data.get('total', 0)
-        except logic.NotFound:
-            pass
-    return total
+            total = result.get(max(deadline - time.time(), 0))
+        except TimeoutError:
+            total = None
+        if total is None:
+            logger.warn('Timed out counting records in resource ' + rid)
+        else:
+            totals[rid] = total
+    return totals
 
 
-def generate_tweet(context, pkg_id, is_new, force_truncate = True):
+def count_records(context, resource_ids):
+    '''
+    Counts the records in each of the given datastore resources, using the
+    cached count where there is one. Resources that could not be counted in
+    time are given a count of 0 (and not cached).
+    :param context: The current context.
+    :param resource_ids: A list of resource IDs.
+    :return: dict of resource ID to number of records
+    '''
+    totals = {}
+    uncached = []
+    for rid in resource_ids:
+        total = cache_helpers.record_counts.get(rid)
+        if total is None:
+            uncached.append(rid)
+        else:
+            totals[rid] = total
+    metrics.datastore_searches.observe(len(uncached))
+    searched = _search_totals(context, uncached)
+    for rid in uncached:
+        if rid in searched:
+            cache_helpers.record_counts.put(rid, searched[rid])
+        totals[rid] = searched.get(rid, 0)
+    return totals
+
+
+def get_number_records(context, pkg_id, pkg_dict = None):
+    '''
+    Counts the total number of records associated with a package. Resources
+    that are not in the datastore are skipped.
+    :param context: The current context.
+    :param pkg_id: The package ID.
+    :param pkg_dict: Optionally, the already-loaded package dictionary, to
+    avoid requesting it from the API again.
+    :return: int
+    '''
+    if pkg_dict:
+        pkg = pkg_dict
+    else:
+        pkg = get_action('package_show')(context, {
+            'id': pkg_id
+            })
+    return sum(count_records(context, _datastore_resource_ids(pkg)).values())
+
+
+def _datastore_resource_ids(pkg_dict):
+    '''
+    Gets the IDs of the package's resources that might be in the datastore.
+    :param pkg_dict: The package dictionary.
+    :return: list
+    '''
+    return [r['id'] for r in pkg_dict.get('resources', None) or [] if
+            _is_datastore_active(r)]
+
+
+def generate_tweet(context, pkg_id, is_new, force_truncate = True,
+                   pkg_dict = None, records = None):
     '''
     Generates a standard tweet based on template values in the pylons
     config. Does not post the tweet; just generates and returns the text.
@@ -129,22 +321,65 @@ def generate_tweet(context, pkg_id, is_new, force_truncate = True):
     :param force_truncate: If True, enforces an extra check at the end to
     ensure the text is below 140 characters. This should not be necessary as
     other methods account for this, but this is an optional final check.
+    :param pkg_dict: Optionally, the already-loaded package dictionary, to
+    avoid requesting it from the API again. It is passed on to everything
+    else that needs the package.
+    :param records: Optionally, the number of records in the package if they
+    have already been counted.
     :return: str
     '''
-    pkg = get_action('package_show')(context, {
-        'id': pkg_id
-        })
+    if pkg_dict:
+        pkg = pkg_dict
+    else:
+        with metrics.generate_seconds.time(phase = 'fetch'):
+            pkg = get_action('package_show')(context, {
+                'id': pkg_id
+                })
     if pkg.get(u'private', False):
         return
-    format_string = config_helpers.twitter_new_format() \
-        if is_new else \
-        config_helpers.twitter_updated_format()
-    tokens = re.findall('(?:{{ )(\w+)(?:(?:|.+?)? }})', format_string)
-    template = Environment().from_string(format_string)
-    simplified_dict = extract_info(context, pkg,
-                                   len(unicode(template.module)), tokens)
-    rendered = template.render(simplified_dict)
+    settings = config_helpers.get_settings()
+    format_string = settings.new_format if is_new else settings.updated_format
+    template = get_template(format_string)
+    if records is None and 'records' in template.variables:
+        with metrics.generate_seconds.time(phase = 'count'):
+            records = get_number_records(context, pkg['id'], pkg)
+    with metrics.generate_seconds.time(phase = 'render'):
+        simplified_dict = extract_info(context, pkg, template.static_length,
+                                       template.tokens, template.variables,
+                                       records)
+        rendered = template.render(simplified_dict)
     # extra check to make sure the tweet isn't too long
     if len(rendered) > tweet_limit and force_truncate:
         rendered = rendered[:tweet_limit]
     return rendered
+
+
+def generate_tweets(context, pkg_dicts, is_new, force_truncate = True):
+    '''
+    Generates tweets for several already-loaded packages at once. The records
+    in all of the packages are counted in a single pass before any tweets are
+    rendered.
+    :param context: The current context.
+    :param pkg_dicts: A list of package dictionaries.
+    :param is_new: A dictionary of package ID to True if that package is new
+    or False if it has been updated.
+    :param force_truncate: See generate_tweet.
+    :return: dict of package ID to tweet text (None for private packages)
+    '''
+    settings = config_helpers.get_settings()
+    uses_records = any('records' in get_template(f).variables for f in
+                       [settings.new_format, settings.updated_format])
+    totals = {}
+    if uses_records:
+        resource_ids = [rid for pkg in pkg_dicts if not pkg.get(u'private')
+                        for rid in _datastore_resource_ids(pkg)]
+        totals = count_records(context, resource_ids)
+    tweets = {}
+    for pkg in pkg_dicts:
+        records = sum(totals.get(rid, 0) for rid in
+                      _datastore_resource_ids(pkg)) if uses_records else None
+        tweets[pkg['id']] = generate_tweet(context, pkg['id'],
+                                           is_new.get(pkg['id'], False),
+                                           force_truncate, pkg_dict = pkg,
+                                           records = records)
+    return tweets
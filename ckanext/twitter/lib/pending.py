@@ -0,0 +1,55 @@
+from ckanext.twitter.lib import db
+from sqlalchemy import Column, DateTime, MetaData, Table, UnicodeText, text
+
+pending_table = Table('twitter_pending', MetaData(),
+                      Column('user_name', UnicodeText, primary_key = True),
+                      Column('package_id', UnicodeText, nullable = False),
+                      Column('expires', DateTime, nullable = False))
+
+# the number of seconds the tweet prompt waits for its package page to be
+# shown
+pending_ttl = 600
+
+
+def mark(user_name, pkg_id):
+    '''
+    Records that the user has just updated a package that can be tweeted
+    about, so the next time they see its page they are asked to tweet. Each
+    user has at most one pending tweet. This is part of the current
+    transaction, so nobody is asked about an update that is rolled back.
+    :param user_name: The name of the user who updated the package.
+    :param pkg_id: The package ID.
+    '''
+    db.execute_in_transaction(text('INSERT INTO twitter_pending (user_name, '
+                                   'package_id, expires) '
+                                   'VALUES (:user_name, :pkg_id, '
+                                   'now() + :ttl * interval \'1 second\') '
+                                   'ON CONFLICT (user_name) DO UPDATE '
+                                   'SET package_id = EXCLUDED.package_id, '
+                                   'expires = EXCLUDED.expires'),
+                              user_name = user_name, pkg_id = pkg_id,
+                              ttl = pending_ttl)
+
+
+def pop(user_name, pkg_id):
+    '''
+    Checks whether the user has a pending tweet about the package and, if
+    so, removes it so they are only asked once. A single lookup by primary
+    key.
+    :param user_name: The name of the user viewing the package.
+    :param pkg_id: The package ID.
+    :return: boolean
+    '''
+    result = db.execute(text('DELETE FROM twitter_pending '
+                             'WHERE user_name = :user_name '
+                             'AND package_id = :pkg_id AND expires > now() '
+                             'RETURNING package_id'), user_name = user_name,
+                        pkg_id = pkg_id)
+    return result.first() is not None
+
+
+def clear():
+    '''
+    Removes all pending tweets.
+    '''
+    db.execute(pending_table.delete())
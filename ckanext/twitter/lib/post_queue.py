@@ -0,0 +1,206 @@
+import logging
+import threading
+import time
+import uuid
+from Queue import Queue
+from collections import OrderedDict
+from datetime import timedelta
+
+from ckan.plugins import toolkit
+from ckanext.twitter.lib import config_helpers, twitter_api
+
+logger = logging.getLogger('ckanext.twitter')
+
+
+def post_job(tweet_text, pkg_id):
+    '''
+    Posts a tweet from a background worker.
+    :param tweet_text: The text to post.
+    :param pkg_id: The package ID (for caching).
+    :return: dict describing the result
+    '''
+    posted, reason = twitter_api.post_tweet(tweet_text, pkg_id)
+    return {
+        'success': posted,
+        'reason': reason,
+        'tweet': tweet_text
+        }
+
+
+class ThreadQueue(object):
+    '''
+    A queue of tweets that are posted one at a time by a worker thread inside
+    the web process. Job statuses are kept in memory, so this is only suitable
+    for single-process deployments and for testing.
+    '''
+
+    def __init__(self, max_jobs = 1000):
+        self.max_jobs = max_jobs
+        self._queue = Queue()
+        self._jobs = OrderedDict()
+        self._lock = threading.Lock()
+        self._worker = None
+
+    def _set_status(self, job_id, status, result = None):
+        with self._lock:
+            # keeps what is already known about the job, e.g. its package
+            job = self._jobs.pop(job_id, {})
+            job.update(result or {})
+            job['status'] = status
+            self._jobs[job_id] = job
+            while len(self._jobs) > self.max_jobs:
+                self._jobs.popitem(last = False)
+
+    def _start_worker(self):
+        with self._lock:
+            if self._worker is None or not self._worker.is_alive():
+                self._worker = threading.Thread(target = self._work,
+                                                name = 'twitter-post-queue')
+                self._worker.daemon = True
+                self._worker.start()
+
+    def _work(self):
+        while True:
+            job_id, tweet_text, pkg_id = self._queue.get()
+            self._set_status(job_id, 'started')
+            try:
+                self._set_status(job_id, 'finished',
+                                 post_job(tweet_text, pkg_id))
+            except Exception as e:
+                logger.exception('Queued tweet failed: ' + tweet_text)
+                self._set_status(job_id, 'failed', {
+                    'success': False,
+                    'reason': str(e),
+                    'tweet': tweet_text
+                    })
+            finally:
+                self._queue.task_done()
+
+    def _put(self, job_id, tweet_text, pkg_id):
+        self._set_status(job_id, 'queued', {
+            'package_id': pkg_id
+            })
+        self._start_worker()
+        self._queue.put((job_id, tweet_text, pkg_id))
+
+    def enqueue(self, tweet_text, pkg_id, delay = 0):
+        '''
+        Adds a tweet to the queue.
+        :param tweet_text: The text to post.
+        :param pkg_id: The package ID (for caching).
+        :param delay: Optionally, the number of seconds to wait before adding
+        it; until then its status is 'scheduled'.
+        :return: str job ID
+        '''
+        job_id = str(uuid.uuid4())
+        if delay > 0:
+            self._set_status(job_id, 'scheduled', {
+                'package_id': pkg_id,
+                'scheduled_for': time.time() + delay
+                })
+            timer = threading.Timer(delay, self._put,
+                                    [job_id, tweet_text, pkg_id])
+            timer.daemon = True
+            timer.start()
+        else:
+            self._put(job_id, tweet_text, pkg_id)
+        return job_id
+
+    def status(self, job_id):
+        '''
+        Gets the status, the package and, once it has finished, the result of
+        a job. Only jobs queued by this process are known.
+        :param job_id: The job ID.
+        :return: dict, or None if the job is not known
+        '''
+        with self._lock:
+            job = self._jobs.get(job_id)
+            return dict(job) if job is not None else None
+
+    def join(self):
+        '''
+        Blocks until every queued tweet has been processed.
+        '''
+        self._queue.join()
+
+
+class JobQueue(object):
+    '''
+    Posts tweets using CKAN's background job queue (available from CKAN 2.7),
+    which is backed by Redis and processed by "paster jobs worker". Tweets
+    that have to wait are scheduled with rq-scheduler if it is installed
+    (its "rqscheduler" process moves them to the queue when they are due);
+    otherwise they wait in the web process, as with ThreadQueue.
+    '''
+
+    def enqueue(self, tweet_text, pkg_id, delay = 0):
+        '''
+        Adds a tweet to the queue.
+        :param tweet_text: The text to post.
+        :param pkg_id: The package ID (for caching).
+        :param delay: Optionally, the number of seconds to wait before adding
+        it; until then its status is 'scheduled'.
+        :return: str job ID
+        '''
+        if delay > 0:
+            return self._schedule(tweet_text, pkg_id, delay)
+        job = toolkit.enqueue_job(post_job, [tweet_text, pkg_id],
+                                  title = 'Tweet about ' + pkg_id)
+        return job.id
+
+    def _schedule(self, tweet_text, pkg_id, delay):
+        '''
+        Adds a tweet to the queue once the delay is over, without holding up
+        a worker in the meantime.
+        :return: str job ID
+        '''
+        try:
+            from rq_scheduler import Scheduler
+        except ImportError:
+            return get_queue('thread').enqueue(tweet_text, pkg_id, delay)
+        from ckan.lib import jobs
+        queue = jobs.get_queue()
+        scheduler = Scheduler(queue = queue, connection = queue.connection)
+        job = scheduler.enqueue_in(timedelta(seconds = delay), post_job,
+                                   tweet_text, pkg_id)
+        return job.id
+
+    def status(self, job_id):
+        '''
+        Gets the status, the package and, once it has finished, the result of
+        a job. Tweets waiting in the web process (see _schedule) are only
+        known to the process that queued them.
+        :param job_id: The job ID.
+        :return: dict, or None if the job is not known
+        '''
+        from ckan.lib import jobs
+        try:
+            job = jobs.job_from_id(job_id)
+        except KeyError:
+            return get_queue('thread').status(job_id)
+        # jobs that rq-scheduler hasn't queued yet have no status
+        return dict(job.result or {}, status = job.get_status() or
+                    'scheduled', package_id = job.args[1])
+
+
+_queues = {
+    'thread': ThreadQueue,
+    'jobs': JobQueue
+    }
+_instances = {}
+
+
+def get_queue(backend = None):
+    '''
+    Gets the queue configured by ckanext.twitter.post_queue, if any.
+    :param backend: Optionally, the name of the queue to get instead.
+    :return: ThreadQueue, JobQueue or None if tweets are posted immediately
+    '''
+    backend = backend or config_helpers.get_settings().post_queue
+    if not backend:
+        return None
+    if backend not in _instances:
+        if backend not in _queues:
+            raise ValueError('Unknown tweet queue: {0}'.format(backend))
+        _instances[backend] = _queues[backend]()
+    return _instances[backend]
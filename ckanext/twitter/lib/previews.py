@@ -0,0 +1,132 @@
+import logging
+import threading
+
+import ckan.model as model
+from ckan.logic import NotFound, get_action
+from ckanext.twitter.lib import (cache_helpers, config_helpers, markers,
+                                 parsers)
+from sqlalchemy import event
+
+logger = logging.getLogger('ckanext.twitter')
+
+# a separate pool from the record count lookups, which generation waits on
+_pool = None
+_pool_lock = threading.Lock()
+
+
+def _get_pool():
+    '''
+    Gets the thread pool used for generating tweets in the background,
+    creating it on first use.
+    :return: ThreadPool
+    '''
+    global _pool
+    with _pool_lock:
+        if _pool is None:
+            from multiprocessing.pool import ThreadPool
+            _pool = ThreadPool(1)
+    return _pool
+
+
+def _key(pkg_dict):
+    '''
+    The cache key for a package's tweet. Any change to the package updates
+    metadata_modified, so a tweet for an older version is never found.
+    :param pkg_dict: The package dictionary.
+    :return: tuple
+    '''
+    return pkg_dict['id'], pkg_dict.get('metadata_modified')
+
+
+def generate(context, pkg_id):
+    '''
+    Generates the tweet for the current version of the package and stores it
+    for get().
+    :param context: The current context.
+    :param pkg_id: The package ID.
+    :return: str, or None if the package should not be tweeted about
+    '''
+    try:
+        pkg_dict = get_action('package_show')(dict(context), {
+            'id': pkg_id
+            })
+    except NotFound:
+        return None
+    tweet_text = parsers.generate_tweet(context, pkg_id,
+                                        markers.is_new(pkg_id),
+                                        pkg_dict = pkg_dict)
+    cache_helpers.tweet_previews.put(_key(pkg_dict), tweet_text)
+    return tweet_text
+
+
+def _background_generate(context, pkg_id):
+    '''
+    Runs generate() on the pool, logging rather than raising any errors.
+    '''
+    try:
+        generate(context, pkg_id)
+    except Exception:
+        logger.exception('Could not generate tweet for ' + pkg_id)
+    finally:
+        model.Session.remove()
+
+
+# the packages to generate tweets for once a session's transaction is
+# committed, in session.info
+_pending_key = 'twitter_previews'
+
+
+def _after_commit(session):
+    '''
+    Starts generating the tweets scheduled during the transaction that has
+    just been committed.
+    '''
+    for pkg_id, user in session.info.pop(_pending_key, {}).items():
+        background_context = {
+            'model': model,
+            'session': model.Session,
+            'user': user,
+            'ignore_auth': True
+            }
+        _get_pool().apply_async(_background_generate,
+                                (background_context, pkg_id))
+
+
+def _after_rollback(session):
+    '''
+    Forgets the tweets scheduled during a transaction that has been rolled
+    back, as the packages weren't changed after all.
+    '''
+    session.info.pop(_pending_key, None)
+
+
+def schedule(context, pkg_id):
+    '''
+    Generates the package's tweet in the background once the current
+    transaction has been committed, so it is (usually) ready before the
+    package page is shown. Nothing is generated if the transaction is rolled
+    back instead.
+    :param context: The current context.
+    :param pkg_id: The package ID.
+    '''
+    if config_helpers.get_settings().preview_ttl == 0:
+        return
+    session = model.Session()
+    # generating before the commit would read the previous version; each
+    # session gets one pair of listeners, however many packages it changes
+    if not event.contains(session, 'after_commit', _after_commit):
+        event.listen(session, 'after_commit', _after_commit)
+        event.listen(session, 'after_rollback', _after_rollback)
+    session.info.setdefault(_pending_key, {})[pkg_id] = context.get('user')
+
+
+def get(pkg_dict):
+    '''
+    Gets the tweet generated in the background for this version of the
+    package.
+    :param pkg_dict: The package dictionary.
+    :return: str, or None if there isn't one
+    '''
+    if not pkg_dict or not pkg_dict.get('metadata_modified'):
+        return None
+    return cache_helpers.tweet_previews.get(_key(pkg_dict))
@@ -0,0 +1,178 @@
+import threading
+import time
+
+import pylons
+from ckanext.twitter.lib import config_helpers, db
+from sqlalchemy import Column, DateTime, MetaData, Table, UnicodeText, text
+
+rate_limit_table = Table('twitter_rate_limit', MetaData(),
+                         Column('package_id', UnicodeText, primary_key = True),
+                         Column('expires', DateTime, nullable = False))
+
+
+class MemoryStore(object):
+    '''
+    Keeps rest periods in memory. Each process has its own store, so this is
+    only consistent for single-process deployments.
+    '''
+
+    def __init__(self):
+        self._expires = {}
+        self._lock = threading.Lock()
+
+    def acquire(self, pkg_id, seconds):
+        '''
+        Atomically checks that the package is not in a rest period and, if
+        it isn't, starts a new one.
+        :param pkg_id: The package ID.
+        :param seconds: The length of the rest period.
+        :return: boolean; True if the package can be tweeted about now
+        '''
+        now = time.time()
+        with self._lock:
+            if self._expires.get(pkg_id, 0) > now:
+                return False
+            self._expires[pkg_id] = now + seconds
+            return True
+
+    def mark(self, pkg_id, seconds):
+        '''
+        Starts a new rest period for the package, whether or not it is
+        already in one.
+        :param pkg_id: The package ID.
+        :param seconds: The length of the rest period.
+        '''
+        with self._lock:
+            self._expires[pkg_id] = time.time() + seconds
+
+    def release(self, pkg_id):
+        '''
+        Ends the package's rest period, e.g. because posting failed.
+        :param pkg_id: The package ID.
+        '''
+        with self._lock:
+            self._expires.pop(pkg_id, None)
+
+    def expired(self, pkg_id):
+        '''
+        Checks whether the package's rest period (if any) is over.
+        :param pkg_id: The package ID.
+        :return: boolean
+        '''
+        return self._expires.get(pkg_id, 0) <= time.time()
+
+    def clear(self):
+        '''
+        Ends all rest periods.
+        '''
+        with self._lock:
+            self._expires.clear()
+
+
+class SQLStore(object):
+    '''
+    Keeps rest periods in a table in CKAN's database, so they are shared by
+    every CKAN process. Requires PostgreSQL 9.5 or later. Times come from the
+    database server, so the clocks on the web servers don't need to agree.
+    The table is created by "paster twitter initdb".
+    '''
+
+    def acquire(self, pkg_id, seconds):
+        result = db.execute(text(
+                'INSERT INTO twitter_rate_limit (package_id, expires) '
+                'VALUES (:pkg_id, now() + :seconds * interval \'1 second\') '
+                'ON CONFLICT (package_id) DO UPDATE '
+                'SET expires = EXCLUDED.expires '
+                'WHERE twitter_rate_limit.expires <= now() '
+                'RETURNING package_id'), pkg_id = pkg_id, seconds = seconds)
+        return result.first() is not None
+
+    def mark(self, pkg_id, seconds):
+        db.execute(text(
+                'INSERT INTO twitter_rate_limit (package_id, expires) '
+                'VALUES (:pkg_id, now() + :seconds * interval \'1 second\') '
+                'ON CONFLICT (package_id) DO UPDATE '
+                'SET expires = EXCLUDED.expires'), pkg_id = pkg_id,
+                seconds = seconds)
+
+    def release(self, pkg_id):
+        db.execute(rate_limit_table.delete().where(
+                rate_limit_table.c.package_id == pkg_id))
+
+    def expired(self, pkg_id):
+        result = db.execute(text(
+                'SELECT 1 FROM twitter_rate_limit '
+                'WHERE package_id = :pkg_id AND expires > now()'),
+                pkg_id = pkg_id)
+        return result.first() is None
+
+    def clear(self):
+        db.execute(rate_limit_table.delete())
+
+
+def redis_client():
+    '''
+    Connects to ckanext.twitter.redis_url, or CKAN's own ckan.redis.url if
+    that isn't set.
+    :return: redis.StrictRedis
+    '''
+    import redis
+    url = pylons.config.get('ckanext.twitter.redis_url',
+                            pylons.config.get('ckan.redis.url',
+                                              'redis://localhost:6379/0'))
+    return redis.StrictRedis.from_url(url)
+
+
+class RedisStore(object):
+    '''
+    Keeps rest periods in Redis as keys that expire at the end of the
+    period, so they are shared by every CKAN process. Uses
+    ckanext.twitter.redis_url, or CKAN's own ckan.redis.url if that isn't
+    set.
+    '''
+
+    prefix = 'ckanext-twitter:rest:'
+
+    def __init__(self):
+        self.redis = redis_client()
+
+    def acquire(self, pkg_id, seconds):
+        return bool(self.redis.set(self.prefix + pkg_id, 1,
+                                   px = max(int(seconds * 1000), 1),
+                                   nx = True))
+
+    def mark(self, pkg_id, seconds):
+        self.redis.set(self.prefix + pkg_id, 1,
+                       px = max(int(seconds * 1000), 1))
+
+    def release(self, pkg_id):
+        self.redis.delete(self.prefix + pkg_id)
+
+    def expired(self, pkg_id):
+        return not self.redis.exists(self.prefix + pkg_id)
+
+    def clear(self):
+        keys = list(self.redis.scan_iter(self.prefix + '*'))
+        if keys:
+            self.redis.delete(*keys)
+
+
+_stores = {
+    'memory': MemoryStore,
+    'sql': SQLStore,
+    'redis': RedisStore
+    }
+_instances = {}
+
+
+def get_store():
+    '''
+    Gets the rest period store configured by ckanext.twitter.rate_limit_store.
+    :return: MemoryStore, SQLStore or RedisStore
+    '''
+    backend = config_helpers.get_settings().rate_limit_store
+    if backend not in _instances:
+        if backend not in _stores:
+            raise ValueError('Unknown rate limit store: {0}'.format(backend))
+        _instances[backend] = _stores[backend]()
+    return _instances[backend]
@@ -0,0 +1,171 @@
+import socket
+import threading
+import time
+
+import httplib2
+import oauth2
+from ckanext.twitter.lib import api_limits, config_helpers, metrics
+
+
+class TransportError(Exception):
+    '''
+    Raised when a request to the twitter API could not be completed, e.g.
+    because the connection failed or timed out.
+    '''
+    pass
+
+
+class OAuthTransport(object):
+    '''
+    Sends OAuth1-signed requests to the twitter API. httplib2 connections
+    can't be shared between threads, so each thread gets its own client for
+    each set of credentials; the client keeps its connection (and so its TLS
+    session) open between requests. The consumer and token objects used for
+    signing are created once per set of credentials and shared.
+    '''
+
+    def __init__(self, base_url, timeout):
+        '''
+        :param base_url: The URL all request paths are relative to, e.g.
+        https://api.twitter.com/1.1/ (or the URL of a mock server).
+        :param timeout: The connect and read timeout in seconds.
+        '''
+        self.base_url = base_url.rstrip('/') + '/'
+        self.timeout = timeout
+        self._signers = {}
+        self._lock = threading.Lock()
+        self._local = threading.local()
+
+    def _signer(self, credentials):
+        '''
+        Gets the consumer and token for a set of credentials.
+        :param credentials: (consumer_key, consumer_secret, token_key,
+        token_secret)
+        :return: (oauth2.Consumer, oauth2.Token)
+        '''
+        with self._lock:
+            if credentials not in self._signers:
+                consumer_key, consumer_secret, token_key, token_secret = \
+                    credentials
+                self._signers[credentials] = (
+                    oauth2.Consumer(consumer_key, consumer_secret),
+                    oauth2.Token(token_key, token_secret))
+            return self._signers[credentials]
+
+    def client(self, credentials):
+        '''
+        Gets the current thread's client for a set of credentials, creating
+        it if necessary.
+        :param credentials: (consumer_key, consumer_secret, token_key,
+        token_secret)
+        :return: oauth2.Client
+        '''
+        clients = getattr(self._local, 'clients', None)
+        if clients is None:
+            clients = self._local.clients = {}
+        if credentials not in clients:
+            consumer, token = self._signer(credentials)
+            clients[credentials] = oauth2.Client(consumer, token,
+                                                 timeout = self.timeout)
+        return clients[credentials]
+
+    def _set_timeout(self, client, timeout):
+        '''
+        Sets the timeout for a client's next request, including on the
+        connections it already has open.
+        :param client: The oauth2.Client.
+        :param timeout: The connect and read timeout in seconds.
+        '''
+        client.timeout = timeout
+        for connection in client.connections.values():
+            connection.timeout = timeout
+            if connection.sock is not None:
+                connection.sock.settimeout(timeout)
+
+    def request(self, method, path, params = None, timeout = None):
+        '''
+        Sends a signed request using the credentials in the config. Raises
+        api_limits.BudgetExceeded instead if the rate limit for the endpoint
+        (from the headers of earlier responses) has been used up.
+        :param method: The HTTP method.
+        :param path: The API path, relative to the base URL, e.g.
+        'statuses/update.json'.
+        :param params: Optionally, a dictionary of parameters to send in the
+        request body.
+        :param timeout: Optionally, a shorter timeout (in seconds, more than
+        0) for this request only, e.g. the time left before a deadline.
+        :return: (httplib2.Response, str content)
+        '''
+        credentials = config_helpers.get_settings().credentials
+        api_limits.take(path, credentials)
+        url = self.base_url + path
+        body = ''
+        if params:
+            request = oauth2.Request(method = method, url = url,
+                                     parameters = params)
+            body = request.to_postdata()
+        client = self.client(credentials)
+        self._set_timeout(client, self.timeout if timeout is None else
+                          min(timeout, self.timeout))
+        start = time.time()
+        try:
+            response, content = client.request(url, method, body)
+        except (socket.error, httplib2.HttpLib2Error) as e:
+            metrics.api_request_seconds.observe(time.time() - start,
+                                                endpoint = path,
+                                                status = 'error')
+            # the connection may be broken, so don't reuse it
+            self.reset()
+            raise TransportError('{0} {1} failed: {2}'.format(method, path, e))
+        metrics.api_request_seconds.observe(time.time() - start,
+                                            endpoint = path,
+                                            status = response.status)
+        api_limits.update(path, credentials, response)
+        return response, content
+
+    def reset(self):
+        '''
+        Closes the current thread's clients so that the next request opens a
+        new connection.
+        '''
+        clients = getattr(self._local, 'clients', None) or {}
+        for client in clients.values():
+            for connection in client.connections.values():
+                connection.close()
+        self._local.clients = {}
+
+
+_transport = None
+# the (API URL, timeout) the transport was created with; None if it was
+# given to set_transport()
+_transport_settings = None
+
+
+def get_transport():
+    '''
+    Gets the transport used for all requests to the twitter API, creating it
+    from the config on first use and again if the API URL or timeout have
+    changed since.
+    :return: OAuthTransport
+    '''
+    global _transport, _transport_settings
+    settings = config_helpers.get_settings()
+    current = (settings.api_url, settings.timeout)
+    if _transport is None or (_transport_settings is not None and
+                              _transport_settings != current):
+        _transport = OAuthTransport(*current)
+        _transport_settings = current
+    return _transport
+
+
+def set_transport(transport):
+    '''
+    Replaces the transport, e.g. with one pointing at a mock server. Passing
+    None means the next call to get_transport creates a new one from the
+    config.
+    :param transport: An object with the same request (including its timeout
+    argument) and reset methods as OAuthTransport, or None.
+    '''
+    global _transport, _transport_settings
+    _transport = transport
+    _transport_settings = None
@@ -0,0 +1,82 @@
+import re
+import threading
+from collections import OrderedDict
+
+marker = '[...]'
+
+# separators between authors, e.g. "Smith, J.; Jones, A."
+author_separator = re.compile('\s?[,;]\s?')
+# separators between parts of a single author's name
+name_separator = re.compile('(?<=[^,;])\s')
+
+_authors = OrderedDict()
+_authors_limit = 1024
+_authors_lock = threading.Lock()
+
+
+def _shorten_author(author):
+    '''
+    Shortens the author field to the first author's surname (plus "et al."
+    if there is more than one author).
+    :param author: The full author string.
+    :return: str
+    '''
+    # only need to know if there are none, one or several kinds of separator
+    separators = set()
+    for match in author_separator.finditer(author):
+        separators.add(match.group())
+        if len(separators) > 1:
+            break
+    if len(separators) == 0:
+        return name_separator.split(author)[-1]
+    first_author = author_separator.split(author, 1)[0]
+    if len(separators) == 1:
+        names = name_separator.split(first_author)
+        if len(names) > 1:
+            first_author = names[1]
+    return '{0} et al.'.format(first_author)
+
+
+def truncate_author(author):
+    '''
+    Shortens the author field using regular expressions. Results are cached,
+    as many packages share the same (often long) author strings.
+    :param author: The full author string.
+    :return: str
+    '''
+    with _authors_lock:
+        if author in _authors:
+            shortened = _authors.pop(author)
+            _authors[author] = shortened
+            return shortened
+    shortened = _shorten_author(author)
+    with _authors_lock:
+        _authors[author] = shortened
+        while len(_authors) > _authors_limit:
+            _authors.popitem(last = False)
+    return shortened
+
+
+def truncate_field(value, char_limit):
+    '''
+    Shortens the given value to a length equal to or less than the character
+    limit and appends a continuation marker. Words are kept while they fit,
+    in a single pass over (at most) as many words as could possibly fit.
+    :param value: The value to be truncated.
+    :param char_limit: The maximum number of characters in the output string.
+    :return: str
+    '''
+    char_limit = int(char_limit)
+    if ' ' not in value:
+        return value[:max(char_limit - len(marker), 0)] + marker
+    # every word kept uses at least one character, so no more than
+    # char_limit words need to be looked at
+    parts = value.split(' ', max(char_limit, 0))
+    truncated = []
+    used = 0
+    for p in parts:
+        if used + len(p) + len(marker) >= char_limit:
+            break
+        truncated.append(p)
+        used += len(p) + 1
+    return ' '.join(truncated) + marker
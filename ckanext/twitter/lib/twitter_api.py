@@ -1,84 +1,433 @@
+'''
+Talks to the twitter API: checks the credentials and posts tweets. Loading
+this module also loads the transport and the OAuth and HTTP clients, so
+modules that are loaded to render pages (the plugin, the template helpers,
+the actions and the digest) import it inside the functions that post,
+rather than at the top. Web processes that never post don't load it.
+'''
+import json
 import logging
+import random
+import threading
+import time
+
+from ckanext.twitter.lib import (api_limits, cache_helpers, circuit,
+                                 config_helpers, duplicates, history, markers,
+                                 metrics, transport)
 
-import oauth2
-from beaker.cache import cache_region
-from ckanext.twitter.lib import cache_helpers, config_helpers
 logger = logging.getLogger('ckanext.twitter')
 
 
-@cache_region('twitter', 'client')
 def twitter_client():
     '''
-    Attempts to create a client for accessing the twitter API using the
+    Gets the current thread's client for accessing the twitter API using the
     credentials specified in the configuration file. Does not test for
-    success. Caches the resulting client in the 'twitter' cache.
+    success. Clients are kept by the transport and reused.
     :return: oauth2.Client
     '''
-    consumer_key, consumer_secret, token_key, token_secret = \
-        config_helpers.twitter_get_credentials()
-    consumer = oauth2.Consumer(consumer_key, consumer_secret)
-    token = oauth2.Token(token_key, token_secret)
-    client = oauth2.Client(consumer, token)
-    return client
+    return transport.get_transport().client(
+            config_helpers.twitter_get_credentials())
 
 
-def twitter_authenticate():
+class VerificationCache(object):
     '''
-    Verifies that the client is able to connect to the twitter API.
-    Refreshes any unauthenticated cached client.
-    :return: boolean
+    Remembers when, and for which credentials, the last successful check
+    was made, so that verify_credentials (which is rate limited) only needs
+    to be called again once that is older than the configured TTL or a post
+    has been rejected. Also counts how many verification calls were made and
+    how many were avoided.
     '''
-    authenticated = False
-    while not authenticated:
-        was_cached = 'client' in cache_helpers.twitter_cache
-        client = twitter_client()
-        url = 'https://api.twitter.com/1.1/account/verify_credentials.json'
-        response, content = client.request(url, 'GET')
-        authenticated = response.status == 200
-        if was_cached and not authenticated:
-            cache_helpers.twitter_cache.remove_value('client')
+
+    def __init__(self):
+        self.verified_at = None
+        self.verified_for = None
+        self.calls = 0
+        self.avoided = 0
+        self.failures = 0
+        self._refreshing = False
+        self._lock = threading.Lock()
+
+    def age(self, credentials = None):
+        '''
+        The number of seconds since the credentials were last verified.
+        :param credentials: Optionally, the credentials that must have been
+        verified.
+        :return: float, or None if they are not currently verified
+        '''
+        verified_at = self.verified_at
+        if verified_at is None or (credentials is not None and
+                                   credentials != self.verified_for):
+            return None
+        return time.time() - verified_at
+
+    def record(self, authenticated, credentials = None):
+        '''
+        Records the result of a verification call.
+        :param authenticated: True if the credentials were accepted.
+        :param credentials: The credentials that were checked.
+        '''
+        with self._lock:
+            self.calls += 1
+            if authenticated:
+                self.verified_at = time.time()
+                self.verified_for = credentials
+            else:
+                self.failures += 1
+                self.verified_at = None
+
+    def avoid(self):
+        '''
+        Records that a verification call was skipped.
+        '''
+        with self._lock:
+            self.avoided += 1
+
+    def invalidate(self):
+        '''
+        Forgets the last verification, e.g. because a post was rejected.
+        '''
+        self.verified_at = None
+
+    def refresh(self, verify):
+        '''
+        Re-verifies the credentials in a background thread, unless that is
+        already happening.
+        :param verify: The function that verifies the credentials.
+        '''
+        with self._lock:
+            if self._refreshing:
+                return
+            self._refreshing = True
+
+        def run():
+            try:
+                verify()
+            except Exception:
+                logger.exception('Could not refresh twitter credentials')
+            finally:
+                self._refreshing = False
+
+        thread = threading.Thread(target = run,
+                                  name = 'twitter-verify-credentials')
+        thread.daemon = True
+        thread.start()
+
+    def stats(self):
+        '''
+        Gets the verification counters and the age of the last verification.
+        :return: dict
+        '''
+        return {
+            'calls': self.calls,
+            'avoided': self.avoided,
+            'failures': self.failures,
+            'age': self.age()
+            }
+
+
+verification = VerificationCache()
+
+breaker = circuit.CircuitBreaker()
+# the thresholds the breaker was last configured with
+_breaker_settings = None
+
+
+def _configure_breaker(settings):
+    '''
+    Gives the circuit breaker the thresholds from the settings, if they have
+    changed since it was last configured (which also closes the circuit).
+    :param settings: The current settings.
+    '''
+    global _breaker_settings
+    thresholds = (settings.circuit_failure_rate, settings.circuit_min_calls,
+                  settings.circuit_window, settings.circuit_reset_timeout)
+    if thresholds != _breaker_settings:
+        _breaker_settings = thresholds
+        breaker.configure(*thresholds)
+
+
+def _request(method, path, params = None, deadline = None,
+             retry_errors = True):
+    '''
+    Sends a request to the twitter API through the circuit breaker. Server
+    errors (and, if retry_errors is set, failed connections) are retried a
+    limited number of times, waiting a little longer (with some random
+    jitter) before each attempt, but never past the deadline: no attempt
+    starts after it, and each attempt times out when it is reached. Raises
+    api_limits.BudgetExceeded if the endpoint's rate limit has been used up.
+    :param method: The HTTP method.
+    :param path: The API path, e.g. 'statuses/update.json'.
+    :param params: Optionally, a dictionary of parameters.
+    :param deadline: Optionally, the time (as from time.time()) by which the
+    request must have finished.
+    :param retry_errors: Whether to retry requests that failed without a
+    response. Only safe if repeating the request can't do anything twice.
+    :return: (httplib2.Response, str content)
+    '''
+    settings = config_helpers.get_settings()
+    _configure_breaker(settings)
+    attempt = 0
+    error, result = None, None
+    while True:
+        timeout = None
+        if deadline is not None:
+            timeout = deadline - time.time()
+            if timeout <= 0:
+                break
+        if not breaker.allow():
+            metrics.circuit_rejections.inc()
+            raise circuit.CircuitOpenError(
+                    'twitter API unavailable; retry in {0:.0f}s'.format(
+                            breaker.retry_after()))
+        try:
+            response, content = transport.get_transport().request(
+                    method, path, params, timeout = timeout)
+        except api_limits.BudgetExceeded:
+            # nothing was sent, so this says nothing about the API's health
+            breaker.cancel()
+            raise
+        except transport.TransportError as e:
+            breaker.record(False)
+            if not retry_errors:
+                raise
+            error, result = e, None
         else:
+            failed = response.status >= 500
+            breaker.record(not failed)
+            if not failed:
+                return response, content
+            error, result = None, (response, content)
+        delay = settings.api_retry_backoff * 2 ** attempt * random.uniform(
+                0.5, 1.5)
+        attempt += 1
+        out_of_time = deadline is not None and time.time() + delay >= deadline
+        if attempt > settings.api_retries or out_of_time:
             break
+        metrics.api_retries.inc(endpoint = path)
+        time.sleep(delay)
+    if error is None and result is None:
+        error = transport.TransportError(
+                '{0} {1} not sent: the deadline has passed'.format(method,
+                                                                   path))
+    if error is not None:
+        raise error
+    return result
+
+
+def _verify_credentials(deadline = None):
+    '''
+    Calls the twitter API to check the credentials. Closes the connection if
+    they are not accepted, so the next attempt starts afresh.
+    :param deadline: Optionally, the time by which the check must be done.
+    :return: boolean
+    '''
+    api = transport.get_transport()
+    credentials = config_helpers.get_settings().credentials
+    try:
+        response, content = _request('GET', 'account/verify_credentials.json',
+                                     deadline = deadline)
+        authenticated = response.status == 200
+    except transport.TransportError as e:
+        logger.warn(str(e))
+        authenticated = False
+    if not authenticated:
+        api.reset()
+    verification.record(authenticated, credentials)
     return authenticated
 
 
-def post_tweet(tweet_text, pkg_id):
+def twitter_authenticate(force = False, deadline = None):
     '''
-    Attempts to post the tweet. Returns a boolean success variable and a
-    message describing the reason for the failure/success in posting the tweet.
-    :param tweet_text: The text to post. This is passed in rather than
-    generated inside the method to allow users to change the tweet before
-    posting (if enabled).
-    :param pkg_id: The package ID (for caching).
-    :return: boolean, str
+    Verifies that the client is able to connect to the twitter API. The
+    result is reused (for the same credentials) until it is older than the
+    configured TTL; once it is three quarters of the way there it is
+    refreshed in the background, so requests don't have to wait for it.
+    Raises CircuitOpenError if the API is currently unavailable.
+    :param force: If True, always calls the API.
+    :param deadline: Optionally, the time by which the check must be done.
+    :return: boolean
     '''
-    if config_helpers.twitter_is_debug():
-        logger.debug('Not posted (debug): ' + tweet_text)
-        return False, 'debug'
+    settings = config_helpers.get_settings()
+    ttl = settings.verify_credentials_ttl
+    age = verification.age(settings.credentials)
+    if force or age is None or age >= ttl:
+        return _verify_credentials(deadline)
+    verification.avoid()
+    if age >= ttl * 0.75 and not breaker.is_open():
+        verification.refresh(_verify_credentials)
+    return True
 
-    # if not enough time has passed since the last tweet
-    if not cache_helpers.expired(pkg_id):
-        logger.debug('Not posted (insufficient rest period): ' + tweet_text)
-        return False, 'insufficient rest period'
 
+def _authenticate_and_post(tweet_text, deadline = None):
+    '''
+    Authenticates and posts the tweet, without any checks on whether it
+    should be posted.
+    :param tweet_text: The text to post.
+    :param deadline: Optionally, the time by which posting must be done.
+    :return: boolean, str, and the ID of the tweet (or None)
+    '''
     # if we can't authenticate
-    if not twitter_authenticate():
+    if not twitter_authenticate(deadline = deadline):
         logger.debug('Not posted (not authenticated): ' + tweet_text)
-        return False, 'not authenticated'
+        return False, 'not authenticated', None
 
     # try to actually post
-    client = twitter_client()
-    url = 'https://api.twitter.com/1.1/statuses/update.json'
     params = {
         'status': tweet_text
         }
-    request = oauth2.Request(method = 'POST', url = url, parameters = params)
-    postdata = request.to_postdata()
-    response, content = client.request(url, 'POST', postdata)
+    # a request that failed without a response might still have posted the
+    # tweet, so only server errors (where it wasn't posted) are retried
+    try:
+        response, content = _request('POST', 'statuses/update.json', params,
+                                     deadline = deadline,
+                                     retry_errors = False)
+    except transport.TransportError as e:
+        logger.debug('Not posted (request failed): ' + tweet_text)
+        return False, str(e), None
+    tweet_id = None
     if response.status == 200:
-        cache_helpers.cache(pkg_id)
         logger.debug('Posted successfully: ' + tweet_text)
+        try:
+            tweet_id = json.loads(content).get('id_str')
+        except (ValueError, AttributeError):
+            pass
     else:
         logger.debug('Not posted (tweet unsuccessful): ' + tweet_text)
+    # the credentials were rejected, so check them again before next time
+    if response.status in (401, 403):
+        verification.invalidate()
     return response.status == 200, '{0} {1}'.format(response.status,
-                                                    response.reason)
+                                                    response.reason), tweet_id
+
+
+def post_wait():
+    '''
+    The number of seconds until a tweet can be posted without going over the
+    rate limit.
+    :return: float; 0 if it can be posted now
+    '''
+    return api_limits.wait('statuses/update.json',
+                           config_helpers.get_settings().credentials)
+
+
+def _post(tweet_text, deadline):
+    '''
+    Authenticates and posts the tweet, turning an unavailable API or a used
+    up rate limit into a reason rather than an error.
+    :param tweet_text: The text to post.
+    :param deadline: The time by which posting must be done.
+    :return: boolean, str, the ID of the tweet (or None), and the number of
+    seconds until the rate limit that stopped it resets (or None)
+    '''
+    try:
+        return _authenticate_and_post(tweet_text, deadline) + (None,)
+    except circuit.CircuitOpenError as e:
+        logger.debug('Not posted ({0}): {1}'.format(e, tweet_text))
+        return False, 'deferred', None, None
+    except api_limits.BudgetExceeded as e:
+        metrics.rate_limited_posts.inc()
+        logger.debug('Not posted ({0}): {1}'.format(e, tweet_text))
+        return False, 'rate limited', None, e.retry_after
+
+
+duplicate_reason = 'duplicate of a recent tweet'
+
+
+def _claim_text(tweet_text):
+    '''
+    Checks that the same text hasn't been posted recently, recording it if
+    not.
+    :param tweet_text: The text to post.
+    :return: boolean; True if the tweet can be posted
+    '''
+    if duplicates.claim(tweet_text):
+        return True
+    metrics.duplicate_rejections.inc()
+    logger.debug('Not posted (duplicate): ' + tweet_text)
+    return False
+
+
+def post_tweet(tweet_text, pkg_id):
+    '''
+    Attempts to post the tweet. Returns a boolean success variable and a
+    message describing the reason for the failure/success in posting the tweet.
+    :param tweet_text: The text to post. This is passed in rather than
+    generated inside the method to allow users to change the tweet before
+    posting (if enabled).
+    :param pkg_id: The package ID (for caching).
+    :return: boolean, str ('deferred' if the twitter API is unavailable,
+    'rate limited' if the rate limit has been used up)
+    '''
+    return post_tweet_result(tweet_text, pkg_id)[:2]
+
+
+def post_tweet_result(tweet_text, pkg_id):
+    '''
+    Attempts to post the tweet, as post_tweet does, also saying when to try
+    again if a rate limit (for posting or for checking the credentials)
+    stopped it.
+    :param tweet_text: The text to post.
+    :param pkg_id: The package ID (for caching).
+    :return: boolean, str (as for post_tweet), and the number of seconds
+    until the rate limit resets if the reason is 'rate limited' (otherwise
+    None)
+    '''
+    settings = config_helpers.get_settings()
+    if settings.debug:
+        logger.debug('Not posted (debug): ' + tweet_text)
+        return False, 'debug', None
+
+    # twitter would reject it anyway, so don't spend a request finding out
+    if not _claim_text(tweet_text):
+        return False, duplicate_reason, None
+
+    # if not enough time has passed since the last tweet; otherwise start a
+    # new rest period now so no other process posts about this package
+    if not cache_helpers.reserve(pkg_id):
+        duplicates.release(tweet_text)
+        metrics.rest_period_rejections.inc()
+        logger.debug('Not posted (insufficient rest period): ' + tweet_text)
+        return False, 'insufficient rest period', None
+
+    # end the rest period again if the tweet doesn't get posted
+    try:
+        posted, reason, tweet_id, retry_after = _post(
+                tweet_text, time.time() + settings.post_deadline)
+    except Exception:
+        cache_helpers.release(pkg_id)
+        duplicates.release(tweet_text)
+        raise
+    if posted:
+        markers.mark_tweeted(pkg_id)
+    else:
+        cache_helpers.release(pkg_id)
+        duplicates.release(tweet_text)
+    # tweets that were never sent aren't part of the history
+    if reason not in ('deferred', 'rate limited'):
+        history.record(pkg_id, tweet_text, history.status_posted if posted
+                       else history.status_failed, tweet_id)
+    return posted, reason, retry_after
+
+
+def post_digest(tweet_text):
+    '''
+    Posts a digest tweet. Digests summarise many packages, so there is no
+    rest period.
+    :param tweet_text: The text to post.
+    :return: boolean, str (as for post_tweet)
+    '''
+    settings = config_helpers.get_settings()
+    if settings.debug:
+        logger.debug('Not posted (debug): ' + tweet_text)
+        return False, 'debug'
+    if not _claim_text(tweet_text):
+        return False, duplicate_reason
+    try:
+        posted, reason = _post(tweet_text,
+                               time.time() + settings.post_deadline)[:2]
+    except Exception:
+        duplicates.release(tweet_text)
+        raise
+    if not posted:
+        duplicates.release(tweet_text)
+    return posted, reason
@@ -0,0 +1,169 @@
+import re
+
+from ckan.plugins import toolkit
+from ckanext.twitter.lib import (api_limits, cache_helpers, history, markers,
+                                 parsers as twitter_parsers)
+
+# the number of packages requested from the search index at a time
+search_batch_size = 100
+
+# the most tweets tweet_history returns
+max_history_limit = 100
+
+# package IDs and names only use these characters, so nothing that matches
+# can change the meaning of the search query it's put into
+valid_pkg_id = re.compile(r'^[a-z0-9_-]+$')
+
+
+def record_count_stats(context, data_dict):
+    '''
+    Gets the hit and miss counts and size of the record count cache.
+    :param context: The current context.
+    :param data_dict: Not used.
+    :return: dict
+    '''
+    toolkit.check_access('twitter_record_count_stats', context, data_dict)
+    return cache_helpers.record_counts.stats()
+
+
+def verification_stats(context, data_dict):
+    '''
+    Gets the number of twitter credential checks made, avoided and failed,
+    and the age in seconds of the last successful check.
+    :param context: The current context.
+    :param data_dict: Not used.
+    :return: dict
+    '''
+    toolkit.check_access('twitter_verification_stats', context, data_dict)
+    from ckanext.twitter.lib import twitter_api
+    return twitter_api.verification.stats()
+
+
+def api_stats(context, data_dict):
+    '''
+    Gets the state of the circuit breaker around the twitter API and the
+    number of requests left to each endpoint before its rate limit resets.
+    :param context: The current context.
+    :param data_dict: Not used.
+    :return: dict
+    '''
+    toolkit.check_access('twitter_api_stats', context, data_dict)
+    from ckanext.twitter.lib import twitter_api
+    return {
+        'circuit': twitter_api.breaker.stats(),
+        'rate_limits': api_limits.get_budget().state()
+        }
+
+
+def tweet_history(context, data_dict):
+    '''
+    Gets the most recent tweets posted (or attempted) about a package.
+    :param package_id: The package ID.
+    :type package_id: string
+    :param limit: The maximum number of tweets (default 20, at most 100).
+    :type limit: int
+    :return: list of dicts, newest first
+    '''
+    toolkit.check_access('twitter_tweet_history', context, data_dict)
+    pkg_id = toolkit.get_or_bust(data_dict, 'package_id')
+    try:
+        limit = int(data_dict.get('limit', 20))
+    except ValueError:
+        raise toolkit.ValidationError({
+            'limit': ['must be a whole number']
+            })
+    if not 1 <= limit <= max_history_limit:
+        raise toolkit.ValidationError({
+            'limit': ['must be between 1 and {0}'.format(max_history_limit)]
+            })
+    return history.for_package(pkg_id, limit)
+
+
+def _search_packages(context, pkg_ids):
+    '''
+    Loads packages from the search index in batches, rather than calling
+    package_show for each one.
+    :param context: The current context.
+    :param pkg_ids: A list of package IDs, already checked against
+    valid_pkg_id.
+    :return: list of package dictionaries
+    '''
+    packages = []
+    for i in range(0, len(pkg_ids), search_batch_size):
+        batch = pkg_ids[i:i + search_batch_size]
+        result = toolkit.get_action('package_search')(dict(context), {
+            'fq': 'id:({0})'.format(' OR '.join(
+                    '"{0}"'.format(pkg_id) for pkg_id in batch)),
+            'rows': len(batch)
+            })
+        packages += result['results']
+    return packages
+
+
+def generate_tweets(context, data_dict):
+    '''
+    Generates the tweet text for a list of packages. Packages that can't be
+    found or are private get None instead of a tweet.
+    :param ids: The IDs of the packages.
+    :type ids: list of strings
+    :param is_new: Whether to use the template for new packages (true) or
+    updated packages (false). If not given, this is worked out for each
+    package.
+    :type is_new: boolean
+    :return: dict of package ID to tweet text
+    '''
+    toolkit.check_access('twitter_generate_tweets', context, data_dict)
+    pkg_ids = toolkit.get_or_bust(data_dict, 'ids')
+    if isinstance(pkg_ids, basestring):
+        pkg_ids = [pkg_id.strip() for pkg_id in pkg_ids.split(',')]
+    invalid = [pkg_id for pkg_id in pkg_ids
+               if not isinstance(pkg_id, basestring) or
+               not valid_pkg_id.match(pkg_id)]
+    if invalid:
+        raise toolkit.ValidationError({
+            'ids': ['not a valid package ID: {0}'.format(
+                ', '.join(repr(pkg_id) for pkg_id in invalid))]
+            })
+    packages = _search_packages(context, pkg_ids)
+    if 'is_new' in data_dict:
+        is_new = toolkit.asbool(data_dict['is_new'])
+        new_packages = {pkg['id']: is_new for pkg in packages}
+    else:
+        new_packages = markers.is_new_many([pkg['id'] for pkg in packages])
+    tweets = {pkg_id: None for pkg_id in pkg_ids}
+    tweets.update(twitter_parsers.generate_tweets(context, packages,
+                                                  new_packages))
+    return tweets
+
+
+def _invalidates_record_count(original_action, context, data_dict):
+    '''
+    Runs a datastore action that changes a resource's records, then removes
+    that resource's entry from the record count cache.
+    :param original_action: The datastore action being wrapped.
+    :param context: The current context.
+    :param data_dict: The parameters for the datastore action.
+    :return: the result of the datastore action
+    '''
+    result = original_action(context, data_dict)
+    resource_id = data_dict.get('resource_id')
+    if not resource_id and isinstance(result, dict):
+        resource_id = result.get('resource_id')
+    if resource_id:
+        cache_helpers.record_counts.invalidate(resource_id)
+    return result
+
+
+def datastore_actions():
+    '''
+    Creates chained versions of the datastore actions that change the number
+    of records in a resource, so the record count cache can be invalidated.
+    Chained actions are only available from CKAN 2.7, so on older versions
+    this returns nothing and cached counts only expire after their TTL.
+    :return: dict
+    '''
+    if not hasattr(toolkit, 'chained_action'):
+        return {}
+    chained = toolkit.chained_action(_invalidates_record_count)
+    return {name: chained for name in
+            ['datastore_create', 'datastore_upsert', 'datastore_delete']}
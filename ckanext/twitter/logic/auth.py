@@ -0,0 +1,83 @@
+def record_count_stats(context, data_dict):
+    '''
+    Only sysadmins can see the record count cache statistics.
+    :param context: The current context.
+    :param data_dict: Not used.
+    :return: dict
+    '''
+    return {
+        'success': False
+        }
+
+
+def verification_stats(context, data_dict):
+    '''
+    Only sysadmins can see the credential check statistics.
+    :param context: The current context.
+    :param data_dict: Not used.
+    :return: dict
+    '''
+    return {
+        'success': False
+        }
+
+
+def api_stats(context, data_dict):
+    '''
+    Only sysadmins can see the state of the twitter API.
+    :param context: The current context.
+    :param data_dict: Not used.
+    :return: dict
+    '''
+    return {
+        'success': False
+        }
+
+
+def tweet_history(context, data_dict):
+    '''
+    Only sysadmins can see the history of tweets.
+    :param context: The current context.
+    :param data_dict: Not used.
+    :return: dict
+    '''
+    return {
+        'success': False
+        }
+
+
+def history_export(context, data_dict):
+    '''
+    Only sysadmins can export the history of tweets.
+    :param context: The current context.
+    :param data_dict: Not used.
+    :return: dict
+    '''
+    return {
+        'success': False
+        }
+
+
+def metrics(context, data_dict):
+    '''
+    Only sysadmins can see the plugin's metrics.
+    :param context: The current context.
+    :param data_dict: Not used.
+    :return: dict
+    '''
+    return {
+        'success': False
+        }
+
+
+def generate_tweets(context, data_dict):
+    '''
+    Any logged-in user can generate tweets; only packages they can see are
+    included.
+    :param context: The current context.
+    :param data_dict: Not used.
+    :return: dict
+    '''
+    return {
+        'success': True
+        }
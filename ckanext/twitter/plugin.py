@@ -1,8 +1,13 @@
+import logging
+
 import ckan.plugins as p
-import ckanext.twitter.lib.config_helpers
-from beaker.cache import cache_regions
-from ckan.common import session
-from ckanext.twitter.lib import config_helpers, helpers as twitter_helpers
+from ckanext.twitter.lib import (cache_helpers, config_helpers, db, digest,
+                                 helpers as twitter_helpers, markers,
+                                 metrics, pending, previews)
+from ckanext.twitter.logic import action, auth
+from sqlalchemy.exc import SQLAlchemyError
+
+logger = logging.getLogger('ckanext.twitter')
 
 
 class TwitterPlugin(p.SingletonPlugin):
@@ -14,19 +19,41 @@ class TwitterPlugin(p.SingletonPlugin):
     p.implements(p.IPackageController, inherit = True)
     p.implements(p.ITemplateHelpers, inherit = True)
     p.implements(p.IRoutes, inherit = True)
+    p.implements(p.IActions)
+    p.implements(p.IAuthFunctions)
 
     # IConfigurable
     def configure(self, config):
-        cache_regions.update({
-            'twitter': {
-                'expire':
-                    ckanext.twitter.lib.config_helpers
-                        .twitter_hours_between_tweets(),
-                'type': 'memory',
-                'enabled': True,
-                'key_length': 250
-                }
-            })
+        # raises ValueError here, rather than on first use, if the config is
+        # invalid. The twitter API client isn't imported until a tweet is
+        # posted; it picks up the new settings then
+        settings = config_helpers.reload(config)
+        metrics.enabled = settings.metrics
+        cache_helpers.record_counts.configure(
+                settings.record_count_ttl,
+                settings.record_count_cache_size)
+        cache_helpers.tweet_previews.configure(
+                settings.preview_ttl,
+                cache_helpers.tweet_previews.max_size)
+        self._check_tables()
+
+    def _check_tables(self):
+        '''
+        Creates any of the plugin's tables that are missing, e.g. after an
+        upgrade that adds one, as otherwise every tweet (and, for some
+        tables, every package update) would fail. If that isn't possible,
+        says how to create them instead of stopping CKAN from starting.
+        '''
+        try:
+            missing = db.missing_tables()
+            if missing:
+                logger.warning('Creating missing tables: ' +
+                               ', '.join(missing))
+                db.create_tables()
+        except SQLAlchemyError:
+            logger.exception('Could not check or create the ckanext-twitter '
+                             'tables; run "paster --plugin=ckanext-twitter '
+                             'twitter initdb"')
 
     # IConfigurer
     def update_config(self, config):
@@ -35,17 +62,51 @@ class TwitterPlugin(p.SingletonPlugin):
         # Add resources
         p.toolkit.add_resource('theme/fanstatic', 'ckanext-twitter')
 
+    def _mark(self, context, pkg_dict, is_suitable, created = False):
+        '''
+        Records whether the package has been published (i.e. is active and
+        suitable) yet, so its first publication can be told apart from later
+        updates.
+        '''
+        package = context.get('package')
+        if package is not None and package.id != pkg_dict['id']:
+            package = None
+        state = pkg_dict.get('state', package.state if package else None)
+        published = is_suitable and state == 'active'
+        if created:
+            markers.mark_created(pkg_dict['id'], published)
+        elif published:
+            markers.mark_published(pkg_dict['id'])
+        elif state in ('active', 'draft'):
+            markers.mark_unpublished(pkg_dict['id'])
+
     # IPackageController
+    def after_create(self, context, pkg_dict):
+        self._mark(context, pkg_dict,
+                   twitter_helpers.twitter_pkg_dict_suitable(context,
+                                                             pkg_dict),
+                   created = True)
+
     def after_update(self, context, pkg_dict):
-        is_suitable = twitter_helpers.twitter_pkg_suitable(context,
-                                                           pkg_dict['id'])
-        if is_suitable:
-            try:
-                session.pop('twitter_is_suitable', '')
-                session.setdefault('twitter_is_suitable', pkg_dict['id'])
-                session.save()
-            except TypeError:
-                print "session not iterable"
+        with metrics.after_update_seconds.time():
+            is_suitable = twitter_helpers.twitter_pkg_dict_suitable(
+                    context, pkg_dict)
+            self._mark(context, pkg_dict, is_suitable)
+            if is_suitable:
+                # in digest mode, updates are summarised later instead of
+                # being tweeted about one at a time, so the user isn't asked
+                # to tweet either
+                if config_helpers.get_settings().digest:
+                    digest.add(pkg_dict['id'],
+                               digest.group_key(context, pkg_dict))
+                    return
+                # API updates don't lead to the package page being shown,
+                # so there's no one to ask
+                user_name = context.get('user')
+                if context.get('api_version') or not user_name:
+                    return
+                previews.schedule(context, pkg_dict['id'])
+                pending.mark(user_name, pkg_dict['id'])
 
     # ITemplateHelpers
     def get_helpers(self):
@@ -64,4 +125,64 @@ class TwitterPlugin(p.SingletonPlugin):
                      conditions = {
                          'method': ['POST']
                          })
+        _map.connect('tweet_status', '/dataset/{pkg_id}/tweet/{job_id}',
+                     controller = controller, action = 'status',
+                     conditions = {
+                         'method': ['GET']
+                         })
+        _map.connect('twitter_history', '/twitter/history',
+                     controller = 'ckanext.twitter.controllers.history'
+                                  ':HistoryController',
+                     action = 'export',
+                     conditions = {
+                         'method': ['GET']
+                         })
+        _map.connect('twitter_metrics', '/twitter/metrics',
+                     controller = 'ckanext.twitter.controllers.metrics'
+                                  ':MetricsController',
+                     action = 'metrics',
+                     conditions = {
+                         'method': ['GET']
+                         })
         return _map
+
+    # IActions
+    def get_actions(self):
+        actions = {
+            'twitter_api_stats': action.api_stats,
+            'twitter_generate_tweets': action.generate_tweets,
+            'twitter_record_count_stats': action.record_count_stats,
+            'twitter_tweet_history': action.tweet_history,
+            'twitter_verification_stats': action.verification_stats
+            }
+        if p.plugin_loaded('datastore'):
+            actions.update(action.datastore_actions())
+        return actions
+
+    # IAuthFunctions
+    def get_auth_functions(self):
+        return {
+            'twitter_api_stats': auth.api_stats,
+            'twitter_generate_tweets': auth.generate_tweets,
+            'twitter_history_export': auth.history_export,
+            'twitter_metrics': auth.metrics,
+            'twitter_record_count_stats': auth.record_count_stats,
+            'twitter_tweet_history': auth.tweet_history,
+            'twitter_verification_stats': auth.verification_stats
+            }
+
+
+class TwitterResourcePlugin(p.SingletonPlugin):
+    '''
+    Clears a resource's cached record count when the resource is updated or
+    deleted. A separate plugin because IResourceController's hooks have the
+    same names as IPackageController's.
+    '''
+    p.implements(p.IResourceController, inherit = True)
+
+    # IResourceController
+    def before_update(self, context, current, resource):
+        cache_helpers.record_counts.invalidate(current['id'])
+
+    def before_delete(self, context, resource, resources):
+        cache_helpers.record_counts.invalidate(resource['id'])
@@ -0,0 +1,246 @@
+'''
+Micro-benchmarks for the tweet generation pipeline. These don't need a CKAN
+database: the plugin's calls to get_action are answered by an in-memory
+registry of synthetic packages.
+
+Run with:
+
+    python -m ckanext.twitter.tests.benchmark
+    python -m ckanext.twitter.tests.benchmark --save baseline.json
+    python -m ckanext.twitter.tests.benchmark --compare baseline.json
+
+Comparing exits with a non-zero status if any benchmark is slower than the
+baseline by more than the tolerance, or makes more action calls.
+'''
+import argparse
+import gc
+import json
+import sys
+import time
+from collections import Counter
+
+import mock
+from ckan.logic import NotFound
+from ckanext.twitter.lib import (cache_helpers, helpers as twitter_helpers,
+                                 parsers as twitter_parsers)
+
+
+class FakeActions(object):
+    '''
+    An in-memory stand-in for get_action that serves synthetic packages and
+    datastore totals, and counts how many times each action is called.
+    '''
+
+    def __init__(self, packages, records_per_resource = 1000):
+        self.packages = {p['id']: p for p in packages}
+        self.resources = {r['id'] for p in packages for r in p['resources']}
+        self.records_per_resource = records_per_resource
+        self.calls = Counter()
+
+    def __call__(self, action_name):
+        action = getattr(self, action_name)
+
+        def call(context, data_dict):
+            self.calls[action_name] += 1
+            return action(context, data_dict)
+
+        return call
+
+    def package_show(self, context, data_dict):
+        try:
+            return self.packages[data_dict['id']]
+        except KeyError:
+            raise NotFound()
+
+    def package_search(self, context, data_dict):
+        return {
+            'results': list(self.packages.values())
+            }
+
+    def datastore_search(self, context, data_dict):
+        if data_dict['resource_id'] not in self.resources:
+            raise NotFound()
+        return {
+            'total': self.records_per_resource,
+            'records': []
+            }
+
+
+def synthetic_package(pkg_id, n_resources = 500, n_authors = 200,
+                      n_note_words = 10000):
+    '''
+    Creates a package dictionary that is as awkward as possible for the
+    parsers: a long title, a long author list, long notes and lots of
+    resources.
+    :return: dict
+    '''
+    return {
+        'id': pkg_id,
+        'name': pkg_id,
+        'state': 'active',
+        'private': False,
+        'title': ' '.join(['A very long package title'] * 12),
+        'author': '; '.join('Author{0} Surname{0}'.format(i) for i in
+                            range(n_authors)),
+        'notes': ' '.join('word{0}'.format(i % 50) for i in
+                          range(n_note_words)),
+        'tags': [{
+            'name': 'tag{0}'.format(i)
+            } for i in range(20)],
+        'resources': [{
+            'id': '{0}-resource-{1}'.format(pkg_id, i),
+            'state': 'active',
+            'datastore_active': True
+            } for i in range(n_resources)]
+        }
+
+
+def _measure(function, repeat, setup = None):
+    '''
+    Calls the function repeatedly, timing each call, and counts the objects
+    (of the kinds tracked by the garbage collector) that the calls leave
+    behind, e.g. in caches. The collector is turned off while timing.
+    :return: (list of seconds per call, objects kept per call)
+    '''
+    timings = []
+    gc.collect()
+    gc.disable()
+    try:
+        before = len(gc.get_objects())
+        for i in range(repeat):
+            if setup:
+                setup()
+            start = time.time()
+            function()
+            timings.append(time.time() - start)
+        gc.collect()
+        objects = float(len(gc.get_objects()) - before) / repeat
+    finally:
+        gc.enable()
+    return timings, objects
+
+
+def benchmarks(pkg):
+    '''
+    The benchmarks to run, as (name, function, setup) tuples.
+    '''
+    context = {
+        'user': 'benchmark'
+        }
+    template = twitter_parsers.get_template(
+            '{{ title }} by {{ author }}: {{ notes }} ({{ records }} records)')
+
+    def clear_counts():
+        cache_helpers.record_counts.clear()
+
+    return [
+        ('generate_tweet', lambda: twitter_parsers.generate_tweet(
+                context, pkg['id'], is_new = True), clear_counts),
+        ('generate_tweet (cached counts)',
+         lambda: twitter_parsers.generate_tweet(context, pkg['id'],
+                                                is_new = True), None),
+        ('extract_info', lambda: twitter_parsers.extract_info(
+                context, pkg, template.static_length, template.tokens,
+                template.variables), None),
+        ('truncate_field', lambda: twitter_parsers.truncate_field(
+                pkg['notes'], 100), None),
+        ('truncate_author', lambda: twitter_parsers.truncate_author(
+                pkg['author']), None),
+        ('twitter_pkg_suitable', lambda: twitter_helpers.twitter_pkg_suitable(
+                context, pkg['id']), None)
+        ]
+
+
+def run(repeat = 20):
+    '''
+    Runs every benchmark.
+    :param repeat: The number of times to call each function.
+    :return: dict of benchmark name to results
+    '''
+    pkg = synthetic_package('benchmark-package')
+    fake = FakeActions([pkg])
+    results = {}
+    with mock.patch('ckanext.twitter.lib.parsers.get_action', fake), \
+         mock.patch('ckanext.twitter.lib.helpers.get_action', fake):
+        for name, function, setup in benchmarks(pkg):
+            # warm up (e.g. compile the templates) before measuring
+            function()
+            fake.calls.clear()
+            timings, objects = _measure(function, repeat, setup)
+            timings.sort()
+            results[name] = {
+                'median': timings[len(timings) // 2],
+                'mean': sum(timings) / len(timings),
+                'p95': timings[int(len(timings) * 0.95) - 1],
+                'objects': objects,
+                'actions': {k: float(v) / repeat for k, v in
+                            fake.calls.items()}
+                }
+    return results
+
+
+def compare(results, baseline, tolerance):
+    '''
+    Compares results with a baseline.
+    :return: list of regression messages
+    '''
+    regressions = []
+    for name, result in sorted(results.items()):
+        base = baseline.get(name)
+        if base is None:
+            continue
+        if result['median'] > base['median'] * (1 + tolerance):
+            regressions.append('{0}: median {1:.1f}us vs {2:.1f}us'.format(
+                    name, result['median'] * 1e6, base['median'] * 1e6))
+        for action_name, calls in result['actions'].items():
+            if calls > base['actions'].get(action_name, 0):
+                regressions.append(
+                        '{0}: {1} {2} calls vs {3}'.format(
+                                name, calls, action_name,
+                                base['actions'].get(action_name, 0)))
+    return regressions
+
+
+def report(results, out = sys.stdout):
+    '''
+    Prints a table of results.
+    '''
+    out.write('{0:<32}{1:>12}{2:>12}{3:>12}{4:>12}  {5}\n'.format(
+            'benchmark', 'median us', 'mean us', 'p95 us', 'objects',
+            'actions/call'))
+    for name, result in sorted(results.items()):
+        out.write('{0:<32}{1:>12.1f}{2:>12.1f}{3:>12.1f}{4:>12.1f}  {5}\n'
+                  .format(name, result['median'] * 1e6, result['mean'] * 1e6,
+                          result['p95'] * 1e6, result['objects'],
+                          ', '.join('{0}={1:g}'.format(k, v) for k, v in
+                                    sorted(result['actions'].items())) or
+                          '-'))
+
+
+def main(argv = None):
+    parser = argparse.ArgumentParser(description = __doc__.split('\n')[1])
+    parser.add_argument('--repeat', type = int, default = 20)
+    parser.add_argument('--save', metavar = 'FILE',
+                        help = 'save the results as a baseline')
+    parser.add_argument('--compare', metavar = 'FILE',
+                        help = 'compare the results with a baseline')
+    parser.add_argument('--tolerance', type = float, default = 0.5,
+                        help = 'allowed slowdown against the baseline, '
+                               'e.g. 0.5 for 50%%')
+    args = parser.parse_args(argv)
+    results = run(args.repeat)
+    report(results)
+    if args.save:
+        with open(args.save, 'w') as f:
+            json.dump(results, f, indent = 2, sort_keys = True)
+    if args.compare:
+        with open(args.compare) as f:
+            regressions = compare(results, json.load(f), args.tolerance)
+        for regression in regressions:
+            sys.stderr.write('REGRESSION ' + regression + '\n')
+        return 1 if regressions else 0
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
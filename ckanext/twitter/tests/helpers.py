@@ -3,6 +3,7 @@ import ckan.new_tests.helpers as helpers
 import pylons.config
 from ckan.logic import get_action
 from ckan.new_tests import factories as factories
+from ckanext.twitter.lib import config_helpers, db
 
 
 class DataFactory(object):
@@ -18,6 +19,7 @@ class DataFactory(object):
         self.private_records = None
         self.author = None
         self.title = None
+        db.create_tables()
         self.refresh()
 
     def _package_data(self, is_private = False):
@@ -194,6 +196,8 @@ class DataFactory(object):
         e.g. title string.
         '''
         helpers.reset_db()
+        # resetting drops every table, including the plugin's
+        db.create_tables()
         self.author = 'Test Author'
         self.title = 'A test package'
 
@@ -240,7 +244,8 @@ class DataFactory(object):
 class Configurer(object):
     '''
     A class for easily and consistently accessing, resetting, and otherwise
-    manipulating the current pylons config within tests.
+    manipulating the current pylons config within tests. The plugin's
+    settings are reloaded after every change.
     '''
 
     def __init__(self, debug = True):
@@ -284,6 +289,7 @@ class Configurer(object):
             if key not in self._changed.keys():
                 self._changed[key] = pylons.config.get(key, None)
             pylons.config[key] = value
+        config_helpers.reload()
 
     def remove(self, keys):
         '''
@@ -296,6 +302,7 @@ class Configurer(object):
                 self._changed[k] = pylons.config.get(k, None)
             if k in pylons.config.keys():
                 del pylons.config[k]
+        config_helpers.reload()
 
     def undo(self, key):
         '''
@@ -308,3 +315,4 @@ class Configurer(object):
         else:
             del pylons.config[key]
         del self._changed[key]
+        config_helpers.reload()
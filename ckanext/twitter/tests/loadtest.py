@@ -0,0 +1,315 @@
+'''
+Load tests a running CKAN site with the plugin enabled, end to end. Start
+the mock twitter API (ckanext.twitter.tests.mock_twitter) and point the site
+at it, then run:
+
+    python -m ckanext.twitter.tests.loadtest --url http://localhost:5000
+        --api-key KEY --datasets ID[,ID...] --scenario send
+        --concurrency 1,4,16,64 --duration 30
+        --mock-url http://localhost:8099/
+
+Scenarios:
+
+    send    posts tweets with POST /dataset/{id}/tweet (TweetController.send)
+    page    edits a dataset through the web form (after_update) and then
+            shows its page (tweet_ready and get_tweet), as a user would
+
+The site needs ckanext.twitter.debug = false and
+ckanext.twitter.hours_between_tweets = 0, otherwise every tweet after the
+first is rejected before reaching the API. The page scenario only changes
+the datasets' notes, but as each user has one pending tweet at a time, use
+at least as many datasets as workers. Each concurrency level runs for
+the given duration and reports throughput, p50/p99 latency, the outcomes of
+the requests and how well throughput scales with concurrency; when scaling
+falls well below 100% while latency climbs, the site's workers are
+saturated. With --mock-url, the most requests the mock API was handling at
+once (i.e. workers waiting on twitter) is reported too.
+'''
+import argparse
+import json
+import sys
+import threading
+import time
+from collections import Counter, defaultdict
+
+import requests
+
+
+def percentile(values, p):
+    '''
+    Gets a percentile of some values by the nearest rank.
+    :param values: A sorted list of numbers.
+    :param p: The percentile, 0-100.
+    :return: the value, or None if there are none
+    '''
+    if not values:
+        return None
+    rank = int(round(p / 100.0 * len(values) + 0.5)) - 1
+    return values[min(max(rank, 0), len(values) - 1)]
+
+
+class Recorder(object):
+    '''
+    Collects the latency and outcome of each step of each iteration, from
+    every worker thread.
+    '''
+
+    def __init__(self):
+        self.latencies = defaultdict(list)
+        self.outcomes = defaultdict(Counter)
+        self.iterations = 0
+        self._lock = threading.Lock()
+
+    def record(self, steps):
+        '''
+        :param steps: A list of (step name, seconds, outcome) for one
+        iteration.
+        '''
+        with self._lock:
+            self.iterations += 1
+            for name, seconds, outcome in steps:
+                self.latencies[name].append(seconds)
+                self.outcomes[name][outcome] += 1
+
+    def summary(self, elapsed):
+        '''
+        :param elapsed: The number of seconds the level ran for.
+        :return: dict
+        '''
+        steps = {}
+        for name, latencies in self.latencies.items():
+            latencies = sorted(latencies)
+            steps[name] = {
+                'count': len(latencies),
+                'p50': percentile(latencies, 50),
+                'p99': percentile(latencies, 99),
+                'outcomes': dict(self.outcomes[name])
+                }
+        return {
+            'iterations': self.iterations,
+            'throughput': self.iterations / elapsed,
+            'steps': steps
+            }
+
+
+def _timed(step, outcome, method, *args, **kwargs):
+    '''
+    Makes a request and times it.
+    :param step: The step name.
+    :param outcome: A function that takes the response and describes it.
+    :param method: The bound requests.Session method to call.
+    :return: (step name, seconds, outcome)
+    '''
+    start = time.time()
+    try:
+        response = method(*args, **kwargs)
+    except requests.RequestException as e:
+        return step, time.time() - start, type(e).__name__
+    return step, time.time() - start, outcome(response)
+
+
+def _send_outcome(response):
+    if response.status_code != 200:
+        return 'HTTP {0}'.format(response.status_code)
+    try:
+        return response.json().get('reason') or 'unknown'
+    except ValueError:
+        return 'invalid response'
+
+
+def _page_outcome(response):
+    if response.status_code != 200:
+        return 'HTTP {0}'.format(response.status_code)
+    return 'tweet shown' if 'data-module="confirm-tweet"' in response.text \
+        else 'no tweet'
+
+
+def _status_outcome(response):
+    return 'HTTP {0}'.format(response.status_code)
+
+
+def send_tweet(session, options, n):
+    '''
+    Posts a tweet about one of the datasets. Every tweet is different.
+    '''
+    pkg_id = options.datasets[n % len(options.datasets)]
+    return [_timed('send', _send_outcome, session.post,
+                   '{0}/dataset/{1}/tweet'.format(options.url, pkg_id),
+                   data = {
+                       'tweet_text': 'Load test tweet {0} at {1:.6f}'.format(
+                               n, time.time())
+                       })]
+
+
+# the edit form fields for each dataset, loaded once
+_forms = {}
+
+
+def _form(session, options, pkg_id):
+    '''
+    Gets the fields the dataset edit form would send for a dataset. Only
+    these fields are changed; resources and extras are left alone.
+    :return: dict
+    '''
+    if pkg_id not in _forms:
+        pkg_dict = session.get('{0}/api/3/action/package_show'.format(
+                options.url), params = {
+            'id': pkg_id
+            }).json()['result']
+        form = {key: pkg_dict.get(key) or '' for key in
+                ['name', 'title', 'owner_org', 'license_id', 'url', 'version',
+                 'author', 'author_email', 'maintainer', 'maintainer_email']}
+        form.update({
+            'private': 'True' if pkg_dict.get('private') else 'False',
+            'tag_string': ','.join(tag['name'] for tag in
+                                   pkg_dict.get('tags', [])),
+            # makes CKAN keep the fields the form doesn't include
+            '_ckan_phase': 'dataset_new_1',
+            'save': ''
+            })
+        _forms[pkg_id] = form
+    return dict(_forms[pkg_id])
+
+
+def edit_and_view(session, options, n):
+    '''
+    Edits one of the datasets and then shows its page.
+    '''
+    pkg_id = options.datasets[n % len(options.datasets)]
+    form = _form(session, options, pkg_id)
+    form['notes'] = 'Load test update {0} at {1:.6f}'.format(n, time.time())
+    return [
+        _timed('edit', _status_outcome, session.post,
+               '{0}/dataset/edit/{1}'.format(options.url, pkg_id),
+               data = form, allow_redirects = False),
+        _timed('page', _page_outcome, session.get,
+               '{0}/dataset/{1}'.format(options.url, pkg_id))
+        ]
+
+
+scenarios = {
+    'send': send_tweet,
+    'page': edit_and_view
+    }
+
+
+def _mock_stats(options, reset = False):
+    if not options.mock_url:
+        return None
+    try:
+        return requests.get(options.mock_url.rstrip('/') + '/stats',
+                            params = {
+                                'reset': 1
+                                } if reset else None).json()
+    except (requests.RequestException, ValueError):
+        return None
+
+
+def run_level(scenario, options, concurrency):
+    '''
+    Runs the scenario with a number of worker threads, each going round
+    again as soon as its last iteration has finished, until the duration is
+    up.
+    :return: dict
+    '''
+    recorder = Recorder()
+    counter = iter(xrange(sys.maxint))
+    counter_lock = threading.Lock()
+    stop_at = time.time() + options.duration
+
+    def work():
+        session = requests.Session()
+        if options.api_key:
+            session.headers['Authorization'] = options.api_key
+        while time.time() < stop_at:
+            with counter_lock:
+                n = next(counter)
+            recorder.record(scenario(session, options, n))
+
+    before = _mock_stats(options, reset = True)
+    start = time.time()
+    workers = [threading.Thread(target = work) for i in range(concurrency)]
+    for worker in workers:
+        worker.daemon = True
+        worker.start()
+    for worker in workers:
+        worker.join()
+    result = recorder.summary(time.time() - start)
+    result['concurrency'] = concurrency
+    after = _mock_stats(options)
+    if before is not None and after is not None:
+        result['mock_max_in_flight'] = after['max_in_flight']
+    return result
+
+
+def add_scaling(results):
+    '''
+    Adds how close each level's throughput is to what the first level's
+    would be if it scaled linearly with concurrency.
+    '''
+    first = results[0]
+    per_worker = first['throughput'] / first['concurrency']
+    for result in results:
+        expected = per_worker * result['concurrency']
+        result['scaling'] = result['throughput'] / expected if expected else \
+            None
+
+
+def report(results, out = sys.stdout):
+    '''
+    Prints a table of results, one row per step of each level.
+    '''
+    out.write('{0:>6}{1:>10}{2:>10}{3:>8}{4:>11}{5:>11}{6:>9}  {7}\n'.format(
+            'conc', 'iter/s', 'scaling', 'step', 'p50 ms', 'p99 ms',
+            'mock', 'outcomes'))
+    for result in results:
+        for name, step in sorted(result['steps'].items()):
+            out.write('{0:>6}{1:>10.1f}{2:>10}{3:>8}{4:>11.1f}{5:>11.1f}'
+                      '{6:>9}  {7}\n'.format(
+                    result['concurrency'], result['throughput'],
+                    '-' if result['scaling'] is None else
+                    '{0:.0%}'.format(result['scaling']), name,
+                    step['p50'] * 1000, step['p99'] * 1000,
+                    result.get('mock_max_in_flight', '-'),
+                    ', '.join('{0}={1}'.format(k, v) for k, v in
+                              sorted(step['outcomes'].items()))))
+
+
+def main(argv = None):
+    parser = argparse.ArgumentParser(description = __doc__.split('\n')[1])
+    parser.add_argument('--url', default = 'http://localhost:5000',
+                        help = 'the CKAN site')
+    parser.add_argument('--api-key', help = 'the API key of a user who can '
+                                            'edit the datasets')
+    parser.add_argument('--datasets', required = True,
+                        help = 'comma separated dataset IDs or names')
+    parser.add_argument('--scenario', choices = sorted(scenarios),
+                        default = 'send')
+    parser.add_argument('--concurrency', default = '1,4,16',
+                        help = 'comma separated numbers of workers')
+    parser.add_argument('--duration', type = float, default = 30,
+                        help = 'seconds to run each level for')
+    parser.add_argument('--mock-url',
+                        help = 'the mock twitter API, for its stats')
+    parser.add_argument('--save', metavar = 'FILE',
+                        help = 'save the results as JSON')
+    options = parser.parse_args(argv)
+    options.url = options.url.rstrip('/')
+    options.datasets = [d.strip() for d in options.datasets.split(',')
+                        if d.strip()]
+    scenario = scenarios[options.scenario]
+    results = []
+    for concurrency in [int(c) for c in options.concurrency.split(',')]:
+        sys.stderr.write('Running {0} with {1} workers for {2:g}s\n'.format(
+                options.scenario, concurrency, options.duration))
+        results.append(run_level(scenario, options, concurrency))
+    add_scaling(results)
+    report(results)
+    if options.save:
+        with open(options.save, 'w') as f:
+            json.dump(results, f, indent = 2, sort_keys = True)
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,251 @@
+'''
+A local stand-in for the parts of the twitter API the plugin uses
+(account/verify_credentials.json and statuses/update.json), for load testing
+without posting anything. Latency, error rate and rate limits can be set;
+responses carry the same rate limit headers as twitter's.
+
+Run with:
+
+    python -m ckanext.twitter.tests.mock_twitter --port 8099
+    python -m ckanext.twitter.tests.mock_twitter --latency 0.2 --jitter 0.1
+        --error-rate 0.05 --post-limit 300 --window 900
+
+and point the plugin at it with ckanext.twitter.api_url =
+http://localhost:8099/1.1/ (any credentials are accepted). Request counts
+and the most requests handled at once are served as JSON at /stats
+(/stats?reset=1 starts counting afresh).
+'''
+import argparse
+import json
+import random
+import sys
+import threading
+import time
+import urlparse
+from BaseHTTPServer import BaseHTTPRequestHandler, HTTPServer
+from collections import Counter
+from SocketServer import ThreadingMixIn
+
+verify_path = 'account/verify_credentials.json'
+update_path = 'statuses/update.json'
+
+
+class MockTwitterServer(ThreadingMixIn, HTTPServer):
+    '''
+    Handles each request in its own thread, so slow responses don't hold
+    up other clients.
+    '''
+    daemon_threads = True
+    allow_reuse_address = True
+
+    def __init__(self, address, latency = 0, jitter = 0, error_rate = 0,
+                 limits = None, window = 900):
+        '''
+        :param address: (host, port) to listen on.
+        :param latency: The number of seconds every response is delayed by.
+        :param jitter: Up to this many more seconds are added at random.
+        :param error_rate: The proportion (0-1) of requests that get a 503.
+        :param limits: A dict of API path to the number of requests allowed
+        per window; paths that aren't included aren't limited.
+        :param window: The length of a rate limit window in seconds.
+        '''
+        HTTPServer.__init__(self, address, MockTwitterHandler)
+        self.latency = latency
+        self.jitter = jitter
+        self.error_rate = error_rate
+        self.limits = limits or {}
+        self.window = window
+        self.counts = Counter()
+        self.in_flight = 0
+        self.max_in_flight = 0
+        self._windows = {}
+        self._next_id = 1
+        self._lock = threading.Lock()
+
+    def start(self):
+        '''
+        Serves requests in a background thread.
+        :return: threading.Thread
+        '''
+        thread = threading.Thread(target = self.serve_forever,
+                                  name = 'mock-twitter')
+        thread.daemon = True
+        thread.start()
+        return thread
+
+    @property
+    def url(self):
+        return 'http://{0}:{1}/1.1/'.format(*self.server_address)
+
+    def begin(self):
+        with self._lock:
+            self.in_flight += 1
+            self.max_in_flight = max(self.max_in_flight, self.in_flight)
+
+    def end(self, path, status):
+        with self._lock:
+            self.in_flight -= 1
+            self.counts['{0} {1}'.format(path, status)] += 1
+
+    def take(self, path):
+        '''
+        Uses up one request to the path.
+        :param path: The API path.
+        :return: (allowed, headers); headers is empty if the path isn't
+        limited
+        '''
+        limit = self.limits.get(path)
+        if limit is None:
+            return True, {}
+        now = time.time()
+        with self._lock:
+            window = self._windows.get(path)
+            if window is None or window[1] <= now:
+                window = self._windows[path] = [limit, now + self.window]
+            allowed = window[0] > 0
+            if allowed:
+                window[0] -= 1
+            return allowed, {
+                'x-rate-limit-limit': str(limit),
+                'x-rate-limit-remaining': str(window[0]),
+                'x-rate-limit-reset': str(int(window[1]))
+                }
+
+    def tweet_id(self):
+        with self._lock:
+            self._next_id += 1
+            return str(self._next_id)
+
+    def stats(self, reset = False):
+        '''
+        Gets the number of requests to each path by status, and the most
+        requests that have been handled at once.
+        :param reset: If True, starts counting afresh afterwards.
+        :return: dict
+        '''
+        with self._lock:
+            stats = {
+                'requests': dict(self.counts),
+                'in_flight': self.in_flight,
+                'max_in_flight': self.max_in_flight
+                }
+            if reset:
+                self.counts.clear()
+                self.max_in_flight = self.in_flight
+            return stats
+
+
+class MockTwitterHandler(BaseHTTPRequestHandler):
+    # keep connections open, as the plugin's transport reuses them
+    protocol_version = 'HTTP/1.1'
+    # send each response in one write, rather than a packet per header
+    wbufsize = -1
+
+    def _reply(self, status, body, headers = None):
+        content = json.dumps(body)
+        self.send_response(status)
+        self.send_header('Content-Type', 'application/json')
+        self.send_header('Content-Length', str(len(content)))
+        for name, value in (headers or {}).items():
+            self.send_header(name, value)
+        self.end_headers()
+        self.wfile.write(content)
+
+    def _handle(self, method):
+        length = int(self.headers.get('Content-Length') or 0)
+        body = urlparse.parse_qs(self.rfile.read(length)) if length else {}
+        url = urlparse.urlparse(self.path)
+        path = url.path
+        if path == '/stats':
+            reset = 'reset' in urlparse.parse_qs(url.query)
+            return self._reply(200, self.server.stats(reset))
+        path = path.split('/1.1/', 1)[-1]
+        if (method, path) not in (('GET', verify_path),
+                                  ('POST', update_path)):
+            return self._reply(404, {
+                'errors': [{
+                    'code': 34,
+                    'message': 'Sorry, that page does not exist.'
+                    }]
+                })
+        server = self.server
+        server.begin()
+        status = 500
+        try:
+            time.sleep(server.latency + random.uniform(0, server.jitter))
+            allowed, headers = server.take(path)
+            if not allowed:
+                status = 429
+                return self._reply(status, {
+                    'errors': [{
+                        'code': 88,
+                        'message': 'Rate limit exceeded'
+                        }]
+                    }, headers)
+            if random.random() < server.error_rate:
+                status = 503
+                return self._reply(status, {
+                    'errors': [{
+                        'code': 130,
+                        'message': 'Over capacity'
+                        }]
+                    }, headers)
+            status = 200
+            if path == verify_path:
+                return self._reply(status, {
+                    'id_str': '1',
+                    'screen_name': 'mock'
+                    }, headers)
+            return self._reply(status, {
+                'id_str': server.tweet_id(),
+                'text': body.get('status', [''])[0]
+                }, headers)
+        finally:
+            server.end(path, status)
+
+    def do_GET(self):
+        self._handle('GET')
+
+    def do_POST(self):
+        self._handle('POST')
+
+    def log_message(self, format, *args):
+        pass
+
+
+def main(argv = None):
+    parser = argparse.ArgumentParser(description = __doc__.split('\n')[1])
+    parser.add_argument('--host', default = 'localhost')
+    parser.add_argument('--port', type = int, default = 8099)
+    parser.add_argument('--latency', type = float, default = 0,
+                        help = 'seconds added to every response')
+    parser.add_argument('--jitter', type = float, default = 0,
+                        help = 'up to this many more seconds, at random')
+    parser.add_argument('--error-rate', type = float, default = 0,
+                        help = 'proportion of requests that get a 503')
+    parser.add_argument('--post-limit', type = int,
+                        help = 'posts allowed per window (default unlimited)')
+    parser.add_argument('--verify-limit', type = int,
+                        help = 'credential checks allowed per window '
+                               '(default unlimited)')
+    parser.add_argument('--window', type = float, default = 900,
+                        help = 'length of a rate limit window in seconds')
+    args = parser.parse_args(argv)
+    limits = {}
+    if args.post_limit is not None:
+        limits[update_path] = args.post_limit
+    if args.verify_limit is not None:
+        limits[verify_path] = args.verify_limit
+    server = MockTwitterServer((args.host, args.port), args.latency,
+                               args.jitter, args.error_rate, limits,
+                               args.window)
+    sys.stderr.write('Mock twitter API at {0}\n'.format(server.url))
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        pass
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,52 @@
+import time
+
+import nose
+from ckanext.twitter.lib.api_limits import MemoryBudget, parse_headers
+
+eq_ = nose.tools.eq_
+
+
+class Response(dict):
+    def __init__(self, status, headers):
+        super(Response, self).__init__(headers)
+        self.status = status
+
+
+class TestRateLimitHeaders(object):
+    def test_parses_headers(self):
+        response = Response(200, {
+            'x-rate-limit-remaining': '14',
+            'x-rate-limit-reset': '1500000000',
+            'x-rate-limit-limit': '15'
+            })
+        eq_(parse_headers(response), (14, 1500000000, 15))
+
+    def test_ignores_missing_headers(self):
+        eq_(parse_headers(Response(200, {})), None)
+
+    def test_assumes_limit_reached_on_429(self):
+        remaining, reset, limit = parse_headers(Response(429, {}))
+        eq_(remaining, 0)
+        assert reset > time.time()
+
+
+class TestMemoryBudget(object):
+    def test_allows_unknown_endpoints(self):
+        budget = MemoryBudget()
+        eq_(budget.take('statuses/update.json', 'account'), 0)
+
+    def test_waits_for_reset_when_used_up(self):
+        budget = MemoryBudget()
+        budget.update('statuses/update.json', 'account', 1,
+                      time.time() + 60)
+        eq_(budget.take('statuses/update.json', 'account'), 0)
+        assert budget.take('statuses/update.json', 'account') > 59
+        assert budget.wait('statuses/update.json', 'account') > 59
+        eq_(budget.take('statuses/update.json', 'other-account'), 0)
+        eq_(budget.state()[0]['remaining'], 0)
+
+    def test_allows_requests_after_reset(self):
+        budget = MemoryBudget()
+        budget.update('statuses/update.json', 'account', 0, time.time())
+        eq_(budget.take('statuses/update.json', 'account'), 0)
+        eq_(budget.state(), [])
@@ -1,6 +1,7 @@
 import ckan.new_tests.helpers as helpers
 import ckan.plugins as p
 import ckanext.twitter.lib.config_helpers
+import mock
 import nose
 from ckan.tests.pylons_controller import PylonsTestCase
 from ckanext.twitter.lib import twitter_api
@@ -30,3 +31,30 @@ class TestTwitterAuthentication(PylonsTestCase):
         eq_(is_authenticated, True,
             'Authentication not successful with key: {0} and secret: '
             '{1}'.format(ck, cs))
+
+    def test_reuses_verification(self):
+        credentials = ckanext.twitter.lib.config_helpers \
+            .twitter_get_credentials()
+        twitter_api.verification.invalidate()
+        twitter_api.verification.record(True, credentials)
+        avoided = twitter_api.verification.avoided
+        with mock.patch('ckanext.twitter.lib.twitter_api._verify_credentials'
+                        ) as verify:
+            eq_(twitter_api.twitter_authenticate(), True)
+            eq_(verify.call_count, 0)
+        eq_(twitter_api.verification.avoided, avoided + 1)
+
+    def test_verifies_after_invalidation(self):
+        twitter_api.verification.record(True)
+        twitter_api.verification.invalidate()
+        with mock.patch('ckanext.twitter.lib.twitter_api._verify_credentials',
+                        return_value = True) as verify:
+            eq_(twitter_api.twitter_authenticate(), True)
+            eq_(verify.call_count, 1)
+
+    def test_verifies_new_credentials(self):
+        twitter_api.verification.record(True, ('old', 'old', 'old', 'old'))
+        with mock.patch('ckanext.twitter.lib.twitter_api._verify_credentials',
+                        return_value = False) as verify:
+            eq_(twitter_api.twitter_authenticate(), False)
+            eq_(verify.call_count, 1)
@@ -0,0 +1,194 @@
+import threading
+import time
+
+import ckan.plugins as p
+import nose
+from ckan.logic import get_action
+from ckan.tests.pylons_controller import PylonsTestCase
+from ckanext.twitter.lib import (cache_helpers, db, parsers as twitter_parsers,
+                                 rate_limit)
+from ckanext.twitter.lib.cache_helpers import RecordCountCache
+from ckanext.twitter.lib.rate_limit import MemoryStore, RedisStore, SQLStore
+from ckanext.twitter.tests.helpers import Configurer, DataFactory
+
+eq_ = nose.tools.eq_
+
+
+class TestRecordCountCache(object):
+    def test_gets_stored_value(self):
+        cache = RecordCountCache()
+        cache.put('resource-a', 5)
+        eq_(cache.get('resource-a'), 5)
+        eq_(cache.stats(), {
+            'hits': 1,
+            'misses': 0,
+            'size': 1
+            })
+
+    def test_counts_misses(self):
+        cache = RecordCountCache()
+        eq_(cache.get('resource-a'), None)
+        eq_(cache.misses, 1)
+
+    def test_expires_entries(self):
+        cache = RecordCountCache(ttl = 0)
+        cache.put('resource-a', 5)
+        time.sleep(0.01)
+        eq_(cache.get('resource-a'), None)
+
+    def test_removes_least_recently_used(self):
+        cache = RecordCountCache(max_size = 2)
+        cache.put('resource-a', 1)
+        cache.put('resource-b', 2)
+        cache.get('resource-a')
+        cache.put('resource-c', 3)
+        eq_(cache.get('resource-b'), None)
+        eq_(cache.get('resource-a'), 1)
+        eq_(cache.get('resource-c'), 3)
+
+    def test_invalidates_entries(self):
+        cache = RecordCountCache()
+        cache.put('resource-a', 5)
+        cache.invalidate('resource-a')
+        eq_(cache.get('resource-a'), None)
+
+
+class TestMemoryStore(object):
+    def test_acquires_once_per_rest_period(self):
+        store = MemoryStore()
+        eq_(store.acquire('package-a', 60), True)
+        eq_(store.acquire('package-a', 60), False)
+        eq_(store.expired('package-a'), False)
+
+    def test_acquires_after_rest_period(self):
+        store = MemoryStore()
+        store.acquire('package-a', 0.01)
+        time.sleep(0.02)
+        eq_(store.expired('package-a'), True)
+        eq_(store.acquire('package-a', 60), True)
+
+    def test_acquires_after_release(self):
+        store = MemoryStore()
+        store.acquire('package-a', 60)
+        store.release('package-a')
+        eq_(store.acquire('package-a', 60), True)
+
+    def test_rest_period_longer_than_a_day(self):
+        store = MemoryStore()
+        store.mark('package-a', 48 * 3600)
+        eq_(store.expired('package-a'), False)
+
+
+class SharedStoreTests(object):
+    '''
+    Tests for the stores shared by every process. Subclasses set up
+    self.store.
+    '''
+
+    def teardown(self):
+        self.store.clear()
+
+    def test_acquires_once_per_rest_period(self):
+        eq_(self.store.acquire('package-a', 60), True)
+        eq_(self.store.acquire('package-a', 60), False)
+        eq_(self.store.expired('package-a'), False)
+        eq_(self.store.acquire('package-b', 60), True)
+
+    def test_acquires_after_rest_period(self):
+        self.store.acquire('package-a', 0.01)
+        time.sleep(0.05)
+        eq_(self.store.expired('package-a'), True)
+        eq_(self.store.acquire('package-a', 60), True)
+
+    def test_acquires_after_release(self):
+        self.store.acquire('package-a', 60)
+        self.store.release('package-a')
+        eq_(self.store.expired('package-a'), True)
+        eq_(self.store.acquire('package-a', 60), True)
+
+    def test_mark_starts_rest_period(self):
+        self.store.mark('package-a', 60)
+        eq_(self.store.expired('package-a'), False)
+        eq_(self.store.acquire('package-a', 60), False)
+
+    def test_one_of_concurrent_acquires_succeeds(self):
+        start = threading.Event()
+        results = []
+
+        def acquire():
+            start.wait()
+            results.append(self.store.acquire('package-a', 60))
+
+        threads = [threading.Thread(target = acquire) for i in range(2)]
+        for thread in threads:
+            thread.start()
+        start.set()
+        for thread in threads:
+            thread.join()
+        eq_(sorted(results), [False, True])
+
+
+class TestSQLStore(SharedStoreTests):
+    @classmethod
+    def setup_class(cls):
+        db.create_tables()
+
+    def setup(self):
+        self.store = SQLStore()
+        self.store.clear()
+
+
+class TestRedisStore(SharedStoreTests):
+    @classmethod
+    def setup_class(cls):
+        try:
+            rate_limit.redis_client().ping()
+        except Exception:
+            raise nose.SkipTest('Redis is not available')
+
+    def setup(self):
+        self.store = RedisStore()
+        self.store.clear()
+
+
+class TestCachedRecordCounts(PylonsTestCase):
+    @classmethod
+    def setup_class(cls):
+        super(TestCachedRecordCounts, cls).setup_class()
+        cls.config = Configurer()
+        p.load('datastore')
+        p.load('twitter')
+        p.load('twitter_resources')
+        cls.df = DataFactory()
+
+    def setup(self):
+        cache_helpers.record_counts.clear()
+
+    @classmethod
+    def teardown_class(cls):
+        cls.config.reset()
+        cls.df.destroy()
+        p.unload('datastore')
+        p.unload('twitter')
+        p.unload('twitter_resources')
+
+    def test_second_count_is_cached(self):
+        pkg_dict = self.df.public_records
+        for i in range(2):
+            n_records = twitter_parsers.get_number_records(self.df.context,
+                                                           pkg_dict['id'],
+                                                           pkg_dict)
+            eq_(n_records, 5)
+        stats = cache_helpers.record_counts.stats()
+        eq_(stats['misses'], 1)
+        eq_(stats['hits'], 1)
+
+    def test_resource_update_clears_count(self):
+        pkg_dict = self.df.public_records
+        twitter_parsers.get_number_records(self.df.context, pkg_dict['id'],
+                                           pkg_dict)
+        resource = pkg_dict['resources'][0]
+        eq_(cache_helpers.record_counts.get(resource['id']), 5)
+        get_action('resource_update')(self.df.context,
+                                      dict(resource, name = 'Updated'))
+        eq_(cache_helpers.record_counts.get(resource['id']), None)
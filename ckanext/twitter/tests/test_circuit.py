@@ -0,0 +1,44 @@
+import time
+
+import nose
+from ckanext.twitter.lib.circuit import CircuitBreaker
+
+eq_ = nose.tools.eq_
+
+
+class TestCircuitBreaker(object):
+    def test_stays_closed_below_failure_rate(self):
+        breaker = CircuitBreaker(failure_rate = 0.5, min_calls = 4)
+        for success in [True, True, True, False]:
+            breaker.record(success)
+        eq_(breaker.state, 'closed')
+        eq_(breaker.allow(), True)
+
+    def test_needs_minimum_calls_to_open(self):
+        breaker = CircuitBreaker(min_calls = 3)
+        breaker.record(False)
+        breaker.record(False)
+        eq_(breaker.state, 'closed')
+        breaker.record(False)
+        eq_(breaker.state, 'open')
+        eq_(breaker.allow(), False)
+        eq_(breaker.is_open(), True)
+
+    def test_lets_one_trial_through_when_half_open(self):
+        breaker = CircuitBreaker(min_calls = 1, reset_timeout = 0.01)
+        breaker.record(False)
+        time.sleep(0.02)
+        eq_(breaker.allow(), True)
+        eq_(breaker.state, 'half-open')
+        eq_(breaker.allow(), False)
+        breaker.record(True)
+        eq_(breaker.state, 'closed')
+
+    def test_reopens_after_failed_trial(self):
+        breaker = CircuitBreaker(min_calls = 1, reset_timeout = 0.01)
+        breaker.record(False)
+        time.sleep(0.02)
+        breaker.allow()
+        breaker.record(False)
+        eq_(breaker.state, 'open')
+        eq_(breaker.stats()['opened'], 2)
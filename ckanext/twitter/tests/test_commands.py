@@ -0,0 +1,56 @@
+import ckan.plugins as p
+import nose
+from ckan.tests.pylons_controller import PylonsTestCase
+from ckanext.twitter import commands
+from ckanext.twitter.tests.helpers import Configurer, DataFactory
+
+eq_ = nose.tools.eq_
+
+
+class TestGenerateCommand(PylonsTestCase):
+    @classmethod
+    def setup_class(cls):
+        super(TestGenerateCommand, cls).setup_class()
+        cls.config = Configurer()
+        p.load('datastore')
+        p.load('twitter')
+        cls.df = DataFactory()
+
+    @classmethod
+    def teardown_class(cls):
+        cls.config.reset()
+        cls.df.destroy()
+        p.unload('datastore')
+        p.unload('twitter')
+
+    def test_pages_through_packages(self):
+        pages = list(commands.search_pages(self.df.context, rows = 1))
+        total = pages[0][0]
+        eq_(len(pages), total)
+        assert all(len(packages) == 1 for _, packages in pages)
+
+    def test_generates_for_suitable_packages(self):
+        pkg_ids = [self.df.public_records['id'],
+                   self.df.private_records['id']]
+        pages, missing = commands.show_pages(self.df.context, pkg_ids,
+                                             rows = 1)
+        results = list(commands.generate_pages(self.df.context, pages,
+                                               workers = 2, is_new = True))
+        eq_(len(results), 2)
+        tweets = [tweet for _, _, page in results for tweet in page]
+        eq_([pkg['id'] for pkg, tweet_text in tweets],
+            [self.df.public_records['id']])
+        assert tweets[0][1] is not None
+
+    def test_shows_packages_by_name(self):
+        pages, missing = commands.show_pages(self.df.context, [
+            self.df.public_records['name'],
+            'not-a-real-id',
+            self.df.private_records['id']
+            ])
+        eq_(missing, ['not-a-real-id'])
+        eq_(len(pages), 1)
+        total, packages = pages[0]
+        eq_(total, 2)
+        eq_([pkg['id'] for pkg in packages],
+            [self.df.public_records['id'], self.df.private_records['id']])
@@ -99,3 +99,25 @@ class TestGetConfigVariables(PylonsTestCase):
         config_value = \
             config_helpers.twitter_disable_edit()
         eq_(default_value, config_value)
+
+    def test_parses_disable_edit_string(self):
+        self._set_config_value('disable_edit', True, 'true')
+        eq_(config_helpers.twitter_disable_edit(), True)
+
+    def test_only_reads_config_on_reload(self):
+        self._set_config_value('hours_between_tweets', True, 2)
+        pylons.config['ckanext.twitter.hours_between_tweets'] = 3
+        eq_(config_helpers.twitter_hours_between_tweets(), 2)
+        config_helpers.reload()
+        eq_(config_helpers.twitter_hours_between_tweets(), 3)
+
+    def test_rejects_malformed_values(self):
+        for key, value in [('timeout', 'soon'),
+                           ('record_count_workers', 0),
+                           ('disable_edit', 'maybe'),
+                           ('post_queue', 'celery'),
+                           ('new', '{{ title ')]:
+            nose.tools.assert_raises(ValueError,
+                                     config_helpers.Settings.from_config, {
+                                         'ckanext.twitter.' + key: value
+                                         })
@@ -1,9 +1,11 @@
 import json
 
 import ckan.plugins
+import mock
 import nose
 from ckan.lib.helpers import url_for
 from ckan.new_tests import factories, helpers
+from ckanext.twitter.lib import db, metrics, post_queue, twitter_api
 from ckanext.twitter.tests.helpers import Configurer
 
 eq_ = nose.tools.eq_
@@ -15,6 +17,7 @@ class TestController(object):
         cls.config = Configurer()
         cls.app = helpers._get_test_app()
         ckan.plugins.load('twitter')
+        db.create_tables()
 
     @classmethod
     def teardown_class(cls):
@@ -22,6 +25,15 @@ class TestController(object):
         ckan.plugins.unload('twitter')
         helpers.reset_db()
 
+    def _sysadmin(self):
+        '''
+        The environment for a request made by a new sysadmin.
+        :return: dict
+        '''
+        return {
+            'REMOTE_USER': str(factories.Sysadmin()['name'])
+            }
+
     def test_url_created(self):
         url = url_for('post_tweet', pkg_id = 'not-a-real-id')
         eq_(url, '/dataset/not-a-real-id/tweet')
@@ -43,3 +55,104 @@ class TestController(object):
         eq_(body['reason'], 'debug')
         eq_(body['tweet'], 'this is a test tweet')
         eq_(body['success'], False)
+
+    def test_queued_post_tweet(self):
+        self.config.update({
+            'ckanext.twitter.post_queue': 'thread'
+            })
+        dataset = factories.Dataset(
+                notes = 'Test dataset'
+                )
+        url = url_for('post_tweet', pkg_id = dataset['id'])
+        response = self.app.post(url, {
+            'tweet_text': 'this is a test tweet'
+            })
+        body = json.loads(response.body)
+        eq_(body['queued'], True)
+        post_queue.get_queue().join()
+        status_url = url_for('tweet_status', pkg_id = dataset['id'],
+                             job_id = body['job_id'])
+        sysadmin = self._sysadmin()
+        status = json.loads(self.app.get(status_url,
+                                         extra_environ = sysadmin).body)
+        eq_(status['status'], 'finished')
+        eq_(status['reason'], 'debug')
+        eq_(status['tweet'], 'this is a test tweet')
+        # only for the package the tweet is about
+        other_url = url_for('tweet_status',
+                            pkg_id = factories.Dataset()['id'],
+                            job_id = body['job_id'])
+        other = json.loads(self.app.get(other_url,
+                                        extra_environ = self._sysadmin()).body)
+        eq_(other['status'], 'unknown')
+        # and only for users who can edit it
+        self.app.get(status_url, status = 403)
+        self.config.undo('ckanext.twitter.post_queue')
+
+    def test_rate_limited_tweet_scheduled_for_reset(self):
+        dataset = factories.Dataset()
+        url = url_for('post_tweet', pkg_id = dataset['id'])
+        # e.g. the credential check's limit, which posting's wait misses
+        post = mock.patch.object(twitter_api, 'post_tweet_result',
+                                 return_value = (False, 'rate limited', 600))
+        enqueue = mock.patch.object(post_queue.ThreadQueue, 'enqueue',
+                                    return_value = 'a-job')
+        with post, enqueue as queued:
+            body = json.loads(self.app.post(url, {
+                'tweet_text': 'this is a test tweet'
+                }).body)
+        eq_(body['reason'], 'scheduled')
+        eq_(body['job_id'], 'a-job')
+        eq_(queued.call_args[1]['delay'], 600)
+
+    def test_scheduled_tweet_status_without_post_queue(self):
+        dataset = factories.Dataset()
+        url = url_for('post_tweet', pkg_id = dataset['id'])
+        with mock.patch.object(twitter_api, 'post_tweet_result',
+                               return_value = (False, 'rate limited', 600)):
+            body = json.loads(self.app.post(url, {
+                'tweet_text': 'this is a test tweet'
+                }).body)
+        eq_(body['reason'], 'scheduled')
+        status_url = url_for('tweet_status', pkg_id = dataset['id'],
+                             job_id = body['job_id'])
+        sysadmin = self._sysadmin()
+        status = json.loads(self.app.get(status_url,
+                                         extra_environ = sysadmin).body)
+        eq_(status['status'], 'scheduled')
+
+    def test_unknown_job_status(self):
+        url = url_for('tweet_status', pkg_id = factories.Dataset()['id'],
+                      job_id = 'not-a-real-job')
+        body = json.loads(self.app.get(url,
+                                       extra_environ = self._sysadmin()).body)
+        eq_(body['status'], 'unknown')
+        eq_(body['success'], False)
+
+    def test_job_status_of_unknown_package(self):
+        url = url_for('tweet_status', pkg_id = 'not-a-real-id',
+                      job_id = 'not-a-real-job')
+        self.app.get(url, extra_environ = self._sysadmin(), status = 404)
+
+    def test_deferred_when_circuit_open(self):
+        for i in range(twitter_api.breaker.min_calls):
+            twitter_api.breaker.record(False)
+        url = url_for('post_tweet', pkg_id = 'not-a-real-id')
+        response = self.app.post(url, {
+            'tweet_text': 'this is a test tweet'
+            })
+        twitter_api.breaker.configure(0.5, 5, 60, 30)
+        body = json.loads(response.body)
+        eq_(body['reason'], 'deferred')
+        eq_(body['deferred'], True)
+        eq_(body['success'], False)
+
+    def test_metrics_are_sysadmin_only(self):
+        url = url_for('twitter_metrics')
+        metrics.enabled = True
+        try:
+            self.app.get(url, status = 403)
+            response = self.app.get(url, extra_environ = self._sysadmin())
+        finally:
+            metrics.enabled = False
+        eq_(response.headers['Content-Type'].split(';')[0], 'text/plain')
@@ -1,4 +1,7 @@
+import time
+
 import ckan.plugins as p
+import mock
 import nose
 from ckan.tests.pylons_controller import PylonsTestCase
 from ckanext.twitter.lib import (parsers as twitter_parsers)
@@ -61,3 +64,82 @@ class TestDatasetMetadata(PylonsTestCase):
             access = 'public'
         eq_(pkg_dict['private'], False,
             'Package is actually: {0}'.format(access))
+
+    def test_skips_resources_not_in_datastore(self):
+        pkg_dict = self.df.public_records.copy()
+        pkg_dict['resources'] = [dict(r, datastore_active = False) for r in
+                                 pkg_dict['resources']]
+        n_records = twitter_parsers.get_number_records(self.df.context,
+                                                       pkg_dict['id'],
+                                                       pkg_dict)
+        eq_(n_records, 0,
+            'Calculated number of records: {0}\nActual number: 0'.format(
+                    n_records))
+
+
+class SlowDatastore(object):
+    '''
+    Stands in for datastore_search, taking a set number of seconds to count
+    each resource's records.
+    '''
+
+    def __init__(self, delays):
+        self.delays = delays
+        self.searched = []
+
+    def __call__(self, action_name):
+        return self.search
+
+    def search(self, context, data_dict):
+        self.searched.append(data_dict['resource_id'])
+        time.sleep(self.delays[data_dict['resource_id']])
+        return {
+            'total': 5
+            }
+
+
+class TestRecordCountTimeout(object):
+    @classmethod
+    def setup_class(cls):
+        cls.config = Configurer()
+
+    def setup(self):
+        self.config.update({
+            'ckanext.twitter.record_count_workers': 2,
+            'ckanext.twitter.record_count_timeout': 0.3
+            })
+        twitter_parsers._pool = None
+
+    def teardown(self):
+        # lets any lookups still running finish without waiting for them
+        twitter_parsers._get_pool().close()
+        twitter_parsers._pool = None
+        self.config.reset()
+
+    def test_leaves_out_slow_lookups(self):
+        datastore = SlowDatastore({
+            'resource-a': 0,
+            'resource-b': 2
+            })
+        start = time.time()
+        with mock.patch('ckanext.twitter.lib.parsers.get_action', datastore):
+            totals = twitter_parsers.count_records({}, ['resource-a',
+                                                        'resource-b'])
+        assert time.time() - start < 0.5
+        eq_(totals, {
+            'resource-a': 5,
+            'resource-b': 0
+            })
+
+    def test_one_deadline_for_more_resources_than_workers(self):
+        resource_ids = ['resource-{0}'.format(i) for i in range(6)]
+        datastore = SlowDatastore({rid: 0.2 for rid in resource_ids})
+        start = time.time()
+        with mock.patch('ckanext.twitter.lib.parsers.get_action', datastore):
+            totals = twitter_parsers._search_totals({}, resource_ids)
+            assert time.time() - start < 0.5
+            eq_(len(totals), 2)
+            # the lookups that were still waiting when time ran out are
+            # skipped rather than holding up the pool
+            time.sleep(0.5)
+        eq_(len(datastore.searched), 4)
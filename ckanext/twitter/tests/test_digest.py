@@ -0,0 +1,67 @@
+from datetime import timedelta
+
+import ckan.plugins as p
+import nose
+from ckan.tests.pylons_controller import PylonsTestCase
+from ckanext.twitter.lib import db, digest
+from ckanext.twitter.lib.parsers import short_number
+from ckanext.twitter.tests.helpers import Configurer, DataFactory
+
+eq_ = nose.tools.eq_
+
+
+class TestDigest(PylonsTestCase):
+    @classmethod
+    def setup_class(cls):
+        super(TestDigest, cls).setup_class()
+        cls.config = Configurer()
+        p.load('datastore')
+        p.load('twitter')
+        cls.df = DataFactory()
+
+    def setup(self):
+        self.config.update({
+            'ckanext.twitter.digest': 'organization',
+            'ckanext.twitter.digest_window': 60
+            })
+
+    def teardown(self):
+        self.config.reset()
+
+    @classmethod
+    def teardown_class(cls):
+        cls.config.reset()
+        cls.df.destroy()
+        p.unload('datastore')
+        p.unload('twitter')
+
+    def test_shortens_numbers(self):
+        eq_(short_number(42), '42')
+        eq_(short_number(1234), '1.2k')
+        eq_(short_number(1200000), '1.2M')
+        eq_(short_number(2000000000), '2B')
+
+    def test_renders_digest(self):
+        eq_(digest.render(u'Natural History Museum', 42, 50, 1200000),
+            u'42 datasets updated by Natural History Museum (1.2M records).')
+
+    def test_shortens_long_group_names(self):
+        tweet_text = digest.render(u'Museum ' * 30, 42, 50, 0)
+        assert len(tweet_text) <= 140
+        assert tweet_text.endswith(u'(50 resources).')
+
+    def test_groups_by_organization(self):
+        pkg_dict = self.df.public_records
+        key = digest.group_key({}, pkg_dict)
+        eq_(key, pkg_dict['owner_org'])
+        digest.add(pkg_dict['id'], key)
+        digest.add(pkg_dict['id'], key)
+        eq_(digest.flush(self.df.context), [])
+        # as if the window had ended
+        db.execute(digest.digest_table.update().values(
+                added = digest.digest_table.c.added - timedelta(seconds = 60)))
+        digests = digest.flush(self.df.context)
+        eq_(len(digests), 1)
+        eq_(digests[0]['datasets'], 1)
+        eq_(digests[0]['reason'], 'debug')
+        eq_(digest.flush(self.df.context), [])
@@ -0,0 +1,83 @@
+import time
+
+import nose
+from ckanext.twitter.lib import (api_limits, cache_helpers, db, duplicates,
+                                 history, transport, twitter_api)
+from ckanext.twitter.lib.duplicates import MemoryIndex
+from ckanext.twitter.tests.helpers import Configurer
+from ckanext.twitter.tests.mock_twitter import MockTwitterServer, update_path
+
+eq_ = nose.tools.eq_
+
+
+class TestMemoryIndex(object):
+    def test_claims_once_per_window(self):
+        index = MemoryIndex()
+        eq_(index.claim('tweet-a', 60), True)
+        eq_(index.claim('tweet-a', 60), False)
+        eq_(index.claim('tweet-b', 60), True)
+
+    def test_claims_after_window(self):
+        index = MemoryIndex()
+        index.claim('tweet-a', 0.01)
+        time.sleep(0.02)
+        eq_(index.claim('tweet-a', 60), True)
+
+    def test_claims_after_release(self):
+        index = MemoryIndex()
+        index.claim('tweet-a', 60)
+        index.release('tweet-a')
+        eq_(index.claim('tweet-a', 60), True)
+
+    def test_forgets_oldest_when_full(self):
+        index = MemoryIndex(max_size = 2)
+        for key in ['tweet-a', 'tweet-b', 'tweet-c']:
+            index.claim(key, 60)
+        eq_(index.claim('tweet-a', 60), True)
+        eq_(index.claim('tweet-c', 60), False)
+
+
+class TestDuplicateTweets(object):
+    @classmethod
+    def setup_class(cls):
+        cls.config = Configurer()
+        cls.server = MockTwitterServer(('localhost', 0))
+        cls.server.start()
+        db.create_tables()
+
+    def setup(self):
+        self.config.update({
+            'ckanext.twitter.debug': 'false',
+            'ckanext.twitter.api_url': self.server.url,
+            'ckanext.twitter.hours_between_tweets': 0
+            })
+        duplicates.get_index().clear()
+        self.server.stats(reset = True)
+        api_limits.get_budget().clear()
+        cache_helpers.reset_cache()
+        history.clear()
+
+    def teardown(self):
+        self.config.reset()
+
+    @classmethod
+    def teardown_class(cls):
+        cls.server.shutdown()
+        cls.server.server_close()
+        transport.set_transport(None)
+        cls.config.reset()
+
+    def test_rejects_same_text(self):
+        eq_(twitter_api.post_tweet(u'a tweet', 'package-a'), (True, '200 OK'))
+        eq_(twitter_api.post_tweet(u'a tweet', 'package-b'),
+            (False, twitter_api.duplicate_reason))
+        eq_(twitter_api.post_tweet(u'another tweet', 'package-b'),
+            (True, '200 OK'))
+        eq_(self.server.stats()['requests'].get(update_path + ' 200'), 2)
+
+    def test_window_can_be_turned_off(self):
+        self.config.update({
+            'ckanext.twitter.duplicate_window': 0
+            })
+        eq_(twitter_api.post_tweet(u'a tweet', 'package-a'), (True, '200 OK'))
+        eq_(twitter_api.post_tweet(u'a tweet', 'package-b'), (True, '200 OK'))
@@ -1,13 +1,34 @@
+import ckan.model as model
+import ckan.new_tests.helpers as helpers
 import ckan.plugins as p
+import mock
 import nose
+from ckan.logic import get_action
 from ckan.tests.pylons_controller import PylonsTestCase
 from ckanext.twitter.lib import (cache_helpers, parsers as twitter_parsers,
-                                 twitter_api)
+                                 previews, twitter_api)
+from ckanext.twitter.lib.helpers import TwitterJSHelpers
 from ckanext.twitter.tests.helpers import Configurer, DataFactory
 
 eq_ = nose.tools.eq_
 
 
+class ActionCounter(object):
+    '''
+    Wraps get_action so that calls to each action can be counted.
+    '''
+
+    def __init__(self):
+        self.calls = []
+
+    def __call__(self, action_name):
+        self.calls.append(action_name)
+        return get_action(action_name)
+
+    def count(self, action_name):
+        return self.calls.count(action_name)
+
+
 class TestTweetGeneration(PylonsTestCase):
     @classmethod
     def setup_class(cls):
@@ -161,3 +182,106 @@ class TestTweetGeneration(PylonsTestCase):
                                                  pkg_dict['id'])
         eq_(tweeted, False)
         eq_(reason, 'not authenticated')
+
+    def test_template_is_compiled_once(self):
+        twitter_parsers.reset_template_cache()
+        format_string = '{{ title }} has {{ records }} records.'
+        template = twitter_parsers.get_template(format_string)
+        eq_(twitter_parsers.get_template(format_string), template)
+
+    def test_template_finds_all_variables(self):
+        template = twitter_parsers.get_template(
+                '{{ title }}{% if records != 0 %} (updated){% endif %}')
+        eq_(template.tokens, ('title',))
+        eq_(template.variables, frozenset(['title', 'records']))
+        eq_(template.static_length, len(' (updated)'))
+
+    def test_generation_shows_package_once(self):
+        counter = ActionCounter()
+        with mock.patch('ckanext.twitter.lib.parsers.get_action', counter):
+            twitter_parsers.generate_tweet(self.df.context,
+                                           self.df.public_records['id'],
+                                           is_new = True)
+        eq_(counter.count('package_show'), 1)
+
+    def test_generation_uses_loaded_package(self):
+        counter = ActionCounter()
+        pkg_dict = self.df.public_records
+        with mock.patch('ckanext.twitter.lib.parsers.get_action', counter):
+            tweet_text = twitter_parsers.generate_tweet(self.df.context,
+                                                        pkg_dict['id'],
+                                                        is_new = True,
+                                                        pkg_dict = pkg_dict)
+        eq_(counter.count('package_show'), 0)
+        assert tweet_text is not None
+
+    def test_generates_tweets_in_batch(self):
+        self.config.remove(['ckanext.twitter.new'])
+        public_id = self.df.public_records['id']
+        private_id = self.df.private_records['id']
+        tweets = helpers.call_action('twitter_generate_tweets',
+                                     ids = [public_id, private_id,
+                                            'not-a-real-id'],
+                                     is_new = True)
+        eq_(tweets[public_id], 'New dataset: "A test package" by Author (5 '
+                               'records).')
+        eq_(tweets[private_id], None)
+        eq_(tweets['not-a-real-id'], None)
+
+    def test_batch_rejects_invalid_ids(self):
+        public_id = self.df.public_records['id']
+        with nose.tools.assert_raises(p.toolkit.ValidationError):
+            helpers.call_action('twitter_generate_tweets',
+                                ids = [public_id, '") OR id:(*'])
+
+    def test_get_tweet_uses_preview(self):
+        pkg_dict = self.df.public_records
+        tweet_text = previews.generate(self.df.context, pkg_dict['id'])
+        with mock.patch('ckanext.twitter.lib.parsers.generate_tweet') as gen:
+            eq_(TwitterJSHelpers().get_tweet(pkg_dict['id'], pkg_dict),
+                tweet_text)
+        eq_(gen.called, False)
+
+    def test_get_tweet_ignores_outdated_preview(self):
+        pkg_dict = dict(self.df.public_records)
+        previews.generate(self.df.context, pkg_dict['id'])
+        pkg_dict['metadata_modified'] = '2000-01-01T00:00:00'
+        eq_(previews.get(pkg_dict), None)
+
+    def test_preview_only_scheduled_after_commit(self):
+        pkg_id = self.df.public_records['id']
+        with mock.patch.object(previews, '_get_pool') as get_pool:
+            previews.schedule(self.df.context, pkg_id)
+            model.Session.rollback()
+            model.Session.commit()
+            eq_(get_pool.return_value.apply_async.called, False)
+            previews.schedule(self.df.context, pkg_id)
+            model.Session.commit()
+            eq_(get_pool.return_value.apply_async.call_count, 1)
+
+
+class TestTruncation(object):
+    def test_truncates_field_at_word_boundary(self):
+        eq_(twitter_parsers.truncate_field('one two three four', 14),
+            'one two[...]')
+
+    def test_truncates_field_without_spaces(self):
+        eq_(twitter_parsers.truncate_field('abcdefghij', 8), 'abc[...]')
+
+    def test_truncates_long_field(self):
+        notes = ' '.join(['word'] * 10000)
+        truncated = twitter_parsers.truncate_field(notes, 50)
+        assert len(truncated) <= 50
+        assert truncated.endswith('[...]')
+
+    def test_shortens_single_author(self):
+        eq_(twitter_parsers.truncate_author('Waylon Dalton'), 'Dalton')
+
+    def test_shortens_multiple_authors(self):
+        eq_(twitter_parsers.truncate_author('Waylon Dalton; Justine '
+                                            'Henderson; Abdullah Lang'),
+            'Dalton et al.')
+
+    def test_shortens_author_without_first_name(self):
+        eq_(twitter_parsers.truncate_author('Dalton; Henderson'),
+            'Dalton et al.')
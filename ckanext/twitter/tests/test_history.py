@@ -0,0 +1,121 @@
+import json
+
+import ckan.model as model
+import ckan.plugins
+import mock
+import nose
+from ckan.lib.helpers import url_for
+from ckan.logic import ValidationError
+from ckan.new_tests import factories, helpers
+from ckanext.twitter.lib import cache_helpers, db, history
+from ckanext.twitter.tests.helpers import Configurer
+from sqlalchemy.exc import ProgrammingError
+
+eq_ = nose.tools.eq_
+
+
+class TestHistory(object):
+    @classmethod
+    def setup_class(cls):
+        cls.config = Configurer()
+        cls.app = helpers._get_test_app()
+        ckan.plugins.load('twitter')
+        db.create_tables()
+
+    def setup(self):
+        history.clear()
+        cache_helpers.reset_cache()
+
+    @classmethod
+    def teardown_class(cls):
+        cls.config.reset()
+        history.clear()
+        ckan.plugins.unload('twitter')
+        helpers.reset_db()
+
+    def test_posted_tweet_starts_rest_period(self):
+        eq_(cache_helpers.expired('package-a'), True)
+        history.record('package-a', u'a tweet', history.status_posted, u'1')
+        eq_(cache_helpers.expired('package-a'), False)
+        # even if the store has forgotten about it
+        cache_helpers.reset_cache()
+        eq_(cache_helpers.reserve('package-a'), False)
+
+    def test_missing_table_created_on_startup(self):
+        # as if the extension had been upgraded without running initdb
+        history.history_table.drop(model.meta.engine)
+        eq_(db.missing_tables(), [history.history_table.name])
+        plugin = ckan.plugins.get_plugin('twitter')
+        plugin.configure(self.config.current)
+        eq_(db.missing_tables(), [])
+        eq_(cache_helpers.reserve('package-a'), True)
+
+    def test_startup_survives_failing_table_check(self):
+        plugin = ckan.plugins.get_plugin('twitter')
+        error = ProgrammingError('SELECT', {}, Exception('permission denied'))
+        with mock.patch.object(db, 'missing_tables', side_effect = error):
+            plugin.configure(self.config.current)
+
+    def test_failed_tweet_does_not_start_rest_period(self):
+        history.record('package-a', u'a tweet', history.status_failed)
+        eq_(cache_helpers.expired('package-a'), True)
+        eq_(cache_helpers.reserve('package-a'), True)
+
+    def test_hashes_text(self):
+        history.record('package-a', u'a tweet', history.status_posted, u'1')
+        row = history.for_package('package-a')[0]
+        eq_(row['text_hash'], history.text_hash(u'a tweet'))
+        eq_(row['tweet_id'], u'1')
+
+    def test_exports_in_batches(self):
+        for i in range(5):
+            history.record('package-{0}'.format(i % 2), u'tweet {0}'.format(i),
+                           history.status_posted, unicode(i))
+        history.export_batch_size = 2
+        try:
+            rows = list(history.export())
+            eq_([row['tweet_id'] for row in rows], [u'0', u'1', u'2', u'3',
+                                                    u'4'])
+            page = list(history.export(after = rows[1]['id'], limit = 2))
+            eq_([row['tweet_id'] for row in page], [u'2', u'3'])
+            eq_(len(list(history.export(pkg_id = 'package-1'))), 2)
+        finally:
+            history.export_batch_size = 1000
+
+    def test_export_is_sysadmin_only(self):
+        url = url_for('twitter_history')
+        self.app.get(url, status = 403)
+        sysadmin = factories.Sysadmin()
+        history.record('package-a', u'a tweet', history.status_posted, u'1')
+        response = self.app.get(url, extra_environ = {
+            'REMOTE_USER': str(sysadmin['name'])
+            })
+        lines = response.body.splitlines()
+        eq_(len(lines), 1)
+        eq_(json.loads(lines[0])['package_id'], 'package-a')
+
+    def test_export_checks_params(self):
+        url = url_for('twitter_history')
+        environ = {
+            'REMOTE_USER': str(factories.Sysadmin()['name'])
+            }
+        response = self.app.get(url, {
+            'after': -1
+            }, extra_environ = environ, status = 400)
+        assert 'after must be at least 0' in response.body
+        response = self.app.get(url, {
+            'limit': 0
+            }, extra_environ = environ, status = 400)
+        assert 'limit must be between 1 and 100000' in response.body
+
+    def test_tweet_history_limit_is_checked(self):
+        context = {
+            'user': factories.Sysadmin()['name']
+            }
+        for limit in [-1, 0, 101]:
+            nose.tools.assert_raises(ValidationError,
+                                     helpers.call_action,
+                                     'twitter_tweet_history', context,
+                                     package_id = 'package-a', limit = limit)
+        eq_(helpers.call_action('twitter_tweet_history', context,
+                                package_id = 'package-a', limit = 100), [])
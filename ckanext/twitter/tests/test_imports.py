@@ -0,0 +1,74 @@
+import json
+import os
+import subprocess
+import sys
+
+import nose
+from nose.plugins.attrib import attr
+
+eq_ = nose.tools.eq_
+
+# the most time loading the plugin (once CKAN itself is loaded) can add to a
+# process's startup; slower machines (e.g. shared CI runners) can allow more
+import_budget = float(os.environ.get('CKANEXT_TWITTER_IMPORT_BUDGET', 0.1))
+
+# modules that are only needed to post tweets
+posting_modules = ['oauth2', 'httplib2', 'ckanext.twitter.lib.transport',
+                   'ckanext.twitter.lib.twitter_api']
+
+# loads what CKAN loads anyway first, then times loading what the plugin
+# needs to render pages
+_script = '''
+import json, sys, time
+import pkg_resources, jinja2, sqlalchemy.dialects.postgresql
+import ckan.logic, ckan.model, ckan.plugins, ckan.common
+start = time.time()
+import ckanext.twitter.plugin
+import ckanext.twitter.lib.helpers
+import ckanext.twitter.logic.action
+elapsed = time.time() - start
+print json.dumps({
+    'seconds': elapsed,
+    'modules': sorted(sys.modules)
+    })
+'''
+
+
+# loads the paster commands, which generate tweets without posting them
+# unless asked to
+_command_script = '''
+import json, sys
+import ckanext.twitter.commands
+print json.dumps({
+    'modules': sorted(sys.modules)
+    })
+'''
+
+
+def _import_plugin(script = _script):
+    '''
+    Imports the plugin in a fresh interpreter, so nothing loaded by other
+    tests is counted.
+    :param script: The code to run.
+    :return: dict
+    '''
+    output = subprocess.check_output([sys.executable, '-c', script])
+    return json.loads(output.strip().splitlines()[-1])
+
+
+class TestImports(object):
+    def test_rendering_does_not_load_api_client(self):
+        loaded = _import_plugin()['modules']
+        eq_([name for name in posting_modules if name in loaded], [])
+
+    def test_commands_do_not_load_api_client(self):
+        loaded = _import_plugin(_command_script)['modules']
+        eq_([name for name in posting_modules if name in loaded], [])
+
+    @attr('benchmark')
+    def test_import_time_within_budget(self):
+        # the best of a few runs, so a busy machine doesn't fail the test
+        seconds = min(_import_plugin()['seconds'] for i in range(3))
+        assert seconds < import_budget, \
+            'importing the plugin took {0:.3f}s (budget {1}s)'.format(
+                    seconds, import_budget)
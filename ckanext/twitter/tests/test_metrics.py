@@ -0,0 +1,39 @@
+import nose
+from ckanext.twitter.lib import metrics
+
+eq_ = nose.tools.eq_
+
+
+class TestMetrics(object):
+    def setup(self):
+        metrics.enabled = True
+        metrics.reset()
+
+    def teardown(self):
+        metrics.enabled = False
+        metrics.reset()
+
+    def test_counts(self):
+        metrics.rest_period_rejections.inc()
+        metrics.rest_period_rejections.inc()
+        assert 'ckanext_twitter_rest_period_rejections_total 2.0' in \
+               metrics.exposition()
+
+    def test_observes_histogram(self):
+        metrics.api_request_seconds.observe(0.02, endpoint = 'test',
+                                            status = 200)
+        text = metrics.exposition()
+        assert 'ckanext_twitter_api_request_seconds_bucket{endpoint="test",' \
+               'le="0.01",status="200"} 0.0' in text
+        assert 'ckanext_twitter_api_request_seconds_bucket{endpoint="test",' \
+               'le="0.025",status="200"} 1.0' in text
+        assert 'ckanext_twitter_api_request_seconds_count{endpoint="test",' \
+               'status="200"} 1.0' in text
+
+    def test_records_nothing_when_disabled(self):
+        metrics.enabled = False
+        metrics.rest_period_rejections.inc()
+        with metrics.after_update_seconds.time():
+            pass
+        eq_(metrics.rest_period_rejections.samples(), [])
+        eq_(metrics.after_update_seconds.samples(), [])
@@ -0,0 +1,91 @@
+import time
+
+import nose
+from ckanext.twitter.lib import api_limits, transport, twitter_api
+from ckanext.twitter.tests.helpers import Configurer
+from ckanext.twitter.tests.mock_twitter import (MockTwitterServer,
+                                                update_path, verify_path)
+
+eq_ = nose.tools.eq_
+
+
+class TestMockTwitter(object):
+    @classmethod
+    def setup_class(cls):
+        cls.config = Configurer()
+        cls.server = MockTwitterServer(('localhost', 0), limits = {
+            update_path: 2
+            })
+        cls.server.start()
+
+    def setup(self):
+        api_limits.get_budget().clear()
+        self.api = transport.OAuthTransport(self.server.url, 5)
+
+    @classmethod
+    def teardown_class(cls):
+        cls.server.shutdown()
+        cls.server.server_close()
+        api_limits.get_budget().clear()
+        cls.config.reset()
+
+    def test_verifies_credentials(self):
+        response, content = self.api.request('GET', verify_path)
+        eq_(response.status, 200)
+
+    def test_posts_until_rate_limited(self):
+        for i in range(2):
+            response, content = self.api.request('POST', update_path, {
+                'status': 'tweet {0}'.format(i)
+                })
+            eq_(response.status, 200)
+        eq_(response['x-rate-limit-remaining'], '0')
+        # the transport stops before sending a request over the limit
+        nose.tools.assert_raises(api_limits.BudgetExceeded,
+                                 self.api.request, 'POST', update_path, {
+                                     'status': 'tweet 2'
+                                     })
+        eq_(self.server.stats()['requests'], {
+            update_path + ' 200': 2
+            })
+
+
+class TestDeadline(object):
+    @classmethod
+    def setup_class(cls):
+        cls.config = Configurer()
+        cls.server = MockTwitterServer(('localhost', 0), latency = 2)
+        cls.server.start()
+
+    def setup(self):
+        self.config.update({
+            'ckanext.twitter.api_url': self.server.url,
+            'ckanext.twitter.timeout': 10
+            })
+        api_limits.get_budget().clear()
+        self.server.stats(reset = True)
+
+    def teardown(self):
+        twitter_api.breaker.configure(0.5, 5, 60, 30)
+        self.config.reset()
+
+    @classmethod
+    def teardown_class(cls):
+        cls.server.shutdown()
+        cls.server.server_close()
+        transport.set_transport(None)
+        cls.config.reset()
+
+    def test_request_times_out_at_deadline(self):
+        start = time.time()
+        nose.tools.assert_raises(transport.TransportError,
+                                 twitter_api._request, 'GET', verify_path,
+                                 deadline = start + 0.3)
+        # well before the response (or the configured timeout) would come
+        assert time.time() - start < 1
+
+    def test_no_request_after_deadline(self):
+        nose.tools.assert_raises(transport.TransportError,
+                                 twitter_api._request, 'GET', verify_path,
+                                 deadline = time.time() - 1)
+        eq_(self.server.stats()['requests'], {})
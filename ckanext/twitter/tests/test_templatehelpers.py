@@ -1,8 +1,15 @@
+import ckan.model as model
 import ckan.plugins as p
+import mock
 import nose
-from ckan.common import session
+from ckan.logic import get_action
+from ckan.new_tests import factories
 from ckan.tests.pylons_controller import PylonsTestCase
-from ckanext.twitter.lib.helpers import TwitterJSHelpers, twitter_pkg_suitable
+from ckanext.twitter.lib import db, markers, pending
+from ckanext.twitter.lib.helpers import (TwitterJSHelpers,
+                                         twitter_pkg_dict_suitable,
+                                         twitter_pkg_is_new,
+                                         twitter_pkg_suitable)
 from ckanext.twitter.tests.helpers import Configurer, DataFactory
 
 eq_ = nose.tools.eq_
@@ -31,16 +38,75 @@ class TestGetConfigVariables(PylonsTestCase):
     def test_gets_context(self):
         assert isinstance(self.js_helpers.context, dict)
 
-    def test_returns_false_if_not_in_session(self):
-        session.clear()
-        eq_(self.js_helpers.tweet_ready(self.df.public_no_records['id']),
-            False)
+    def test_returns_false_if_not_pending(self):
+        pending.clear()
+        with mock.patch('ckan.plugins.toolkit.c') as c:
+            c.user = self.df.sysadmin['name']
+            eq_(self.js_helpers.tweet_ready(self.df.public_no_records['id']),
+                False)
+
+    def test_returns_true_once_if_pending(self):
+        pending.mark(self.df.sysadmin['name'],
+                     self.df.public_no_records['id'])
+        model.Session.commit()
+        with mock.patch('ckan.plugins.toolkit.c') as c:
+            c.user = self.df.sysadmin['name']
+            eq_(self.js_helpers.tweet_ready(self.df.public_no_records['id']),
+                True)
+            eq_(self.js_helpers.tweet_ready(self.df.public_no_records['id']),
+                False)
+
+    def test_rolled_back_update_not_pending(self):
+        pending.clear()
+        pending.mark(self.df.sysadmin['name'],
+                     self.df.public_no_records['id'])
+        model.Session.rollback()
+        eq_(pending.pop(self.df.sysadmin['name'],
+                        self.df.public_no_records['id']), False)
+
+    def test_anonymous_never_ready(self):
+        pending.mark(self.df.sysadmin['name'],
+                     self.df.public_no_records['id'])
+        model.Session.commit()
+        with mock.patch('ckan.plugins.toolkit.c') as c, \
+                mock.patch.object(pending, 'pop') as pop:
+            c.user = ''
+            eq_(self.js_helpers.tweet_ready(self.df.public_no_records['id']),
+                False)
+            eq_(pop.call_count, 0)
+        pending.clear()
+
+    def test_only_editors_check_pending(self):
+        user = factories.User()
+        pending.mark(user['name'], self.df.public_no_records['id'])
+        model.Session.commit()
+        with mock.patch('ckan.plugins.toolkit.c') as c, \
+                mock.patch.object(pending, 'pop') as pop:
+            c.user = user['name']
+            eq_(self.js_helpers.tweet_ready(self.df.public_no_records['id']),
+                False)
+            eq_(pop.call_count, 0)
+        pending.clear()
+
+    def test_web_updates_are_pending(self):
+        context = dict(self.df.context)
+        pkg_dict = get_action('package_show')(context, {
+            'id': self.df.public_records['id']
+            })
+        with mock.patch.object(pending, 'mark') as mark:
+            get_action('package_update')(context, pkg_dict)
+        mark.assert_called_once_with(self.df.sysadmin['name'], pkg_dict['id'])
+        self.df.refresh()
 
-    def test_returns_true_if_is_in_session(self):
-        session.setdefault('twitter_is_suitable',
-                           self.df.public_no_records['id'])
-        session.save()
-        eq_(self.js_helpers.tweet_ready(self.df.public_no_records['id']), True)
+    def test_api_updates_are_not_pending(self):
+        pending.clear()
+        context = dict(self.df.context, api_version = 3)
+        pkg_dict = get_action('package_show')(context, {
+            'id': self.df.public_records['id']
+            })
+        get_action('package_update')(context, pkg_dict)
+        eq_(pending.pop(self.df.sysadmin['name'], pkg_dict['id']), False)
+        self.df.refresh()
 
     def test_gets_tweet(self):
         self.config.remove(['ckanext.twitter.new'])
@@ -161,3 +227,79 @@ class TestGetConfigVariables(PylonsTestCase):
         is_suitable = twitter_pkg_suitable(self.df.context,
                                            self.df.public_records['id'])
         eq_(is_suitable, True)
+
+    def test_dict_suitable_without_lookup(self):
+        self.df.reload_pkg_dicts()
+        with mock.patch('ckan.model.Package.get') as get_package:
+            is_suitable = twitter_pkg_dict_suitable(self.df.context,
+                                                    self.df.public_records)
+            eq_(get_package.call_count, 0)
+        eq_(is_suitable, True)
+
+    def test_dict_suitable_fills_missing_fields(self):
+        self.df.reload_pkg_dicts()
+        pkg_dict = {
+            'id': self.df.public_records['id'],
+            'state': 'active'
+            }
+        eq_(twitter_pkg_dict_suitable(self.df.context, pkg_dict), True)
+        pkg_dict['id'] = self.df.private_records['id']
+        eq_(twitter_pkg_dict_suitable(self.df.context, pkg_dict), False)
+
+    def test_dict_not_suitable_if_does_not_exist(self):
+        eq_(twitter_pkg_dict_suitable(self.df.context, {
+            'id': 'not-a-real-id'
+            }), False)
+
+    def test_new_until_updated(self):
+        self.df.refresh()
+        pkg_id = self.df.public_records['id']
+        eq_(twitter_pkg_is_new(self.df.context, pkg_id), True)
+        pkg_dict = get_action('package_show')(self.df.context, {
+            'id': pkg_id
+            })
+        pkg_dict['notes'] = 'these are some updated notes'
+        get_action('package_update')(self.df.context, pkg_dict)
+        eq_(twitter_pkg_is_new(self.df.context, pkg_id), False)
+        self.df.refresh()
+
+    def test_is_new_many_matches_is_new(self):
+        self.df.refresh()
+        pkg_ids = [self.df.public_records['id'],
+                   self.df.public_no_records['id'], 'not-a-real-id']
+        eq_(markers.is_new_many(pkg_ids),
+            {pkg_id: markers.is_new(pkg_id) for pkg_id in pkg_ids})
+
+    def test_marks_rolled_back_with_package_changes(self):
+        pkg_id = self.df.public_records['id']
+
+        def first_published():
+            return db.execute(markers.marker_table.select().where(
+                markers.marker_table.c.package_id == pkg_id)).first()[
+                'first_published']
+
+        markers.clear()
+        markers.mark_unpublished(pkg_id)
+        model.Session.commit()
+        markers.mark_published(pkg_id)
+        model.Session.rollback()
+        eq_(first_published(), None)
+        # not skipped because of the rolled back mark
+        markers.mark_published(pkg_id)
+        model.Session.commit()
+        assert first_published() is not None
+        self.df.refresh()
+
+    def test_not_new_if_published_before_install(self):
+        self.df.refresh()
+        pkg_id = self.df.public_records['id']
+        # as if the package had been published before the plugin was
+        # installed
+        markers.clear()
+        pkg_dict = get_action('package_show')(self.df.context, {
+            'id': pkg_id
+            })
+        pkg_dict['notes'] = 'these are some updated notes'
+        get_action('package_update')(self.df.context, pkg_dict)
+        eq_(twitter_pkg_is_new(self.df.context, pkg_id), False)
+        self.df.refresh()
@@ -18,14 +18,14 @@ ckan.module('confirm-tweet', function ($, _) {
                                    form.serialize(),
                                    function (results) {
                                        self.modal.modal('hide');
-                                       if (results === undefined || results === null) {
-                                           self.flash_error('Tweet not posted due to unknown error.');
-                                       }
-                                       else if (!results.success) {
-                                           self.flash_error('Tweet not posted! Error message: "' + results.reason + '".<br>Your tweet: "' + results.tweet + '".');
+                                       if (results && results.queued) {
+                                           if (results.reason === 'scheduled') {
+                                               self.flash_success('The Twitter rate limit has been reached, so your tweet will be posted in ' + Math.max(Math.ceil((results.scheduled_for - Date.now() / 1000) / 60), 1) + ' minute(s).');
+                                           }
+                                           self._poll(url + '/' + results.job_id, results.tweet);
                                        }
                                        else {
-                                           self.flash_success('Tweet posted!<br>Your tweet: "' + results.tweet + '"')
+                                           self._onResults(results);
                                        }
                                    },
                                    'json'
@@ -35,6 +35,41 @@ ckan.module('confirm-tweet', function ($, _) {
                         self.modal.modal().appendTo(self.sandbox.body);
                     },
 
+                    _onResults: function (results) {
+                        if (results === undefined || results === null) {
+                            self.flash_error('Tweet not posted due to unknown error.');
+                        }
+                        else if (results.deferred) {
+                            self.flash_error('Tweet not posted because Twitter is not responding. Please try again in ' + Math.max(Math.ceil(results.retry_after / 60), 1) + ' minute(s).<br>Your tweet: "' + results.tweet + '".');
+                        }
+                        else if (!results.success) {
+                            self.flash_error('Tweet not posted! Error message: "' + results.reason + '".<br>Your tweet: "' + results.tweet + '".');
+                        }
+                        else {
+                            self.flash_success('Tweet posted!<br>Your tweet: "' + results.tweet + '"')
+                        }
+                    },
+
+                    _poll: function (statusUrl, tweet) {
+                        $.getJSON(statusUrl, function (job) {
+                            if (job.status === 'scheduled' || job.status === 'queued' || job.status === 'started') {
+                                setTimeout(function () {
+                                    self._poll(statusUrl, tweet);
+                                }, self.options.poll_interval || 2000);
+                            }
+                            else {
+                                self._onResults(job);
+                            }
+                        }).fail(function (xhr) {
+                            // e.g. 403 if the session has ended; the outcome of the tweet isn't known
+                            self._onResults({
+                                success: false,
+                                reason:  'could not check the status of the tweet (' + xhr.status + ' ' + xhr.statusText + ')',
+                                tweet:   tweet
+                            });
+                        });
+                    },
+
                     flash: function (message, category) {
                         $('.flash-messages').append('<div class="alert ' + category + '">' + message + '</div>');
                     },
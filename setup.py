@@ -22,5 +22,9 @@ setup(
         """
             [ckan.plugins]
             twitter=ckanext.twitter.plugin:TwitterPlugin
+            twitter_resources=ckanext.twitter.plugin:TwitterResourcePlugin
+
+            [paste.paster_command]
+            twitter=ckanext.twitter.commands:TwitterCommand
         """,
 )